@@ -9,6 +9,7 @@ from typing import List, Dict, Any, Optional
 from sqlalchemy import func, and_, or_
 from app import db
 from models import User, TimeEntry, Schedule, LeaveApplication, PayRule, PayCalculation
+from attendance_stats import recent_attendance_statistics
 
 
 class WFMFallbackIntelligence:
@@ -109,8 +110,8 @@ class WFMFallbackIntelligence:
         try:
             # Get time entries for the period
             time_entries = TimeEntry.query.filter(
-                func.date(TimeEntry.clock_in_time) >= pay_period_start,
-                func.date(TimeEntry.clock_in_time) <= pay_period_end,
+                TimeEntry.work_date >= pay_period_start,
+                TimeEntry.work_date <= pay_period_end,
                 TimeEntry.total_hours.isnot(None)
             ).all()
             
@@ -212,20 +213,10 @@ class WFMFallbackIntelligence:
     def analyze_attendance_patterns(self, employee_id: Optional[int] = None, days: int = 30) -> Dict[str, Any]:
         """Analyze attendance patterns using statistical methods"""
         try:
-            end_date = date.today()
-            start_date = end_date - timedelta(days=days)
-            
-            query = TimeEntry.query.filter(
-                func.date(TimeEntry.clock_in_time) >= start_date,
-                func.date(TimeEntry.clock_in_time) <= end_date
-            )
-            
-            if employee_id:
-                query = query.filter(TimeEntry.user_id == employee_id)
-            
-            entries = query.all()
+            stats = recent_attendance_statistics(days, user_ids=[employee_id] if employee_id else None)
+            overall = stats.overall
             
-            if not entries:
+            if not stats.total_entries:
                 return {
                     'success': True,
                     'insights': {
@@ -235,37 +226,17 @@ class WFMFallbackIntelligence:
                     }
                 }
             
-            # Pattern analysis
-            daily_attendance = {}
-            late_arrivals = 0
-            early_departures = 0
-            employee_attendance = {}
-            
-            for entry in entries:
-                day = entry.clock_in_time.date()
-                daily_attendance[day] = daily_attendance.get(day, 0) + 1
-                
-                # Employee tracking
-                emp_id = entry.user_id
-                employee_attendance[emp_id] = employee_attendance.get(emp_id, 0) + 1
-                
-                # Late arrival check (after 9 AM)
-                if entry.clock_in_time.hour > 9:
-                    late_arrivals += 1
-                
-                # Early departure check (before 5 PM if clock out exists)
-                if entry.clock_out_time and entry.clock_out_time.hour < 17:
-                    early_departures += 1
-            
-            # Calculate insights
-            avg_daily_attendance = sum(daily_attendance.values()) / len(daily_attendance) if daily_attendance else 0
-            total_entries = len(entries)
-            late_percentage = (late_arrivals / total_entries * 100) if total_entries > 0 else 0
+            avg_daily_attendance = (sum(stats.daily_headcount.values()) / len(stats.daily_headcount)
+                                    if stats.daily_headcount else 0)
+            late_percentage = overall.lateness_rate * 100
+            absence_percentage = overall.absence_rate * 100
             
             patterns = [
-                f"Total attendance entries: {total_entries}",
+                f"Total attendance entries: {stats.total_entries}",
                 f"Average daily attendance: {avg_daily_attendance:.1f}",
-                f"Late arrivals: {late_percentage:.1f}%"
+                f"Late arrivals: {late_percentage:.1f}%",
+                f"Absence rate: {absence_percentage:.1f}%",
+                f"Average daily hours: {overall.avg_daily_hours:.1f} (std dev {overall.hours_variance ** 0.5:.1f})"
             ]
             
             risk_factors = []
@@ -273,12 +244,18 @@ class WFMFallbackIntelligence:
                 risk_factors.append("High rate of late arrivals detected")
             if avg_daily_attendance < 5:
                 risk_factors.append("Low daily attendance rates")
+            if absence_percentage > 10:
+                risk_factors.append("Absence rate above 10%")
+            if overall.overtime_trend > 1:
+                risk_factors.append("Overtime is increasing week over week")
             
             recommendations = []
             if late_percentage > 15:
                 recommendations.append("Consider reviewing arrival time policies")
-            if len(employee_attendance) < 10:
+            if len(stats.employees) < 10:
                 recommendations.append("Encourage more employees to use time tracking")
+            if overall.overtime_trend > 1:
+                recommendations.append("Review staffing levels to curb rising overtime")
             
             return {
                 'success': True,
@@ -286,7 +263,8 @@ class WFMFallbackIntelligence:
                     'patterns': patterns,
                     'risk_factors': risk_factors or ['No significant risk factors detected'],
                     'recommendations': recommendations or ['Attendance patterns appear normal'],
-                    'period_summary': f"Analysis of {days} days ending {end_date}"
+                    'period_summary': f"Analysis of {days} days ending {stats.end_date}",
+                    'metrics': overall.to_dict()
                 }
             }
             
@@ -4,17 +4,31 @@ Provides intelligent schedule optimization, availability matching, and automated
 """
 
 from datetime import datetime, timedelta, time
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, abort
 from flask_login import login_required, current_user
 from sqlalchemy import and_, or_, func
 from app import db
-from models import User, Schedule, TimeEntry, LeaveApplication, Department
+from models import User, Schedule, TimeEntry, LeaveApplication, Department, ScheduleGenerationJob
 from auth_simple import role_required
+from scheduling_features import availability_feature_store
+from schedule_jobs import submit_schedule_job, cancel_schedule_job, apply_schedule_job, expire_orphaned_job, COMPLETED
+from schedule_optimizer import ShiftAssignmentOptimizer, shift_duration_hours
 import logging
 
 # Create blueprint for AI scheduling
 ai_scheduling_bp = Blueprint('ai_scheduling', __name__, url_prefix='/ai-scheduling')
 
+class GenerationCancelled(Exception):
+    """Raised from a progress callback to abandon a schedule generation run"""
+
+
+# Standard shifts and the head count each one needs per day
+STANDARD_SHIFTS = [
+    {'name': 'Morning', 'start': time(9, 0), 'end': time(17, 0), 'time_slot': '09:00-17:00', 'required': 3},
+    {'name': 'Evening', 'start': time(17, 0), 'end': time(1, 0), 'time_slot': '17:00-01:00', 'required': 2},
+    {'name': 'Night', 'start': time(1, 0), 'end': time(9, 0), 'time_slot': '01:00-09:00', 'required': 1}
+]
+
 class SchedulingAI:
     """
     Core AI scheduling engine for intelligent workforce management
@@ -22,57 +36,35 @@ class SchedulingAI:
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        self.optimizer = ShiftAssignmentOptimizer(STANDARD_SHIFTS)
     
     def analyze_employee_availability(self, employee_id, start_date, end_date):
         """
         Analyze employee availability patterns and constraints
         """
         try:
-            # Get employee's historical schedule patterns
-            historical_schedules = Schedule.query.filter(
-                and_(
-                    Schedule.user_id == employee_id,
-                    Schedule.start_time >= start_date - timedelta(days=30),
-                    Schedule.start_time <= start_date
-                )
-            ).all()
+            availability = availability_feature_store.get_features([employee_id]).get(employee_id)
+            if availability is None:
+                return None
             
-            # Get leave applications for the period
-            leave_applications = LeaveApplication.query.filter(
-                and_(
-                    LeaveApplication.user_id == employee_id,
-                    LeaveApplication.start_date <= end_date,
-                    LeaveApplication.end_date >= start_date,
-                    LeaveApplication.status.in_(['Approved', 'Pending'])
-                )
-            ).all()
-            
-            # Get time entry patterns for preferred working hours
-            time_entries = TimeEntry.query.filter(
-                and_(
-                    TimeEntry.user_id == employee_id,
-                    TimeEntry.clock_in_time >= start_date - timedelta(days=60)
-                )
-            ).all()
-            
-            availability_data = {
-                'employee_id': employee_id,
-                'historical_patterns': self._analyze_patterns(historical_schedules),
-                'leave_constraints': self._process_leave_constraints(leave_applications),
-                'preferred_hours': self._calculate_preferred_hours(time_entries),
-                'availability_score': self._calculate_availability_score(historical_schedules, leave_applications)
-            }
-            
-            return availability_data
+            availability['leave_constraints'] = availability_feature_store.get_leave_constraints(
+                [employee_id], start_date, end_date
+            ).get(employee_id, [])
+            return availability
             
         except Exception as e:
             self.logger.error(f"Error analyzing employee availability: {e}")
             return None
     
-    def generate_optimized_schedule(self, department_id=None, start_date=None, end_date=None):
+    def generate_optimized_schedule(self, department_id=None, start_date=None, end_date=None,
+                                    progress_callback=None):
         """
         Generate optimized schedule using AI algorithms
+        
+        progress_callback, if given, is called with a 0-100 percentage as the run
+        advances and may raise GenerationCancelled to stop it.
         """
+        report = progress_callback or (lambda percent: None)
         try:
             if not start_date:
                 start_date = datetime.now().date()
@@ -80,28 +72,39 @@ class SchedulingAI:
                 end_date = start_date + timedelta(days=7)
             
             # Get active employees
+            query = User.query.options(db.joinedload(User.employee_department))
             if department_id:
-                employees = User.query.filter(
+                employees = query.filter(
                     and_(
                         User.is_active == True,
-                        User.department == department_id
+                        User.department_id == department_id
                     )
                 ).all()
             else:
-                employees = User.query.filter_by(is_active=True).all()
+                employees = query.filter_by(is_active=True).all()
+            employee_info = {
+                employee.id: {
+                    'name': employee.full_name or employee.username,
+                    'department': employee.employee_department.name if employee.employee_department else 'Unknown Department'
+                }
+                for employee in employees
+            }
+            report(5)
             
-            # Analyze availability for all employees
-            employee_availability = {}
-            for employee in employees:
-                availability = self.analyze_employee_availability(
-                    employee.id, start_date, end_date
-                )
-                if availability:
-                    employee_availability[employee.id] = availability
+            # Read precomputed features and period leave for all employees in batch
+            employee_ids = [employee.id for employee in employees]
+            employee_availability = availability_feature_store.get_features(employee_ids)
+            leave_constraints = availability_feature_store.get_leave_constraints(
+                employee_ids, start_date, end_date
+            )
+            for employee_id, availability in employee_availability.items():
+                availability['leave_constraints'] = leave_constraints.get(employee_id, [])
+            report(30)
             
             # Generate schedule recommendations
             schedule_recommendations = self._optimize_schedule_distribution(
-                employee_availability, start_date, end_date
+                employee_availability, start_date, end_date, employee_info,
+                lambda done, total: report(30 + int(60 * done / total))
             )
             
             return {
@@ -111,115 +114,44 @@ class SchedulingAI:
                 'coverage_analysis': self._analyze_coverage(schedule_recommendations)
             }
             
+        except GenerationCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"Error generating optimized schedule: {e}")
             return {'success': False, 'error': str(e)}
     
-    def _analyze_patterns(self, schedules):
-        """Analyze historical scheduling patterns"""
-        patterns = {
-            'preferred_days': {},
-            'preferred_shifts': {},
-            'average_hours_per_week': 0
-        }
-        
-        if not schedules:
-            return patterns
-        
-        total_hours = 0
-        for schedule in schedules:
-            # Day preference analysis
-            day_of_week = schedule.start_time.weekday()
-            patterns['preferred_days'][day_of_week] = patterns['preferred_days'].get(day_of_week, 0) + 1
-            
-            # Shift time analysis
-            shift_hour = schedule.start_time.hour
-            patterns['preferred_shifts'][shift_hour] = patterns['preferred_shifts'].get(shift_hour, 0) + 1
-            
-            # Calculate hours
-            if schedule.end_time:
-                hours = (schedule.end_time - schedule.start_time).total_seconds() / 3600
-                total_hours += hours
-        
-        if schedules:
-            patterns['average_hours_per_week'] = total_hours / len(schedules) * 7
-        
-        return patterns
-    
-    def _process_leave_constraints(self, leave_applications):
-        """Process leave constraints for scheduling"""
-        constraints = []
-        
-        for leave in leave_applications:
-            constraints.append({
-                'start_date': leave.start_date,
-                'end_date': leave.end_date,
-                'type': leave.leave_type_id,
-                'status': leave.status
-            })
-        
-        return constraints
-    
-    def _calculate_preferred_hours(self, time_entries):
-        """Calculate preferred working hours based on clock-in patterns"""
-        hour_frequency = {}
-        
-        for entry in time_entries:
-            hour = entry.clock_in_time.hour
-            hour_frequency[hour] = hour_frequency.get(hour, 0) + 1
-        
-        if hour_frequency:
-            most_common_hour = max(hour_frequency, key=hour_frequency.get)
-            return {
-                'preferred_start_hour': most_common_hour,
-                'hour_distribution': hour_frequency
-            }
-        
-        return {'preferred_start_hour': 9, 'hour_distribution': {}}
-    
-    def _calculate_availability_score(self, schedules, leave_applications):
-        """Calculate overall availability score for employee"""
-        base_score = 100
-        
-        # Reduce score for frequent leave applications
-        if leave_applications:
-            leave_penalty = min(len(leave_applications) * 5, 30)
-            base_score -= leave_penalty
-        
-        # Increase score for consistent scheduling
-        if schedules:
-            consistency_bonus = min(len(schedules), 20)
-            base_score += consistency_bonus
-        
-        return max(0, min(base_score, 100))
-    
-    def _optimize_schedule_distribution(self, employee_availability, start_date, end_date):
+    def _optimize_schedule_distribution(self, employee_availability, start_date, end_date, employee_info,
+                                        progress_callback=None):
         """Optimize schedule distribution using AI algorithms"""
-        recommendations = []
+        days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
         
-        # Generate recommendations for each day in the period
-        current_date = start_date
-        while current_date <= end_date:
-            day_recommendations = self._generate_day_schedule(
-                employee_availability, current_date
+        # Solve the whole period as one matrix assignment when NumPy is installed
+        if self.optimizer.is_available():
+            assignments = self.optimizer.solve(
+                [employee_id for employee_id in employee_availability if employee_id in employee_info],
+                employee_availability, days, progress_callback
             )
-            recommendations.extend(day_recommendations)
-            current_date += timedelta(days=1)
+            return [
+                self._build_recommendation(employee_id, day, shift, score, priority, employee_info)
+                for employee_id, day, shift, score, priority in assignments
+            ]
+        
+        # Generate recommendations for each day in the period
+        recommendations = []
+        for day_index, current_date in enumerate(days):
+            recommendations.extend(self._generate_day_schedule(
+                employee_availability, current_date, employee_info
+            ))
+            if progress_callback:
+                progress_callback(day_index + 1, len(days))
         
         return recommendations
     
-    def _generate_day_schedule(self, employee_availability, target_date):
+    def _generate_day_schedule(self, employee_availability, target_date, employee_info):
         """Generate schedule recommendations for a specific day"""
         day_schedules = []
         
-        # Define standard shifts
-        shifts = [
-            {'name': 'Morning', 'start': time(9, 0), 'end': time(17, 0)},
-            {'name': 'Evening', 'start': time(17, 0), 'end': time(1, 0)},
-            {'name': 'Night', 'start': time(1, 0), 'end': time(9, 0)}
-        ]
-        
-        for shift in shifts:
+        for shift in STANDARD_SHIFTS:
             # Find best employees for this shift
             best_employees = self._rank_employees_for_shift(
                 employee_availability, target_date, shift
@@ -227,34 +159,33 @@ class SchedulingAI:
             
             # Assign top-ranked employees to shifts
             for i, (employee_id, score) in enumerate(best_employees[:3]):  # Top 3 employees
-                # Get employee details
-                employee = User.query.get(employee_id)
-                if employee:
-                    start_dt = datetime.combine(target_date, shift['start'])
-                    end_dt = datetime.combine(target_date, shift['end'])
-                    
-                    # Calculate hours (handle overnight shifts)
-                    if end_dt < start_dt:
-                        end_dt += timedelta(days=1)
-                    hours = (end_dt - start_dt).total_seconds() / 3600
-                    
-                    day_schedules.append({
-                        'employee_id': employee_id,
-                        'employee_name': employee.full_name or employee.username,
-                        'department': getattr(employee.department, 'name', 'Unknown Department') if hasattr(employee, 'department') and employee.department else 'Unknown Department',
-                        'date': target_date.strftime('%Y-%m-%d'),
-                        'shift_name': shift['name'],
-                        'start_time': start_dt.strftime('%H:%M'),
-                        'end_time': end_dt.strftime('%H:%M'),
-                        'hours': round(hours, 1),
-                        'ai_score': score,
-                        'confidence': score,
-                        'shift_type': shift['name'],
-                        'priority': i + 1
-                    })
+                if employee_id in employee_info:
+                    day_schedules.append(self._build_recommendation(
+                        employee_id, target_date, shift, score, i + 1, employee_info
+                    ))
         
         return day_schedules
     
+    def _build_recommendation(self, employee_id, target_date, shift, score, priority, employee_info):
+        """Build a single shift recommendation from preloaded employee details"""
+        start_dt = datetime.combine(target_date, shift['start'])
+        end_dt = start_dt + timedelta(hours=shift_duration_hours(shift))
+        
+        return {
+            'employee_id': employee_id,
+            'employee_name': employee_info[employee_id]['name'],
+            'department': employee_info[employee_id]['department'],
+            'date': target_date.strftime('%Y-%m-%d'),
+            'shift_name': shift['name'],
+            'start_time': start_dt.strftime('%H:%M'),
+            'end_time': end_dt.strftime('%H:%M'),
+            'hours': round(shift_duration_hours(shift), 1),
+            'ai_score': score,
+            'confidence': score,
+            'shift_type': shift['name'],
+            'priority': priority
+        }
+    
     def _rank_employees_for_shift(self, employee_availability, date, shift):
         """Rank employees for a specific shift based on AI scoring"""
         rankings = []
@@ -332,19 +263,12 @@ class SchedulingAI:
                 shift_coverage[shift_name] = []
             shift_coverage[shift_name].append(rec)
         
-        # Standard shift requirements
-        shift_requirements = {
-            'Morning': {'time_slot': '09:00-17:00', 'required': 3},
-            'Evening': {'time_slot': '17:00-01:00', 'required': 2},
-            'Night': {'time_slot': '01:00-09:00', 'required': 1}
-        }
-        
-        # Calculate coverage for each shift
-        for shift_name, requirements in shift_requirements.items():
-            scheduled_count = len(shift_coverage.get(shift_name, []))
+        # Calculate coverage for each standard shift
+        for shift in STANDARD_SHIFTS:
+            scheduled_count = len(shift_coverage.get(shift['name'], []))
             coverage_data.append({
-                'time_slot': requirements['time_slot'],
-                'required': requirements['required'],
+                'time_slot': shift['time_slot'],
+                'required': shift['required'],
                 'scheduled': scheduled_count
             })
         
@@ -389,42 +313,16 @@ def generate_schedule():
             
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-            department_id = request.form.get('department_id') or None
+            department_id = request.form.get('department_id', type=int) or None
             
-            # Generate optimized schedule
-            result = scheduling_ai.generate_optimized_schedule(
-                department_id=department_id,
-                start_date=start_date,
-                end_date=end_date
-            )
+            if end_date < start_date:
+                flash('End date must be on or after the start date', 'error')
+                return redirect(url_for('ai_scheduling.generate_schedule'))
             
-            if result['success']:
-                flash('AI-optimized schedule generated successfully!', 'success')
-                
-                # Enhance recommendations with proper formatting and type checking
-                recommendations = result.get('schedule_recommendations', [])
-                if isinstance(recommendations, list):
-                    for i, rec in enumerate(recommendations):
-                        if isinstance(rec, dict):
-                            rec['id'] = i + 1  # Add ID for frontend handling
-                            # Ensure all required fields are present
-                            rec.setdefault('employee_name', f'Employee {rec.get("employee_id", "Unknown")}')
-                            rec.setdefault('department', 'Unknown Department')
-                            rec.setdefault('date', rec.get('date', 'Unknown Date'))
-                            rec.setdefault('start_time', 'Unknown')
-                            rec.setdefault('end_time', 'Unknown')
-                            rec.setdefault('hours', 8)
-                            rec.setdefault('confidence', rec.get('ai_score', 75))
-                            rec.setdefault('shift_type', rec.get('shift_name', 'Regular'))
-                else:
-                    recommendations = []
-                    
-                return render_template('ai_scheduling/results.html', 
-                                     recommendations=recommendations,
-                                     metrics=result.get('optimization_metrics', {}),
-                                     coverage=result.get('coverage_analysis', []))
-            else:
-                flash(f'Error generating schedule: {result.get("error", "Unknown error")}', 'error')
+            # Optimisation runs on the background job pool; the job page polls for progress
+            job = submit_schedule_job(current_user.id, start_date, end_date, department_id)
+            flash('Schedule generation started. Results will appear here when ready.', 'info')
+            return redirect(url_for('ai_scheduling.view_job', job_id=job.id))
                 
         except Exception as e:
             flash(f'Error: {str(e)}', 'error')
@@ -468,6 +366,7 @@ def analyze_employee(employee_id):
         availability = scheduling_ai.analyze_employee_availability(
             employee_id, start_date, end_date
         )
+        db.session.commit()  # keep any features the lookup refreshed
         
         if availability:
             employee = User.query.get_or_404(employee_id)
@@ -496,6 +395,7 @@ def api_employee_availability(employee_id):
         availability = scheduling_ai.analyze_employee_availability(
             employee_id, start_date, end_date
         )
+        db.session.commit()  # keep any features the lookup refreshed
         
         return jsonify({
             'success': True,
@@ -508,28 +408,150 @@ def api_employee_availability(employee_id):
             'error': str(e)
         }), 400
 
+def _prepare_recommendations(result):
+    """Add display ids and defaults to a generation result's recommendations"""
+    recommendations = result.get('schedule_recommendations', [])
+    if not isinstance(recommendations, list):
+        return []
+    
+    for i, rec in enumerate(recommendations):
+        if isinstance(rec, dict):
+            rec['id'] = i + 1  # Add ID for frontend handling
+            # Ensure all required fields are present
+            rec.setdefault('employee_name', f'Employee {rec.get("employee_id", "Unknown")}')
+            rec.setdefault('department', 'Unknown Department')
+            rec.setdefault('date', rec.get('date', 'Unknown Date'))
+            rec.setdefault('start_time', 'Unknown')
+            rec.setdefault('end_time', 'Unknown')
+            rec.setdefault('hours', 8)
+            rec.setdefault('confidence', rec.get('ai_score', 75))
+            rec.setdefault('shift_type', rec.get('shift_name', 'Regular'))
+    return recommendations
+
+def _get_job_or_404(job_id):
+    """Load a generation job visible to the current user, failing it first if its worker is gone"""
+    job = ScheduleGenerationJob.query.get_or_404(job_id)
+    if job.requested_by_id != current_user.id and not (
+        current_user.has_role('Admin') or current_user.has_role('Super User')
+    ):
+        abort(404)
+    return expire_orphaned_job(job)
+
+@ai_scheduling_bp.route('/jobs/<int:job_id>')
+@login_required
+@role_required('Manager', 'Admin', 'Super User')
+def view_job(job_id):
+    """Show a generation job's progress, or its results once complete"""
+    job = _get_job_or_404(job_id)
+    
+    if job.status == COMPLETED:
+        result = job.get_result()
+        return render_template('ai_scheduling/results.html',
+                             job=job,
+                             recommendations=_prepare_recommendations(result),
+                             metrics=result.get('optimization_metrics', {}),
+                             coverage=result.get('coverage_analysis', []))
+    
+    return render_template('ai_scheduling/job_status.html', job=job)
+
+@ai_scheduling_bp.route('/api/jobs', methods=['POST'])
+@login_required
+@role_required('Manager', 'Admin', 'Super User')
+def api_submit_job():
+    """Queue a schedule generation job"""
+    try:
+        data = request.get_json() or {}
+        start_date = datetime.strptime(data['start_date'], '%Y-%m-%d').date()
+        end_date = datetime.strptime(data['end_date'], '%Y-%m-%d').date()
+        if end_date < start_date:
+            raise ValueError('end_date must be on or after start_date')
+        
+        job = submit_schedule_job(current_user.id, start_date, end_date, data.get('department_id'))
+        return jsonify({
+            'success': True,
+            'job': job.to_dict(),
+            'status_url': url_for('ai_scheduling.api_job_status', job_id=job.id)
+        }), 202
+        
+    except (KeyError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'error': f'Invalid request: {str(e)}'
+        }), 400
+
+@ai_scheduling_bp.route('/api/jobs/<int:job_id>')
+@login_required
+@role_required('Manager', 'Admin', 'Super User')
+def api_job_status(job_id):
+    """Job status with progress percentage"""
+    job = _get_job_or_404(job_id)
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    })
+
+@ai_scheduling_bp.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+@role_required('Manager', 'Admin', 'Super User')
+def api_cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = _get_job_or_404(job_id)
+    if not cancel_schedule_job(job):
+        return jsonify({
+            'success': False,
+            'error': f'Job is already {job.status.lower()}'
+        }), 409
+    
+    return jsonify({
+        'success': True,
+        'job': job.to_dict()
+    })
+
+@ai_scheduling_bp.route('/api/jobs/<int:job_id>/result')
+@login_required
+@role_required('Manager', 'Admin', 'Super User')
+def api_job_result(job_id):
+    """Generated schedule for a completed job"""
+    job = _get_job_or_404(job_id)
+    if job.status != COMPLETED:
+        return jsonify({
+            'success': False,
+            'job': job.to_dict(),
+            'error': f'Job is {job.status.lower()}'
+        }), 409
+    
+    return jsonify({
+        'success': True,
+        'job': job.to_dict(),
+        'result': job.get_result()
+    })
+
 @ai_scheduling_bp.route('/apply-ai-schedule', methods=['POST'])
 @login_required
 @role_required('Manager', 'Admin', 'Super User')
 def apply_ai_generated_schedule():
     """Apply AI-generated schedule to the system"""
     try:
-        data = request.get_json()
+        data = request.get_json() or {}
         notify_employees = data.get('notify_employees', True)
         overwrite_existing = data.get('overwrite_existing', False)
         
-        # Get the most recent AI recommendations from session or database
-        # For now, return a success message indicating the feature is ready
-        flash('AI schedule application functionality is being implemented', 'info')
+        if not data.get('job_id'):
+            raise ValueError('job_id is required')
+        job = _get_job_or_404(int(data['job_id']))
+        
+        outcome = apply_schedule_job(job, current_user.id,
+                                     overwrite_existing=overwrite_existing,
+                                     notify_employees=notify_employees)
         
         return jsonify({
             'success': True,
-            'message': 'Schedule would be applied successfully (feature in development)',
-            'applied_count': 0,
-            'conflicts_resolved': 0
+            'message': f"Applied {outcome['applied_count']} shifts ({outcome['conflicts']} conflicts)",
+            **outcome
         })
         
     except Exception as e:
+        db.session.rollback()
         return jsonify({
             'success': False,
             'message': f'Error applying schedule: {str(e)}'
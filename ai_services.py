@@ -6,32 +6,135 @@ Provides OpenAI-powered intelligent features for workforce management
 import os
 import json
 import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as UpstreamTimeout
 from datetime import datetime, timedelta, date
+from types import SimpleNamespace
 from typing import List, Dict, Any, Optional
-from openai import OpenAI
 from flask import current_app
 from sqlalchemy import func, and_, or_
 from app import db
 from models import User, TimeEntry, Schedule, LeaveApplication, PayRule, PayCalculation
 from ai_fallback import fallback_service
+from attendance_stats import recent_attendance_statistics
+from tenant_scope import current_tenant_id
+from ttl_cache import TTLCache, make_cache_key
+
+_openai_client = None
+
+
+def get_openai_client():
+    """OpenAI client, created on first use; the SDK import alone costs most of a second at boot"""
+    global _openai_client
+    if _openai_client is None:
+        try:
+            from openai import OpenAI
+            _openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        except Exception as e:
+            logging.error(f"OpenAI client initialization error: {e}")
+    return _openai_client
+
+# How long finished insights are reused before the data is queried again
+AI_INSIGHT_TTL = int(os.environ.get('AI_INSIGHT_TTL', '300'))
+
+# Model answers keyed on the exact prompt; same data gives the same answer
+AI_COMPLETION_TTL = int(os.environ.get('AI_COMPLETION_TTL', '21600'))
+
+# Seconds to wait for the model before serving the statistical fallback.
+# The call keeps running in the background and fills the cache for next time.
+AI_UPSTREAM_TIMEOUT = float(os.environ.get('AI_UPSTREAM_TIMEOUT', '8'))
+
+insight_cache = TTLCache(ttl=AI_INSIGHT_TTL, max_entries=512)
+completion_cache = TTLCache(ttl=AI_COMPLETION_TTL, max_entries=512)
+_upstream_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='ai-upstream')
+
+
+class StubChatClient:
+    """Local stand-in for the OpenAI client; set WFM_AI_STUB=1 or pass it to WFMIntelligence"""
+    
+    def __init__(self, response: Optional[Dict[str, Any]] = None):
+        self.response = response if response is not None else {
+            'patterns_identified': ['Stub analysis'],
+            'recommendations': ['Stub recommendation'],
+            'response': 'Stub response'
+        }
+        self.calls = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+    
+    def _create(self, model, messages, **kwargs):
+        self.calls.append(messages)
+        message = SimpleNamespace(content=json.dumps(self.response))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+def cached_insight(method):
+    """Serve an insight from insight_cache, coalescing concurrent identical requests.
+
+    The key covers the tenant the queries are scoped to, the method, its
+    arguments and today's date (the analysis windows are relative to today).
+    Failed results and timeout fallbacks are returned but not cached, so the
+    next request retries the model.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = make_cache_key(current_tenant_id(), method.__name__, self.model, args, kwargs, date.today())
+        return insight_cache.get_or_set(
+            key,
+            lambda: method(self, *args, **kwargs),
+            cache_if=lambda result: result.get('success', True) and not result.get('upstream_timeout')
+        )
+    return wrapper
+
+
+def _timeout_fallback(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Mark a statistical fallback served because the model was too slow"""
+    result = dict(result)
+    result['upstream_timeout'] = True
+    return result
 
-# Initialize OpenAI client with error handling
-try:
-    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
-except Exception as e:
-    logging.error(f"OpenAI client initialization error: {e}")
-    client = None
 
 class WFMIntelligence:
     """AI-powered workforce management intelligence engine"""
     
-    def __init__(self):
-        self.client = client
+    def __init__(self, chat_client=None):
+        if chat_client is None and os.environ.get('WFM_AI_STUB'):
+            chat_client = StubChatClient()
+        self._chat_client = chat_client
         # the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
         # do not change this unless explicitly requested by the user
         self.model = "gpt-4o"
-        self.is_available = client is not None and os.environ.get("OPENAI_API_KEY") is not None
+        self.is_available = chat_client is not None or os.environ.get("OPENAI_API_KEY") is not None
     
+    @property
+    def client(self):
+        return self._chat_client or get_openai_client()
+    
+    def _complete(self, system_message: str, prompt: str) -> Dict[str, Any]:
+        """JSON chat completion, cached by prompt and bounded by AI_UPSTREAM_TIMEOUT.
+        
+        Raises UpstreamTimeout when the model is slow; identical prompts in flight
+        share one upstream call.
+        """
+        key = make_cache_key(self.model, system_message, prompt)
+        cached = completion_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        def call_model():
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"}
+            )
+            return json.loads(response.choices[0].message.content)
+        
+        future = _upstream_pool.submit(completion_cache.get_or_set, key, call_model)
+        return future.result(timeout=AI_UPSTREAM_TIMEOUT)
+    
+    @cached_insight
     def analyze_scheduling_patterns(self, department_id: Optional[int] = None, days: int = 30) -> Dict[str, Any]:
         """Analyze scheduling patterns and provide AI insights"""
         if not self.is_available:
@@ -86,17 +189,11 @@ class WFMIntelligence:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a workforce management expert analyzing scheduling patterns."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
+            analysis = self._complete(
+                "You are a workforce management expert analyzing scheduling patterns.",
+                prompt
             )
             
-            analysis = json.loads(response.choices[0].message.content)
-            
             return {
                 'success': True,
                 'analysis': analysis,
@@ -104,6 +201,9 @@ class WFMIntelligence:
                 'total_schedules_analyzed': len(schedules)
             }
             
+        except UpstreamTimeout:
+            logging.warning("AI scheduling analysis timed out, using fallback statistical analysis")
+            return _timeout_fallback(fallback_service.analyze_scheduling_patterns(department_id, days))
         except Exception as e:
             logging.error(f"AI scheduling analysis error: {e}")
             error_msg = str(e)
@@ -117,6 +217,7 @@ class WFMIntelligence:
                 'fallback_available': True
             }
     
+    @cached_insight
     def generate_payroll_insights(self, pay_period_start: date, pay_period_end: date) -> Dict[str, Any]:
         """Generate AI-powered payroll insights and anomaly detection"""
         if not self.is_available:
@@ -132,8 +233,8 @@ class WFMIntelligence:
             
             # Get time entries for comparison
             time_entries = TimeEntry.query.filter(
-                func.date(TimeEntry.clock_in_time) >= pay_period_start,
-                func.date(TimeEntry.clock_in_time) <= pay_period_end
+                TimeEntry.work_date >= pay_period_start,
+                TimeEntry.work_date <= pay_period_end
             ).all()
             
             # Prepare payroll data
@@ -187,17 +288,11 @@ class WFMIntelligence:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a payroll expert analyzing workforce costs and compliance."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
+            insights = self._complete(
+                "You are a payroll expert analyzing workforce costs and compliance.",
+                prompt
             )
             
-            insights = json.loads(response.choices[0].message.content)
-            
             return {
                 'success': True,
                 'insights': insights,
@@ -206,6 +301,9 @@ class WFMIntelligence:
                 'time_entries_analyzed': len(time_entries)
             }
             
+        except UpstreamTimeout:
+            logging.warning("AI payroll insights timed out, using fallback statistical analysis")
+            return _timeout_fallback(fallback_service.generate_payroll_insights(pay_period_start, pay_period_end))
         except Exception as e:
             logging.error(f"AI payroll insights error: {e}")
             error_msg = str(e)
@@ -219,6 +317,7 @@ class WFMIntelligence:
                 'fallback_available': True
             }
     
+    @cached_insight
     def analyze_attendance_patterns(self, employee_id: Optional[int] = None, days: int = 30) -> Dict[str, Any]:
         """Analyze attendance patterns and predict potential issues"""
         if not self.is_available:
@@ -226,37 +325,22 @@ class WFMIntelligence:
             return fallback_service.analyze_attendance_patterns(employee_id, days)
             
         try:
-            end_date = date.today()
-            start_date = end_date - timedelta(days=days)
-            
-            query = TimeEntry.query.filter(
-                func.date(TimeEntry.clock_in_time) >= start_date,
-                func.date(TimeEntry.clock_in_time) <= end_date
-            )
-            
-            if employee_id:
-                query = query.filter(TimeEntry.user_id == employee_id)
-            
-            entries = query.all()
-            
-            # Prepare attendance data
-            attendance_data = []
-            for entry in entries:
-                attendance_data.append({
-                    'employee_id': entry.user_id,
-                    'date': entry.clock_in_time.date().isoformat(),
-                    'clock_in_time': entry.clock_in_time.strftime('%H:%M'),
-                    'clock_out_time': entry.clock_out_time.strftime('%H:%M') if entry.clock_out_time else 'Still active',
-                    'total_hours': float(entry.total_hours) if entry.total_hours else 0,
-                    'day_of_week': entry.clock_in_time.weekday(),
-                    'is_late': entry.clock_in_time.time() > datetime.strptime('09:00', '%H:%M').time(),
-                    'break_minutes': getattr(entry, 'total_break_minutes', 0) or 0
-                })
+            stats = recent_attendance_statistics(days, user_ids=[employee_id] if employee_id else None)
+            
+            # Summarised metrics instead of raw rows: covers every employee within the token budget
+            employee_metrics = sorted(stats.employees.items(), key=lambda item: item[1].late_days, reverse=True)
+            attendance_data = {
+                'overall': stats.overall.to_dict(),
+                'departments': {str(department_id): metrics.to_dict()
+                                for department_id, metrics in stats.departments.items()},
+                'employees': [dict(employee_id=user_id, **metrics.to_dict())
+                              for user_id, metrics in employee_metrics[:40]]
+            }
             
             prompt = f"""
             Analyze attendance patterns for workforce insights:
             
-            {json.dumps(attendance_data[:40], indent=2)}
+            {json.dumps(attendance_data, indent=2)}
             
             Provide analysis in JSON format:
             {{
@@ -279,24 +363,21 @@ class WFMIntelligence:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are an HR analytics expert analyzing employee attendance patterns."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
+            analysis = self._complete(
+                "You are an HR analytics expert analyzing employee attendance patterns.",
+                prompt
             )
             
-            analysis = json.loads(response.choices[0].message.content)
-            
             return {
                 'success': True,
                 'analysis': analysis,
-                'period': f"{start_date} to {end_date}",
-                'entries_analyzed': len(entries)
+                'period': f"{stats.start_date} to {stats.end_date}",
+                'entries_analyzed': stats.total_entries
             }
             
+        except UpstreamTimeout:
+            logging.warning("AI attendance analysis timed out, using fallback statistical analysis")
+            return _timeout_fallback(fallback_service.analyze_attendance_patterns(employee_id, days))
         except Exception as e:
             logging.error(f"AI attendance analysis error: {e}")
             error_msg = str(e)
@@ -378,17 +459,11 @@ class WFMIntelligence:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a workforce optimization expert creating efficient schedules."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
+            suggestions = self._complete(
+                "You are a workforce optimization expert creating efficient schedules.",
+                prompt
             )
             
-            suggestions = json.loads(response.choices[0].message.content)
-            
             return {
                 'success': True,
                 'suggestions': suggestions,
@@ -403,6 +478,7 @@ class WFMIntelligence:
                 'error': str(e)
             }
     
+    @cached_insight
     def natural_language_query(self, query: str) -> Dict[str, Any]:
         """Process natural language queries about workforce data"""
         try:
@@ -444,23 +520,24 @@ class WFMIntelligence:
             }}
             """
             
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a helpful WFM assistant providing insights about workforce data."},
-                    {"role": "user", "content": prompt}
-                ],
-                response_format={"type": "json_object"}
+            result = self._complete(
+                "You are a helpful WFM assistant providing insights about workforce data.",
+                prompt
             )
             
-            result = json.loads(response.choices[0].message.content)
-            
             return {
                 'success': True,
                 'query': query,
                 'result': result
             }
             
+        except UpstreamTimeout:
+            logging.warning("AI natural language query timed out")
+            return {
+                'success': False,
+                'error': 'The AI service is taking longer than usual. Please try again shortly.',
+                'upstream_timeout': True
+            }
         except Exception as e:
             logging.error(f"AI natural language query error: {e}")
             return {
@@ -11,8 +11,10 @@ import logging
 import json
 
 from app import db
-from models import User, TimeEntry, Schedule, LeaveApplication, PayCode, PayRule, LeaveType, LeaveBalance, ShiftType, Role
+from models import User, TimeEntry, Schedule, LeaveApplication, PayCode, PayRule, LeaveType, LeaveBalance, ShiftType, Role, Department
 from auth import role_required, super_user_required
+from attendance_stats import worked_hours_expression
+from punch_service import punch_in, punch_out, get_idempotency_key, ALREADY_OPEN, NOT_OPEN, REPLAYED
 
 # Create API blueprint
 api_bp = Blueprint('api', __name__, url_prefix='/api/v1')
@@ -60,41 +62,38 @@ def api_clock_in():
     """Clock in API endpoint for mobile apps"""
     try:
         data = request.get_json() or {}
+        location = data.get('location', {})
         
-        # Check if user is already clocked in
-        existing_entry = TimeEntry.query.filter(
-            and_(
-                TimeEntry.user_id == current_user.id,
-                TimeEntry.clock_out_time.is_(None)
-            )
-        ).first()
+        # Single round-trip insert; a retried request with the same key is replayed
+        result = punch_in(
+            current_user.id,
+            datetime.utcnow(),
+            idempotency_key=get_idempotency_key(data),
+            notes=data.get('notes'),
+            latitude=location.get('latitude'),
+            longitude=location.get('longitude')
+        )
         
-        if existing_entry:
+        if result.outcome == ALREADY_OPEN:
             return api_response(False, error={
                 'code': 'ALREADY_CLOCKED_IN',
                 'message': 'You are already clocked in'
             }, status_code=400)
         
-        # Create new time entry
-        time_entry = TimeEntry(
-            user_id=current_user.id,
-            clock_in_time=datetime.utcnow(),
-            status='Open',
-            notes=data.get('notes'),
-            clock_in_latitude=data.get('location', {}).get('latitude'),
-            clock_in_longitude=data.get('location', {}).get('longitude')
-        )
-        
-        db.session.add(time_entry)
-        db.session.commit()
-        
         return api_response(True, data={
-            'entry_id': time_entry.id,
-            'clock_in_time': time_entry.clock_in_time.isoformat() + 'Z',
-            'status': 'clocked_in'
+            'entry_id': result.entry_id,
+            'clock_in_time': result.clock_in_time.isoformat() + 'Z',
+            'status': 'clocked_in',
+            'replayed': result.outcome == REPLAYED
         }, message='Successfully clocked in')
         
+    except ValueError as e:
+        return api_response(False, error={
+            'code': 'INVALID_IDEMPOTENCY_KEY',
+            'message': str(e)
+        }, status_code=400)
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Clock in API error: {e}")
         return api_response(False, error={
             'code': 'SERVER_ERROR',
@@ -107,40 +106,39 @@ def api_clock_out():
     """Clock out API endpoint for mobile apps"""
     try:
         data = request.get_json() or {}
+        location = data.get('location', {})
+        
+        # Single round-trip update of the open entry; retries are replayed
+        result = punch_out(
+            current_user.id,
+            datetime.utcnow(),
+            idempotency_key=get_idempotency_key(data),
+            notes_suffix='\n' + data.get('notes') if data.get('notes') else None,
+            latitude=location.get('latitude'),
+            longitude=location.get('longitude')
+        )
         
-        # Find active time entry
-        time_entry = TimeEntry.query.filter(
-            and_(
-                TimeEntry.user_id == current_user.id,
-                TimeEntry.clock_out_time.is_(None)
-            )
-        ).first()
-        
-        if not time_entry:
+        if result.outcome == NOT_OPEN:
             return api_response(False, error={
                 'code': 'NOT_CLOCKED_IN',
                 'message': 'You are not currently clocked in'
             }, status_code=400)
         
-        # Update time entry
-        time_entry.clock_out_time = datetime.utcnow()
-        time_entry.status = 'Closed'
-        time_entry.clock_out_latitude = data.get('location', {}).get('latitude')
-        time_entry.clock_out_longitude = data.get('location', {}).get('longitude')
-        
-        if data.get('notes'):
-            time_entry.notes = (time_entry.notes or '') + '\n' + data.get('notes')
-        
-        db.session.commit()
-        
         return api_response(True, data={
-            'entry_id': time_entry.id,
-            'clock_out_time': time_entry.clock_out_time.isoformat() + 'Z',
-            'total_hours': round(time_entry.total_hours, 2),
-            'status': 'clocked_out'
+            'entry_id': result.entry_id,
+            'clock_out_time': result.clock_out_time.isoformat() + 'Z',
+            'total_hours': result.total_hours,
+            'status': 'clocked_out',
+            'replayed': result.outcome == REPLAYED
         }, message='Successfully clocked out')
         
+    except ValueError as e:
+        return api_response(False, error={
+            'code': 'INVALID_IDEMPOTENCY_KEY',
+            'message': str(e)
+        }, status_code=400)
     except Exception as e:
+        db.session.rollback()
         logging.error(f"Clock out API error: {e}")
         return api_response(False, error={
             'code': 'SERVER_ERROR',
@@ -165,7 +163,7 @@ def api_current_status():
         today_entries = TimeEntry.query.filter(
             and_(
                 TimeEntry.user_id == current_user.id,
-                func.date(TimeEntry.clock_in_time) == today
+                TimeEntry.work_date == today
             )
         ).all()
         
@@ -212,9 +210,9 @@ def api_time_entries():
         query = TimeEntry.query.filter(TimeEntry.user_id == current_user.id)
         
         if start_date:
-            query = query.filter(func.date(TimeEntry.clock_in_time) >= start_date)
+            query = query.filter(TimeEntry.work_date >= start_date)
         if end_date:
-            query = query.filter(func.date(TimeEntry.clock_in_time) <= end_date)
+            query = query.filter(TimeEntry.work_date <= end_date)
         
         # Paginate results
         entries = query.order_by(TimeEntry.clock_in_time.desc()).paginate(
@@ -505,13 +503,13 @@ def api_team_time_entries():
         if current_user.has_role('Super User'):
             # Super Users see all entries
             entries = TimeEntry.query.filter(
-                func.date(TimeEntry.clock_in_time) == target_date
+                TimeEntry.work_date == target_date
             ).join(User, TimeEntry.user_id == User.id).all()
         elif current_user.has_role('Manager'):
             # Managers only see their department's entries
             if hasattr(current_user, 'department_id') and current_user.department_id:
                 entries = TimeEntry.query.filter(
-                    func.date(TimeEntry.clock_in_time) == target_date
+                    TimeEntry.work_date == target_date
                 ).join(User, TimeEntry.user_id == User.id).filter(
                     User.department_id == current_user.department_id
                 ).all()
@@ -519,7 +517,7 @@ def api_team_time_entries():
                 # Manager with no department sees only their own entries
                 entries = TimeEntry.query.filter(
                     and_(
-                        func.date(TimeEntry.clock_in_time) == target_date,
+                        TimeEntry.work_date == target_date,
                         TimeEntry.user_id == current_user.id
                     )
                 ).all()
@@ -767,6 +765,48 @@ def api_users():
 # DRILL-DOWN ANALYTICS APIs
 # ====================
 
+# Row detail page sizes for drill-downs
+DRILL_DOWN_PAGE_SIZE = 50
+DRILL_DOWN_MAX_PAGE_SIZE = 200
+
+# extract('dow') numbering: 0 = Sunday on both PostgreSQL and SQLite
+DAY_NAMES_FROM_SUNDAY = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+def _drill_down_page_args():
+    """Page and page size for drill-down row detail"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', DRILL_DOWN_PAGE_SIZE, type=int), 1), DRILL_DOWN_MAX_PAGE_SIZE)
+    return page, per_page
+
+def _drill_down_pagination(page, per_page, total):
+    """Pagination block matching the paginated list endpoints"""
+    pages = (total + per_page - 1) // per_page if total else 0
+    return {
+        'page': page,
+        'pages': pages,
+        'per_page': per_page,
+        'total': total,
+        'has_next': page < pages,
+        'has_prev': page > 1
+    }
+
+def _drill_down_entry_rows(conditions, page, per_page, *extra_columns):
+    """One page of time entry detail rows, projected without loading ORM objects"""
+    return db.session.execute(
+        db.select(
+            TimeEntry.clock_in_time, TimeEntry.clock_out_time, TimeEntry.total_break_minutes,
+            worked_hours_expression().label('worked_hours'),
+            User.first_name, User.last_name, User.employee_number,
+            Department.name.label('department_name'), *extra_columns
+        )
+        .join(User, User.id == TimeEntry.user_id)
+        .outerjoin(Department, Department.id == User.department_id)
+        .where(*conditions)
+        .order_by(TimeEntry.clock_in_time, TimeEntry.id)
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+    ).all()
+
 @api_bp.route('/drill-down/daily-attendance', methods=['GET'])
 @login_required
 def api_drill_down_daily_attendance():
@@ -780,34 +820,60 @@ def api_drill_down_daily_attendance():
     
     try:
         target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        page, per_page = _drill_down_page_args()
+        
+        # Half-open range on clock_in_time so the clock-in index is used
+        day_start = datetime.combine(target_date, datetime.min.time())
+        conditions = [
+            TimeEntry.clock_in_time >= day_start,
+            TimeEntry.clock_in_time < day_start + timedelta(days=1)
+        ]
+        
+        # Summary and department breakdown aggregated in the database
+        summary = db.session.execute(
+            db.select(
+                func.count(TimeEntry.id).label('total_entries'),
+                func.coalesce(func.sum(worked_hours_expression()), 0).label('total_hours'),
+                func.count(TimeEntry.id).filter(TimeEntry.clock_out_time.is_(None)).label('active'),
+                func.count(TimeEntry.clock_out_time).label('completed')
+            ).where(*conditions)
+        ).one()
+        
+        department_breakdown = {
+            (row.department or 'Not Assigned'): row.entries
+            for row in db.session.execute(
+                db.select(Department.name.label('department'), func.count(TimeEntry.id).label('entries'))
+                .select_from(TimeEntry)
+                .join(User, User.id == TimeEntry.user_id)
+                .outerjoin(Department, Department.id == User.department_id)
+                .where(*conditions)
+                .group_by(Department.name)
+            )
+        }
         
-        # Get all time entries for the specific date
-        time_entries = TimeEntry.query.filter(
-            func.date(TimeEntry.clock_in_time) == target_date
-        ).join(User).all()
-        
-        # Prepare detailed data
         entries_data = []
-        for entry in time_entries:
+        for row in _drill_down_entry_rows(conditions, page, per_page):
             entries_data.append({
-                'employee': f"{entry.user.first_name} {entry.user.last_name}",
-                'employee_id': getattr(entry.user, 'employee_id', 'N/A'),
-                'department': getattr(entry.user, 'department', 'Not Assigned') or 'Not Assigned',
-                'clock_in': entry.clock_in_time.strftime('%H:%M') if entry.clock_in_time else 'N/A',
-                'clock_out': entry.clock_out_time.strftime('%H:%M') if entry.clock_out_time else 'Still Active',
-                'total_hours': round(entry.total_hours, 2) if entry.total_hours else 0,
-                'status': 'Completed' if entry.clock_out_time else 'Active',
-                'break_minutes': getattr(entry, 'total_break_minutes', 0) or 0
+                'employee': f"{row.first_name} {row.last_name}",
+                'employee_id': row.employee_number or 'N/A',
+                'department': row.department_name or 'Not Assigned',
+                'clock_in': row.clock_in_time.strftime('%H:%M'),
+                'clock_out': row.clock_out_time.strftime('%H:%M') if row.clock_out_time else 'Still Active',
+                'total_hours': round(float(row.worked_hours or 0), 2),
+                'status': 'Completed' if row.clock_out_time else 'Active',
+                'break_minutes': row.total_break_minutes or 0
             })
         
         return api_response(True, data={
             'date': date_str,
-            'total_entries': len(entries_data),
+            'total_entries': summary.total_entries,
             'entries': entries_data,
+            'pagination': _drill_down_pagination(page, per_page, summary.total_entries),
             'summary': {
-                'total_hours': sum(e['total_hours'] for e in entries_data),
-                'active_employees': len([e for e in entries_data if e['status'] == 'Active']),
-                'completed_shifts': len([e for e in entries_data if e['status'] == 'Completed'])
+                'total_hours': round(float(summary.total_hours), 2),
+                'active_employees': summary.active,
+                'completed_shifts': summary.completed,
+                'department_breakdown': department_breakdown
             }
         })
         
@@ -895,52 +961,61 @@ def api_drill_down_hourly_patterns():
     
     try:
         hour_int = int(hour)
+        if not 0 <= hour_int <= 23:
+            raise ValueError(hour)
+        page, per_page = _drill_down_page_args()
         
-        # Get time entries for the specific hour (last 30 days)
+        # Stored clock_in_hour + clock_in_time range: one index range scan
         thirty_days_ago = datetime.now() - timedelta(days=30)
-        
-        time_entries = TimeEntry.query.filter(
-            TimeEntry.clock_in_time >= thirty_days_ago,
-            func.extract('hour', TimeEntry.clock_in_time) == hour_int
-        ).join(User).all()
+        conditions = [
+            TimeEntry.clock_in_hour == hour_int,
+            TimeEntry.clock_in_time >= thirty_days_ago
+        ]
+        
+        # Frequency per employee name and per weekday via GROUP BY; employees sharing
+        # a display name are summed into one key, as the response is keyed by name
+        employee_rows = db.session.execute(
+            db.select(User.first_name, User.last_name, func.count(TimeEntry.id).label('clock_ins'))
+            .select_from(TimeEntry)
+            .join(User, User.id == TimeEntry.user_id)
+            .where(*conditions)
+            .group_by(User.first_name, User.last_name)
+            .order_by(func.count(TimeEntry.id).desc())
+        ).all()
+        frequency_by_employee = {f"{row.first_name} {row.last_name}": row.clock_ins for row in employee_rows}
+        total_clock_ins = sum(row.clock_ins for row in employee_rows)
+        
+        weekday = func.extract('dow', TimeEntry.clock_in_time)
+        day_patterns = {
+            DAY_NAMES_FROM_SUNDAY[int(row.weekday)]: row.clock_ins
+            for row in db.session.execute(
+                db.select(weekday.label('weekday'), func.count(TimeEntry.id).label('clock_ins'))
+                .where(*conditions)
+                .group_by(weekday)
+            )
+        }
         
         entries_data = []
-        frequency_by_employee = {}
-        
-        for entry in time_entries:
-            employee_name = f"{entry.user.first_name} {entry.user.last_name}"
-            entry_data = {
-                'employee': employee_name,
-                'employee_id': getattr(entry.user, 'employee_id', 'N/A'),
-                'department': getattr(entry.user, 'department', 'Not Assigned') or 'Not Assigned',
-                'date': entry.clock_in_time.strftime('%Y-%m-%d'),
-                'exact_time': entry.clock_in_time.strftime('%H:%M:%S'),
-                'day_of_week': entry.clock_in_time.strftime('%A')
-            }
-            entries_data.append(entry_data)
-            
-            # Count frequency per employee
-            if employee_name not in frequency_by_employee:
-                frequency_by_employee[employee_name] = 0
-            frequency_by_employee[employee_name] += 1
-        
-        # Analyze patterns
-        day_patterns = {}
-        for entry in entries_data:
-            day = entry['day_of_week']
-            if day not in day_patterns:
-                day_patterns[day] = 0
-            day_patterns[day] += 1
+        for row in _drill_down_entry_rows(conditions, page, per_page):
+            entries_data.append({
+                'employee': f"{row.first_name} {row.last_name}",
+                'employee_id': row.employee_number or 'N/A',
+                'department': row.department_name or 'Not Assigned',
+                'date': row.clock_in_time.strftime('%Y-%m-%d'),
+                'exact_time': row.clock_in_time.strftime('%H:%M:%S'),
+                'day_of_week': row.clock_in_time.strftime('%A')
+            })
         
         return api_response(True, data={
             'hour': f"{hour}:00",
             'period': "Last 30 days",
-            'total_clock_ins': len(entries_data),
+            'total_clock_ins': total_clock_ins,
             'entries': entries_data,
+            'pagination': _drill_down_pagination(page, per_page, total_clock_ins),
             'patterns': {
                 'employee_frequency': frequency_by_employee,
                 'day_of_week_breakdown': day_patterns,
-                'most_frequent_employee': max(frequency_by_employee.items(), key=lambda x: x[1]) if frequency_by_employee else None,
+                'most_frequent_employee': next(iter(frequency_by_employee.items()), None),
                 'most_common_day': max(day_patterns.items(), key=lambda x: x[1]) if day_patterns else None
             }
         })
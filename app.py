@@ -1,5 +1,6 @@
 import os
 import logging
+import importlib
 from flask import Flask, Blueprint, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -18,6 +19,67 @@ class Base(DeclarativeBase):
 db = SQLAlchemy(model_class=Base)
 migrate = Migrate()
 
+# Optional subsystems that can be left out with WFM_SUBSYSTEMS; they pull in heavy dependencies
+OPTIONAL_SUBSYSTEMS = frozenset({'ai', 'sage', 'pulse', 'tenant'})
+
+# (subsystem or None for core, module, blueprint attribute, url_prefix override) in registration order.
+# Modules are imported only when their blueprint is registered.
+BLUEPRINTS = [
+    (None, 'routes', 'main_bp', None),
+    (None, 'auth_simple', 'auth_bp', None),
+    (None, 'time_attendance', 'time_attendance_bp', None),
+    (None, 'scheduling', 'scheduling_bp', None),
+    (None, 'leave_management', 'leave_management_bp', None),
+    (None, 'pay_rules', 'pay_rules_bp', None),
+    (None, 'pay_codes', 'pay_codes_bp', None),
+    (None, 'payroll', 'payroll_bp', None),
+    (None, 'api', 'api_bp', None),
+    (None, 'automation_engine', 'automation_bp', None),
+    ('ai', 'ai_scheduling', 'ai_scheduling_bp', None),
+    (None, 'organization_management', 'org_bp', None),
+    (None, 'employee_import', 'import_bp', None),
+    (None, 'debug_roles', 'debug_bp', None),
+    (None, 'notifications', 'notifications_bp', None),
+    (None, 'pay_code_admin', 'pay_code_admin_bp', None),
+    ('sage', 'sage_vip_routes', 'sage_vip_bp', None),
+    ('sage', 'sage_vip_api', 'sage_vip_api_bp', None),
+    ('sage', 'sage_vip_config_api', 'sage_vip_config_api_bp', None),
+    (None, 'timecard_rollup', 'timecard_rollup_bp', None),
+    (None, 'time_tracking_routes', 'time_tracking_bp', '/time'),
+    (None, 'dashboard_management', 'dashboard_bp', '/dashboard'),
+    ('pulse', 'pulse_survey', 'pulse_survey_bp', '/pulse'),
+    ('tenant', 'tenant_management', 'tenant_bp', '/tenant'),
+    ('ai', 'ai_routes', 'ai_bp', None),
+]
+
+def register_blueprints(app, enabled_subsystems):
+    """Import and register the core blueprints and those of the enabled subsystems"""
+    for subsystem, module_name, attribute, url_prefix in BLUEPRINTS:
+        if subsystem is not None and subsystem not in enabled_subsystems:
+            logging.info(f"Subsystem '{subsystem}' disabled, skipping {module_name}")
+            continue
+        blueprint = getattr(importlib.import_module(module_name), attribute)
+        if url_prefix:
+            app.register_blueprint(blueprint, url_prefix=url_prefix)
+        else:
+            app.register_blueprint(blueprint)
+
+def init_database():
+    """Create missing tables and seed the default notification types"""
+    # Import models to ensure tables are created
+    import models  # noqa: F401
+    
+    try:
+        db.create_all()
+        logging.info("Database tables created successfully")
+        
+        # Initialize notification system
+        from notifications import init_notification_types
+        init_notification_types()
+        logging.info("Notification system initialized")
+    except Exception as e:
+        logging.error(f"Error creating database tables: {e}")
+
 def create_app(config_class=Config):
     """Application factory pattern"""
     app = Flask(__name__)
@@ -37,6 +99,10 @@ def create_app(config_class=Config):
     from auth_simple import init_login_manager
     init_login_manager(app)
     
+    # Scope tenant-owned tables to the signed-in user's tenant
+    from tenant_scope import init_tenant_scope
+    init_tenant_scope(app)
+    
     # Register currency formatter for templates
     from currency_formatter import currency_filter
     app.jinja_env.filters['currency'] = currency_filter
@@ -78,49 +144,10 @@ def create_app(config_class=Config):
     
     app.jinja_env.filters['department_name'] = get_department_name
     
-    # Register blueprints/routes
-    from routes import main_bp
-    from auth_simple import auth_bp
-    from time_attendance import time_attendance_bp
-    from scheduling import scheduling_bp
-    from leave_management import leave_management_bp
-    from pay_rules import pay_rules_bp
-    from pay_codes import pay_codes_bp
-    from payroll import payroll_bp
-    from api import api_bp
-    from automation_engine import automation_bp
-    from ai_scheduling import ai_scheduling_bp
-    from organization_management import org_bp
-    from employee_import import import_bp
-    from debug_roles import debug_bp
-    from dashboard_management import dashboard_bp
-    from notifications import notifications_bp
-    from pay_code_admin import pay_code_admin_bp
-    from sage_vip_routes import sage_vip_bp
-    from sage_vip_api import sage_vip_api_bp
-    from sage_vip_config_api import sage_vip_config_api_bp
-    from timecard_rollup import timecard_rollup_bp
-    app.register_blueprint(main_bp)
-    app.register_blueprint(auth_bp)
-    app.register_blueprint(time_attendance_bp)
-    app.register_blueprint(scheduling_bp)
-    app.register_blueprint(leave_management_bp)
-    app.register_blueprint(pay_rules_bp)
-    app.register_blueprint(pay_codes_bp)
-    app.register_blueprint(payroll_bp)
-    app.register_blueprint(api_bp)
-    app.register_blueprint(automation_bp)
-    app.register_blueprint(ai_scheduling_bp)
-    app.register_blueprint(org_bp)
-    app.register_blueprint(import_bp)
-    app.register_blueprint(debug_bp)
-    app.register_blueprint(notifications_bp)
-    app.register_blueprint(pay_code_admin_bp)
-    app.register_blueprint(sage_vip_bp)
-    app.register_blueprint(sage_vip_api_bp)
-    app.register_blueprint(sage_vip_config_api_bp)
-    app.register_blueprint(timecard_rollup_bp)
-
+    # Register blueprints/routes; optional subsystems only when enabled in config
+    enabled_subsystems = app.config.get('ENABLED_SUBSYSTEMS', OPTIONAL_SUBSYSTEMS)
+    app.jinja_env.globals['subsystem_enabled'] = lambda name: name in enabled_subsystems
+    register_blueprints(app, enabled_subsystems)
     
     # Register additional API routes without version prefix for frontend compatibility
     from api import api_bp as api_v1_bp
@@ -172,26 +199,6 @@ def create_app(config_class=Config):
     
     app.register_blueprint(api_compat_bp)
     
-    # Register time tracking routes
-    from time_tracking_routes import time_tracking_bp
-    app.register_blueprint(time_tracking_bp, url_prefix='/time')
-    
-    # Register dashboard management routes
-    from dashboard_management import dashboard_bp
-    app.register_blueprint(dashboard_bp, url_prefix='/dashboard')
-    
-    # Register pulse survey routes
-    from pulse_survey import pulse_survey_bp
-    app.register_blueprint(pulse_survey_bp, url_prefix='/pulse')
-    
-    # Register tenant management routes
-    from tenant_management import tenant_bp
-    app.register_blueprint(tenant_bp, url_prefix='/tenant')
-    
-    # Register AI-powered routes
-    from ai_routes import ai_bp
-    app.register_blueprint(ai_bp)
-    
     # Error handlers
     @app.errorhandler(404)
     def not_found_error(error):
@@ -212,21 +219,10 @@ def create_app(config_class=Config):
     from cli_commands import register_commands
     register_commands(app)
     
-    # Create database tables
-    with app.app_context():
-        # Import models to ensure tables are created
-        import models  # noqa: F401
-        
-        try:
-            db.create_all()
-            logging.info("Database tables created successfully")
-            
-            # Initialize notification system
-            from notifications import init_notification_types
-            init_notification_types()
-            logging.info("Notification system initialized")
-        except Exception as e:
-            logging.error(f"Error creating database tables: {e}")
+    # Creating tables is a deployment step (`flask init-db` or migrations), not part of every boot
+    if app.config.get('AUTO_CREATE_TABLES'):
+        with app.app_context():
+            init_database()
     
     return app
 
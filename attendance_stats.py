@@ -0,0 +1,251 @@
+"""
+Attendance Statistics Kernel
+Shared per-employee and per-department attendance metrics for the insight providers
+"""
+
+import math
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Optional
+
+from app import db
+from models import TimeEntry, User
+
+# Clock-ins after this time of day count as late
+LATE_AFTER = time(9, 0)
+
+# Clock-outs before this time of day count as early departures
+EARLY_DEPARTURE_BEFORE = time(17, 0)
+
+# Worked hours per day above this count as overtime
+STANDARD_DAILY_HOURS = 8
+
+
+@dataclass
+class AttendanceMetrics:
+    """Attendance metrics for one employee, one department or the whole scope"""
+    employees: int = 0
+    days_worked: int = 0
+    expected_days: int = 0
+    hours_days: int = 0
+    late_days: int = 0
+    late_minutes: float = 0.0
+    early_departures: int = 0
+    total_hours: float = 0.0
+    overtime_hours: float = 0.0
+    dow_distribution: Dict[int, int] = field(default_factory=lambda: {day: 0 for day in range(7)})
+    weekly_overtime: Dict[date, float] = field(default_factory=dict)
+    _hours_sum_sq: float = 0.0
+
+    def add_day(self, work_date: date, first_in: datetime, last_out: Optional[datetime], hours: float):
+        """Fold one employee work day into the metrics"""
+        self.days_worked += 1
+        self.dow_distribution[work_date.weekday()] += 1
+
+        late_by = (datetime.combine(work_date, first_in.time()) -
+                   datetime.combine(work_date, LATE_AFTER)).total_seconds() / 60
+        if late_by > 0:
+            self.late_days += 1
+            self.late_minutes += late_by
+        if last_out is None:
+            # Still clocked in: counts as attendance but not towards hours metrics
+            return
+        if last_out.date() == work_date and last_out.time() < EARLY_DEPARTURE_BEFORE:
+            self.early_departures += 1
+
+        self.hours_days += 1
+        self.total_hours += hours
+        self._hours_sum_sq += hours * hours
+        overtime = max(0.0, hours - STANDARD_DAILY_HOURS)
+        self.overtime_hours += overtime
+        week_start = work_date - timedelta(days=work_date.weekday())
+        self.weekly_overtime[week_start] = self.weekly_overtime.get(week_start, 0.0) + overtime
+
+    def merge(self, other: 'AttendanceMetrics'):
+        """Fold another group's metrics into this one"""
+        self.employees += other.employees
+        self.days_worked += other.days_worked
+        self.hours_days += other.hours_days
+        self.expected_days += other.expected_days
+        self.late_days += other.late_days
+        self.late_minutes += other.late_minutes
+        self.early_departures += other.early_departures
+        self.total_hours += other.total_hours
+        self.overtime_hours += other.overtime_hours
+        self._hours_sum_sq += other._hours_sum_sq
+        for day, count in other.dow_distribution.items():
+            self.dow_distribution[day] += count
+        for week, hours in other.weekly_overtime.items():
+            self.weekly_overtime[week] = self.weekly_overtime.get(week, 0.0) + hours
+
+    @property
+    def lateness_rate(self) -> float:
+        return self.late_days / self.days_worked if self.days_worked else 0.0
+
+    @property
+    def punctuality_rate(self) -> float:
+        return 1 - self.lateness_rate if self.days_worked else 0.0
+
+    @property
+    def avg_minutes_late(self) -> float:
+        return self.late_minutes / self.late_days if self.late_days else 0.0
+
+    @property
+    def attendance_rate(self) -> float:
+        return min(1.0, self.days_worked / self.expected_days) if self.expected_days else 0.0
+
+    @property
+    def absence_rate(self) -> float:
+        return 1 - self.attendance_rate if self.expected_days else 0.0
+
+    @property
+    def avg_daily_hours(self) -> float:
+        return self.total_hours / self.hours_days if self.hours_days else 0.0
+
+    @property
+    def hours_variance(self) -> float:
+        """Population variance of daily worked hours"""
+        if not self.hours_days:
+            return 0.0
+        mean = self.avg_daily_hours
+        return max(0.0, self._hours_sum_sq / self.hours_days - mean * mean)
+
+    @property
+    def overtime_trend(self) -> float:
+        """Least-squares slope of weekly overtime hours, in hours per week"""
+        weeks = sorted(self.weekly_overtime)
+        if len(weeks) < 2:
+            return 0.0
+        xs = [(week - weeks[0]).days / 7 for week in weeks]
+        ys = [self.weekly_overtime[week] for week in weeks]
+        x_mean = sum(xs) / len(xs)
+        y_mean = sum(ys) / len(ys)
+        denominator = sum((x - x_mean) ** 2 for x in xs)
+        return sum((x - x_mean) * (y - y_mean) for x, y in zip(xs, ys)) / denominator
+
+    def to_dict(self) -> Dict:
+        return {
+            'employees': self.employees,
+            'days_worked': self.days_worked,
+            'expected_days': self.expected_days,
+            'attendance_rate': round(self.attendance_rate, 4),
+            'absence_rate': round(self.absence_rate, 4),
+            'late_days': self.late_days,
+            'lateness_rate': round(self.lateness_rate, 4),
+            'avg_minutes_late': round(self.avg_minutes_late, 1),
+            'early_departures': self.early_departures,
+            'total_hours': round(self.total_hours, 2),
+            'avg_daily_hours': round(self.avg_daily_hours, 2),
+            'hours_variance': round(self.hours_variance, 3),
+            'hours_std_dev': round(math.sqrt(self.hours_variance), 3),
+            'overtime_hours': round(self.overtime_hours, 2),
+            'overtime_trend': round(self.overtime_trend, 3),
+            'dow_distribution': dict(self.dow_distribution)
+        }
+
+
+@dataclass
+class AttendanceStatistics:
+    """Kernel output: metrics at employee, department and scope level plus daily series"""
+    start_date: date
+    end_date: date
+    overall: AttendanceMetrics
+    employees: Dict[int, AttendanceMetrics]
+    departments: Dict[Optional[int], AttendanceMetrics]
+    daily_headcount: Dict[date, int]
+    hour_coverage: Dict[int, int]
+    total_entries: int = 0
+
+
+def worked_hours_expression():
+    """SQL equivalent of TimeEntry.total_hours: the stored worked_hours column, 0 while open"""
+    return db.func.coalesce(TimeEntry.worked_hours, 0)
+
+
+def count_weekdays(start_date: date, end_date: date) -> int:
+    """Number of Monday-Friday days in the inclusive range"""
+    days = (end_date - start_date).days + 1
+    if days <= 0:
+        return 0
+    full_weeks, remainder = divmod(days, 7)
+    weekdays = full_weeks * 5
+    for offset in range(remainder):
+        if (start_date + timedelta(days=full_weeks * 7 + offset)).weekday() < 5:
+            weekdays += 1
+    return weekdays
+
+
+def compute_attendance_statistics(start_date: date, end_date: date,
+                                  user_ids: Optional[Iterable[int]] = None,
+                                  department_id: Optional[int] = None) -> AttendanceStatistics:
+    """
+    Aggregate time entries to one row per employee per work day in SQL, then fold
+    those rows into employee, department and overall metrics in a single pass.
+    """
+    work_date = TimeEntry.work_date
+
+    query = (
+        db.select(
+            TimeEntry.user_id, User.department_id, work_date.label('work_date'),
+            db.func.count(TimeEntry.id).label('entries'),
+            db.func.min(TimeEntry.clock_in_time).label('first_in'),
+            db.func.max(TimeEntry.clock_out_time).label('last_out'),
+            db.func.sum(worked_hours_expression()).label('worked_hours')
+        )
+        .join(User, User.id == TimeEntry.user_id)
+        .where(
+            TimeEntry.clock_in_time >= datetime.combine(start_date, time.min),
+            TimeEntry.clock_in_time < datetime.combine(end_date + timedelta(days=1), time.min)
+        )
+        .group_by(TimeEntry.user_id, User.department_id, work_date)
+    )
+    if user_ids is not None:
+        query = query.where(TimeEntry.user_id.in_(list(user_ids)))
+    if department_id:
+        query = query.where(User.department_id == department_id)
+
+    employees = defaultdict(AttendanceMetrics)
+    employee_departments = {}
+    daily_headcount = defaultdict(int)
+    hour_coverage = defaultdict(int)
+    total_entries = 0
+
+    for row in db.session.execute(query):
+        worked_hours = max(0.0, float(row.worked_hours or 0))
+        employees[row.user_id].add_day(row.work_date, row.first_in, row.last_out, worked_hours)
+        employee_departments[row.user_id] = row.department_id
+        daily_headcount[row.work_date] += 1
+        total_entries += row.entries
+
+        if row.last_out:
+            last_hour = row.last_out.hour if row.last_out.date() == row.work_date else 23
+            for hour in range(row.first_in.hour, last_hour + 1):
+                hour_coverage[hour] += 1
+
+    expected_days = count_weekdays(start_date, end_date)
+    overall = AttendanceMetrics()
+    departments = defaultdict(AttendanceMetrics)
+    for user_id, metrics in employees.items():
+        metrics.employees = 1
+        metrics.expected_days = expected_days
+        departments[employee_departments[user_id]].merge(metrics)
+        overall.merge(metrics)
+
+    return AttendanceStatistics(
+        start_date=start_date,
+        end_date=end_date,
+        overall=overall,
+        employees=dict(employees),
+        departments=dict(departments),
+        daily_headcount=dict(daily_headcount),
+        hour_coverage=dict(hour_coverage),
+        total_entries=total_entries
+    )
+
+
+def recent_attendance_statistics(days: int, user_ids: Optional[Iterable[int]] = None,
+                                 department_id: Optional[int] = None) -> AttendanceStatistics:
+    """Statistics for the trailing window of `days` days ending today"""
+    end_date = date.today()
+    return compute_attendance_statistics(end_date - timedelta(days=days), end_date, user_ids, department_id)
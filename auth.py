@@ -5,6 +5,8 @@ from flask_login import LoginManager, login_user, logout_user, login_required, c
 from urllib.parse import urlparse
 from app import db
 from models import User, Role, Department, Job
+from password_hashing import login_retry_after, record_login_failure, record_login_success
+from user_cache import load_identity
 from forms import LoginForm, RegistrationForm, EditUserForm, ChangePasswordForm
 
 # Create authentication blueprint
@@ -22,8 +24,8 @@ def init_login_manager(app):
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Load user for Flask-Login"""
-    return User.query.get(int(user_id))
+    """Load user for Flask-Login, with roles and department, from the short-lived identity cache"""
+    return load_identity(int(user_id))
 
 def role_required(*roles):
     """Decorator to require specific roles for access"""
@@ -87,11 +89,19 @@ def login():
     
     form = LoginForm()
     if form.validate_on_submit():
+        # Reject brute-force bursts before spending any time on hashing
+        retry_after = login_retry_after(form.username.data, request.remote_addr)
+        if retry_after:
+            flash(f'Too many failed login attempts. Please try again in {retry_after} seconds.', 'danger')
+            return redirect(url_for('auth.login'))
+        
         user = User.query.filter_by(username=form.username.data).first()
         
         if user is None or not user.check_password(form.password.data):
+            record_login_failure(form.username.data, request.remote_addr)
             flash('Invalid username or password', 'danger')
             return redirect(url_for('auth.login'))
+        record_login_success(form.username.data)
         
         if not user.is_active:
             flash('Your account has been deactivated. Please contact an administrator.', 'warning')
@@ -342,8 +342,8 @@ class AutomationEngine:
         time_entries = TimeEntry.query.filter(
             and_(
                 TimeEntry.user_id == employee.id,
-                func.date(TimeEntry.clock_in_time) >= period_start,
-                func.date(TimeEntry.clock_in_time) <= period_end,
+                TimeEntry.work_date >= period_start,
+                TimeEntry.work_date <= period_end,
                 TimeEntry.clock_out_time.isnot(None)
             )
         ).all()
@@ -719,7 +719,7 @@ def workflow_config():
             # Count pending approvals (entries missing clock-out times)
             pending_approvals = TimeEntry.query.filter(
                 and_(
-                    func.date(TimeEntry.clock_in_time) >= today - timedelta(days=7),
+                    TimeEntry.work_date >= today - timedelta(days=7),
                     TimeEntry.clock_out_time.is_(None)
                 )
             ).count()
@@ -727,7 +727,7 @@ def workflow_config():
             # Count exceptions today (missing clock-outs)
             exceptions_today = TimeEntry.query.filter(
                 and_(
-                    func.date(TimeEntry.clock_in_time) == today,
+                    TimeEntry.work_date == today,
                     TimeEntry.clock_out_time.is_(None)
                 )
             ).count()
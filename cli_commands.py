@@ -1,3 +1,6 @@
+import os
+import subprocess
+import sys
 import click
 from flask import current_app
 from flask.cli import with_appcontext
@@ -82,7 +85,93 @@ def init_roles():
     db.session.commit()
     click.echo('Role initialization complete!')
 
+@click.command('refresh-availability-features')
+@with_appcontext
+def refresh_availability_features():
+    """Recompute stale scheduling availability features"""
+    from scheduling_features import availability_feature_store
+    
+    refreshed = availability_feature_store.refresh_stale()
+    click.echo(f'Refreshed availability features for {refreshed} employees')
+
+@click.command('backfill-pulse-answers')
+@click.option('--batch-size', default=500, show_default=True, help='Responses per transaction')
+@with_appcontext
+def backfill_pulse_answers(batch_size):
+    """Normalise stored pulse survey responses into the answer table"""
+    from pulse_survey import backfill_answers
+    
+    written = backfill_answers(batch_size)
+    click.echo(f'Wrote answers for {written} pulse survey responses')
+
+@click.command('init-db')
+@click.option('--skip-migrations', is_flag=True, help='Only create missing tables')
+@with_appcontext
+def init_db(skip_migrations):
+    """Create missing tables, apply column and index migrations and seed notification types.
+    
+    Safe to run on every deploy: tables, columns and indexes that exist are left alone.
+    """
+    from app import db, init_database
+    
+    init_database()
+    if not skip_migrations:
+        if db.engine.dialect.name == 'postgresql':
+            from migration_add_indexes import run_migration
+            run_migration(current_app._get_current_object())
+        else:
+            click.echo('Skipping column and index migrations: they target PostgreSQL')
+    click.echo('Database initialised')
+
+def parse_import_times(stderr_text):
+    """Parse `python -X importtime` output into {module: (self_us, cumulative_us)}"""
+    timings = {}
+    for line in stderr_text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # column header
+        timings[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+    return timings
+
+@click.command('startup-profile')
+@click.option('--limit', default=25, show_default=True, help='Number of modules to list')
+@click.option('--sort', 'sort_by', type=click.Choice(['cumulative', 'self']), default='cumulative',
+              show_default=True, help='Rank modules by cumulative or self import time')
+@click.option('--subsystems', default=None,
+              help='Comma separated optional subsystems to enable (defaults to the current WFM_SUBSYSTEMS)')
+def startup_profile(limit, sort_by, subsystems):
+    """Report per-module import time of create_app() in a fresh interpreter"""
+    env = dict(os.environ)
+    if subsystems is not None:
+        env['WFM_SUBSYSTEMS'] = subsystems
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    script = (
+        'import time; started = time.perf_counter(); '
+        'from app import create_app; create_app(); '
+        'print(round((time.perf_counter() - started) * 1000, 1))'
+    )
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], cwd=project_dir, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise click.ClickException(f'create_app() failed:\n{result.stderr[-2000:]}')
+    
+    timings = parse_import_times(result.stderr)
+    column = 1 if sort_by == 'cumulative' else 0
+    ranked = sorted(timings.items(), key=lambda item: item[1][column], reverse=True)[:limit]
+    
+    click.echo(f'create_app() took {result.stdout.strip().splitlines()[-1]} ms, '
+               f'{len(timings)} modules imported')
+    click.echo(f'{"self ms":>10} {"cumulative ms":>14}  module')
+    for module, (self_us, cumulative_us) in ranked:
+        click.echo(f'{self_us / 1000:>10.1f} {cumulative_us / 1000:>14.1f}  {module}')
+
 def register_commands(app):
     """Register CLI commands with the app"""
     app.cli.add_command(create_superuser)
-    app.cli.add_command(init_roles)
\ No newline at end of file
+    app.cli.add_command(init_roles)
+    app.cli.add_command(refresh_availability_features)
+    app.cli.add_command(init_db)
+    app.cli.add_command(startup_profile)
+    app.cli.add_command(backfill_pulse_answers)
\ No newline at end of file
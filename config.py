@@ -32,6 +32,14 @@ class Config:
     # Application settings
     APP_NAME = os.environ.get('APP_NAME', 'WFM24/7')
     
+    # Optional subsystems to load: any of ai, sage, pulse, tenant (comma separated)
+    ENABLED_SUBSYSTEMS = frozenset(
+        name.strip() for name in os.environ.get('WFM_SUBSYSTEMS', 'ai,sage,pulse,tenant').split(',') if name.strip()
+    )
+    
+    # Create missing tables on every boot; deployments run `flask init-db` (tables and migrations) before starting
+    AUTO_CREATE_TABLES = os.environ.get('AUTO_CREATE_TABLES', 'False').lower() == 'true'
+    
     # Timezone configuration
     TIMEZONE = SAST
     
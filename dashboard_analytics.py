@@ -0,0 +1,367 @@
+"""
+Dashboard Analytics Engine
+Chart series, KPI snapshot and team counters for the dashboards from grouped queries, cached per scope for the day
+"""
+
+import os
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy.orm import aliased
+
+from app import db
+from attendance_stats import STANDARD_DAILY_HOURS, worked_hours_expression
+from models import Company, Department, LeaveApplication, LeaveBalance, Region, Schedule, Site, TimeEntry, User
+from tenant_scope import current_tenant_id
+from ttl_cache import TTLCache
+
+# Days of history behind the hourly pattern and the productivity ranking
+ANALYTICS_WINDOW_DAYS = 30
+DAILY_TREND_DAYS = 7
+WEEKLY_TREND_WEEKS = 4
+LEAVE_STATUSES = ('pending', 'approved', 'rejected')
+
+# Seconds a scope's charts are reused; entries are keyed by day so they never outlive it
+DASHBOARD_ANALYTICS_TTL = int(os.environ.get('DASHBOARD_ANALYTICS_TTL', '300'))
+
+# Seconds live team counters (present, on break, open entries) are reused; short because they move all day
+TEAM_STATS_TTL = int(os.environ.get('TEAM_STATS_TTL', '60'))
+
+# Shared by the chart series, the KPI snapshot and the team counters
+analytics_cache = TTLCache(ttl=DASHBOARD_ANALYTICS_TTL, max_entries=2048)
+
+
+@dataclass(frozen=True)
+class AnalyticsScope:
+    """Whose data the charts cover: everyone, a set of departments or one employee"""
+    kind: str  # 'all', 'departments' or 'user'
+    department_ids: Tuple[int, ...] = ()
+    user_id: Optional[int] = None
+
+    def filter_time_entries(self, query):
+        if self.kind == 'departments':
+            return query.join(User, User.id == TimeEntry.user_id).where(User.department_id.in_(self.department_ids))
+        if self.kind == 'user':
+            return query.where(TimeEntry.user_id == self.user_id)
+        return query
+
+    def filter_leave(self, query):
+        if self.kind == 'departments':
+            return query.join(User, User.id == LeaveApplication.user_id).where(
+                User.department_id.in_(self.department_ids))
+        if self.kind == 'user':
+            return query.where(LeaveApplication.user_id == self.user_id)
+        return query
+
+
+def resolve_scope(user, managed_department_ids, user_id=None) -> AnalyticsScope:
+    """Super users see everything, managers their departments, employees themselves"""
+    if user.has_role('Super User'):
+        return AnalyticsScope('all')
+    if user.has_role('Manager') and managed_department_ids:
+        return AnalyticsScope('departments', department_ids=tuple(sorted(managed_department_ids)))
+    if user_id:
+        return AnalyticsScope('user', user_id=user_id)
+    return AnalyticsScope('all')
+
+
+def _time_entry_buckets(scope: AnalyticsScope, start_date: date, end_date: date):
+    """Entries and worked hours per work day and clock-in hour, in one grouped query"""
+    work_date = TimeEntry.work_date
+    query = (
+        db.select(
+            work_date.label('work_date'),
+            TimeEntry.clock_in_hour,
+            db.func.count(TimeEntry.id).label('entries'),
+            db.func.sum(worked_hours_expression()).label('worked_hours')
+        )
+        .where(
+            TimeEntry.clock_in_time >= datetime.combine(start_date, time.min),
+            TimeEntry.clock_in_time < datetime.combine(end_date + timedelta(days=1), time.min)
+        )
+        .group_by(work_date, TimeEntry.clock_in_hour)
+    )
+    return db.session.execute(scope.filter_time_entries(query)).all()
+
+
+def _leave_status_counts(scope: AnalyticsScope) -> Dict[str, int]:
+    query = db.select(LeaveApplication.status, db.func.count(LeaveApplication.id)).group_by(LeaveApplication.status)
+    counts = defaultdict(int)
+    for status, count in db.session.execute(scope.filter_leave(query)):
+        counts[(status or '').lower()] += count
+    return counts
+
+
+def _top_contributors(scope: AnalyticsScope, start_date: date, limit: int = 5):
+    """Employees with the most worked hours in the window"""
+    hours = db.func.sum(worked_hours_expression())
+    query = (
+        db.select(User.username, hours.label('hours'))
+        .join(TimeEntry, TimeEntry.user_id == User.id)
+        .where(TimeEntry.clock_in_time >= datetime.combine(start_date, time.min))
+        .group_by(User.id, User.username)
+        .order_by(hours.desc())
+        .limit(limit)
+    )
+    if scope.kind == 'departments':
+        query = query.where(User.department_id.in_(scope.department_ids))
+    elif scope.kind == 'user':
+        query = query.where(User.id == scope.user_id)
+    return [{'name': row.username, 'hours': round(float(row.hours or 0), 1)}
+            for row in db.session.execute(query)]
+
+
+def compute_dashboard_analytics(scope: AnalyticsScope, include_productivity: bool,
+                                end_date: Optional[date] = None) -> Dict:
+    """Build every dashboard chart for a scope; series are zero-filled for days and hours without entries"""
+    end_date = end_date or date.today()
+    start_date = end_date - timedelta(days=ANALYTICS_WINDOW_DAYS)
+
+    daily_entries = defaultdict(int)
+    daily_hours = defaultdict(float)
+    hourly_patterns = [0] * 24
+    for row in _time_entry_buckets(scope, start_date, end_date):
+        daily_entries[row.work_date] += row.entries
+        daily_hours[row.work_date] += float(row.worked_hours or 0)
+        if row.clock_in_hour is not None:
+            hourly_patterns[row.clock_in_hour] += row.entries
+
+    days = [end_date - timedelta(days=offset) for offset in range(DAILY_TREND_DAYS - 1, -1, -1)]
+    daily_data = [{'date': day.strftime('%m/%d'), 'entries': daily_entries.get(day, 0)} for day in days]
+
+    this_week = end_date - timedelta(days=end_date.weekday())
+    week_starts = [this_week - timedelta(weeks=weeks) for weeks in range(WEEKLY_TREND_WEEKS - 1, -1, -1)]
+    weekly_hours = [
+        round(sum(daily_hours.get(week_start + timedelta(days=offset), 0.0) for offset in range(7)), 1)
+        for week_start in week_starts
+    ]
+
+    leave_stats = _leave_status_counts(scope)
+    productivity_data = _top_contributors(scope, start_date) if include_productivity else []
+
+    return {
+        'daily_attendance': {
+            'labels': [d['date'] for d in daily_data],
+            'data': [d['entries'] for d in daily_data]
+        },
+        'weekly_hours': {
+            'labels': [f"Week {week_start.strftime('%m/%d')}" for week_start in week_starts],
+            'data': weekly_hours
+        },
+        'leave_distribution': {
+            'labels': [status.title() for status in LEAVE_STATUSES],
+            'data': [leave_stats.get(status, 0) for status in LEAVE_STATUSES]
+        },
+        'productivity_insights': productivity_data,
+        'hourly_patterns': {
+            'labels': [f"{i}:00" for i in range(24)],
+            'data': hourly_patterns
+        },
+        'insights': {
+            'peak_hour': hourly_patterns.index(max(hourly_patterns)),
+            'total_entries_month': sum(d['entries'] for d in daily_data),
+            'avg_daily_entries': sum(d['entries'] for d in daily_data) / len(daily_data),
+            'most_productive_day': max(daily_data, key=lambda x: x['entries'])['date']
+        }
+    }
+
+
+def get_dashboard_analytics(scope: AnalyticsScope, include_productivity: bool) -> Dict:
+    """Dashboard charts for a scope, computed at most once per scope, tenant and day within the TTL"""
+    today = date.today()
+    return analytics_cache.get_or_set(
+        (current_tenant_id(), scope, include_productivity, today),
+        lambda: compute_dashboard_analytics(scope, include_productivity, today)
+    )
+
+
+def _scoped_count(scope: AnalyticsScope, count, user_id_column, *criteria):
+    """Scalar subquery counting the scope's rows of user_id_column's table that match criteria"""
+    query = db.select(count).where(*criteria)
+    if scope.kind == 'departments':
+        query = query.join(User, User.id == user_id_column).where(User.department_id.in_(scope.department_ids))
+    elif scope.kind == 'user':
+        query = query.where(user_id_column == scope.user_id)
+    return query.scalar_subquery()
+
+
+def _scoped_users(scope: AnalyticsScope, query):
+    """Restrict a query over users (or joined to them) to the scope and the current tenant.
+
+    Users are not among the automatically tenant-filtered models, so the predicate is explicit.
+    """
+    tenant_id = current_tenant_id()
+    if tenant_id is not None:
+        query = query.where(User.tenant_id == tenant_id)
+    if scope.kind == 'departments':
+        return query.where(User.department_id.in_(scope.department_ids))
+    if scope.kind == 'user':
+        return query.where(User.id == scope.user_id)
+    return query
+
+
+def compute_team_stats(scope: AnalyticsScope, today: Optional[date] = None) -> Dict:
+    """Team size, attendance and approval counters for a scope in one round trip.
+
+    Each counter is an index-backed subquery; "today" is a clock_in_time range
+    rather than a DATE() comparison, and department ids are bound parameters.
+    """
+    today = today or date.today()
+    day_start = datetime.combine(today, time.min)
+    day_end = day_start + timedelta(days=1)
+
+    team_size = _scoped_users(scope, db.select(db.func.count(User.id)).where(User.is_active == True))
+
+    entry_count = db.func.count(TimeEntry.id)
+    row = db.session.execute(db.select(
+        team_size.scalar_subquery().label('team_size'),
+        _scoped_count(scope, db.func.count(db.distinct(TimeEntry.user_id)), TimeEntry.user_id,
+                      TimeEntry.clock_in_time >= day_start, TimeEntry.clock_in_time < day_end).label('present_today'),
+        _scoped_count(scope, entry_count, TimeEntry.user_id, TimeEntry.clock_out_time.is_(None),
+                      TimeEntry.break_start_time.isnot(None), TimeEntry.break_end_time.is_(None)).label('on_break'),
+        _scoped_count(scope, entry_count, TimeEntry.user_id, TimeEntry.clock_out_time.is_(None)).label('open_entries'),
+        _scoped_count(scope, db.func.count(LeaveApplication.id), LeaveApplication.user_id,
+                      LeaveApplication.status == 'Pending').label('pending_leave'),
+        _scoped_count(scope, entry_count, TimeEntry.user_id, TimeEntry.worked_hours > STANDARD_DAILY_HOURS,
+                      TimeEntry.is_overtime_approved == False).label('pending_overtime')
+    )).one()
+
+    stats = {key: row._mapping[key] or 0 for key in row._mapping.keys()}
+    # Open timecards are what the manager dashboard asks to be approved
+    stats['pending_approvals'] = stats['open_entries']
+    return stats
+
+
+def get_team_stats(scope: AnalyticsScope) -> Dict:
+    """Team counters for a scope, shared by every manager with that scope for TEAM_STATS_TTL seconds"""
+    today = date.today()
+    return analytics_cache.get_or_set(
+        ('team_stats', current_tenant_id(), scope, today),
+        lambda: compute_team_stats(scope, today),
+        ttl=TEAM_STATS_TTL
+    )
+
+
+def _org_counts():
+    """Companies, regions, sites and departments; within a tenant, only those its employees belong to"""
+    org = {
+        'companies': db.select(db.func.count(Company.id)),
+        'regions': db.select(db.func.count(Region.id)),
+        'sites': db.select(db.func.count(Site.id)),
+        'departments': db.select(db.func.count(Department.id)),
+    }
+    tenant_id = current_tenant_id()
+    if tenant_id is None:
+        return {name: query.scalar_subquery() for name, query in org.items()}
+    tenant_departments = (
+        db.select(Department.id, Department.site_id, Site.region_id, Region.company_id)
+        .join(Site, Site.id == Department.site_id)
+        .join(Region, Region.id == Site.region_id)
+        .where(Department.id.in_(db.select(User.department_id).where(User.tenant_id == tenant_id)))
+        .subquery()
+    )
+    return {
+        'companies': db.select(db.func.count(db.distinct(tenant_departments.c.company_id))).scalar_subquery(),
+        'regions': db.select(db.func.count(db.distinct(tenant_departments.c.region_id))).scalar_subquery(),
+        'sites': db.select(db.func.count(db.distinct(tenant_departments.c.site_id))).scalar_subquery(),
+        'departments': db.select(db.func.count(tenant_departments.c.id)).scalar_subquery(),
+    }
+
+
+def compute_kpi_counters(scope: AnalyticsScope, now: Optional[datetime] = None) -> Dict:
+    """Every counter behind the dashboard KPI snapshot, in one round trip.
+
+    Time entries, leave and schedules are tenant-filtered by tenant_scope; users and
+    leave balances get the tenant predicate from _scoped_users. The workflow and
+    conflict counters cover the whole tenant, whatever the scope.
+    """
+    now = now or datetime.now()
+    today = now.date()
+    day_start = datetime.combine(today, time.min)
+    day_end = day_start + timedelta(days=1)
+    month_start = day_start.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+    everyone = AnalyticsScope('all')
+
+    entry_count = db.func.count(TimeEntry.id)
+    leave_count = db.func.count(LeaveApplication.id)
+    schedule_count = db.func.count(Schedule.id)
+    closed = (TimeEntry.clock_in_time.isnot(None), TimeEntry.clock_out_time.isnot(None))
+    overtime = db.func.coalesce(db.func.sum(db.case(
+        (TimeEntry.worked_hours > STANDARD_DAILY_HOURS, TimeEntry.worked_hours - STANDARD_DAILY_HOURS), else_=0
+    )), 0)
+
+    def users(column, *criteria):
+        return _scoped_users(scope, db.select(column).where(*criteria)).scalar_subquery()
+
+    managed_ids = db.select(User.manager_id).where(User.manager_id.isnot(None))
+    first = aliased(Schedule)
+    second = aliased(Schedule)
+    conflicts = (
+        db.select(db.func.count(db.distinct(first.user_id)))
+        .join(second, db.and_(
+            first.user_id == second.user_id, first.id != second.id,
+            first.start_time < second.end_time, first.end_time > second.start_time
+        ))
+        .where(first.status == 'Active', second.status == 'Active',
+               first.start_time >= day_start - timedelta(days=7))
+    )
+
+    counters = {
+        'total_users': users(db.func.count(User.id)),
+        'active_users_24h': users(db.func.count(User.id), User.last_login >= now - timedelta(hours=24),
+                                  User.is_active == True),
+        'avg_hourly_rate': users(db.func.avg(User.hourly_rate), User.hourly_rate.isnot(None), User.is_active == True),
+        'balance_issues': _scoped_users(scope, (
+            db.select(db.func.count(db.distinct(LeaveBalance.user_id)))
+            .join(User, User.id == LeaveBalance.user_id)
+            .where(LeaveBalance.balance < 0)
+        )).scalar_subquery(),
+        'total_time_entries': _scoped_count(scope, entry_count, TimeEntry.user_id),
+        'complete_entries': _scoped_count(scope, entry_count, TimeEntry.user_id, TimeEntry.clock_out_time.isnot(None)),
+        'pending_overtime': _scoped_count(scope, entry_count, TimeEntry.user_id, *closed,
+                                          TimeEntry.worked_hours > STANDARD_DAILY_HOURS,
+                                          TimeEntry.is_overtime_approved == False),
+        'active_employees': _scoped_count(scope, db.func.count(db.distinct(TimeEntry.user_id)), TimeEntry.user_id,
+                                          TimeEntry.clock_in_time >= day_start - timedelta(days=7)),
+        'today_entries': _scoped_count(scope, entry_count, TimeEntry.user_id, TimeEntry.work_date == today),
+        'overtime_hours': _scoped_count(scope, overtime, TimeEntry.user_id, *closed),
+        'exceptions': _scoped_count(scope, entry_count, TimeEntry.user_id, TimeEntry.clock_out_time.is_(None)),
+        'monthly_hours': _scoped_count(scope, db.func.coalesce(db.func.sum(TimeEntry.worked_hours), 0),
+                                       TimeEntry.user_id, *closed, TimeEntry.clock_in_time >= month_start,
+                                       TimeEntry.clock_in_time < next_month),
+        'leave_applications': _scoped_count(scope, leave_count, LeaveApplication.user_id),
+        'pending_leave': _scoped_count(scope, leave_count, LeaveApplication.user_id,
+                                       LeaveApplication.status == 'Pending'),
+        'approved_month': _scoped_count(scope, leave_count, LeaveApplication.user_id,
+                                        LeaveApplication.status == 'Approved',
+                                        LeaveApplication.created_at >= month_start,
+                                        LeaveApplication.created_at < next_month),
+        'total_schedules': _scoped_count(scope, schedule_count, Schedule.user_id),
+        'shifts_today': _scoped_count(scope, schedule_count, Schedule.user_id,
+                                      Schedule.start_time >= day_start, Schedule.start_time < day_end),
+        'upcoming_shifts': _scoped_count(scope, schedule_count, Schedule.user_id, Schedule.start_time >= day_start,
+                                         Schedule.start_time < day_start + timedelta(days=8)),
+        # Tenant-wide workflow counters
+        'all_open_entries': _scoped_count(everyone, entry_count, TimeEntry.user_id,
+                                          TimeEntry.clock_out_time.is_(None)),
+        'all_time_entries': _scoped_count(everyone, entry_count, TimeEntry.user_id),
+        'all_complete_entries': _scoped_count(everyone, entry_count, TimeEntry.user_id,
+                                              TimeEntry.clock_out_time.isnot(None)),
+        'all_leave_applications': _scoped_count(everyone, leave_count, LeaveApplication.user_id),
+        'approved_leave': _scoped_count(everyone, leave_count, LeaveApplication.user_id,
+                                        LeaveApplication.status == 'Approved', LeaveApplication.approved_at.isnot(None)),
+        'completed_today': _scoped_count(everyone, leave_count, LeaveApplication.user_id,
+                                         LeaveApplication.approved_at >= day_start, LeaveApplication.approved_at < day_end),
+        'top_managers': _scoped_users(everyone, db.select(db.func.count(User.id)).where(
+            User.manager_id.is_(None), User.id.in_(_scoped_users(everyone, managed_ids))
+        )).scalar_subquery(),
+        'conflicts': conflicts.scalar_subquery(),
+    }
+    if scope.kind == 'all':
+        counters.update(_org_counts())
+
+    row = db.session.execute(db.select(*(query.label(name) for name, query in counters.items()))).one()
+    return {name: row._mapping[name] or 0 for name in counters}
@@ -3,13 +3,16 @@ Dashboard Management Module
 Handles role-based dashboard configuration and rendering
 """
 
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, g
 from flask_login import login_required, current_user
 from auth_simple import role_required, super_user_required
+from dashboard_analytics import AnalyticsScope, analytics_cache, compute_kpi_counters, get_team_stats, resolve_scope
+from tenant_scope import current_tenant_id
 from models import db, User, TimeEntry, Department, Company, Region, Site, LeaveApplication, Schedule, DashboardConfig
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_, text
 import json
+import logging
 
 def get_managed_departments(user_id):
     """Get list of department IDs that a manager oversees"""
@@ -20,213 +23,70 @@ def get_managed_departments(user_id):
 
 dashboard_bp = Blueprint('dashboard_mgmt', __name__, url_prefix='/dashboard')
 
+def get_dashboard_scope():
+    """The current user's analytics scope and managed departments, resolved once per request"""
+    if 'dashboard_scope' not in g:
+        managed_dept_ids = get_managed_departments(current_user.id) if current_user.has_role('Manager') else []
+        g.dashboard_scope = (resolve_scope(current_user, managed_dept_ids, current_user.id), managed_dept_ids)
+    return g.dashboard_scope
+
 def get_dashboard_data():
-    """Collect comprehensive dashboard data for all roles with proper department filtering"""
+    """KPI snapshot for the current user's scope, shared with users of the same scope for the day's TTL"""
+    scope, managed_dept_ids = get_dashboard_scope()
+    dashboard_data = analytics_cache.get_or_set(
+        ('kpi_snapshot', current_tenant_id(), scope, datetime.now().date()),
+        lambda: collect_dashboard_data(scope, managed_dept_ids),
+        cache_if=lambda data: data is not None
+    )
+    # Callers add their own sections, so never hand out the cached dict itself
+    return dict(dashboard_data or empty_dashboard_data())
+
+def collect_dashboard_data(scope, managed_dept_ids):
+    """Collect comprehensive dashboard data for all roles with proper department and tenant filtering"""
     try:
-        # System Statistics - Apply role-based filtering
-        from sqlalchemy import text
-        from datetime import datetime, timedelta
-        
-        # Determine user's access scope with managed departments
-        is_super_user = current_user.has_role('Super User')
-        is_manager = current_user.has_role('Manager')
-        managed_dept_ids = get_managed_departments(current_user.id) if is_manager else []
-        
-        # Apply role-based data filtering
-        if is_super_user:
-            # Super Users see all data
-            total_users = db.session.execute(text("SELECT COUNT(*) FROM users")).scalar() or 0
-            companies_count = db.session.execute(text("SELECT COUNT(*) FROM companies")).scalar() or 0
-            departments_count = db.session.execute(text("SELECT COUNT(*) FROM departments")).scalar() or 0
-            regions_count = db.session.execute(text("SELECT COUNT(*) FROM regions")).scalar() or 0
-            sites_count = db.session.execute(text("SELECT COUNT(*) FROM sites")).scalar() or 0
-            total_time_entries = db.session.execute(text("SELECT COUNT(*) FROM time_entries")).scalar() or 0
-            leave_applications = db.session.execute(text("SELECT COUNT(*) FROM leave_applications")).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            # Managers see only their managed departments' data
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            print(f"DEBUG: Manager {current_user.id} managing departments: {managed_dept_ids}")
-            print(f"DEBUG: dept_ids_str: {dept_ids_str}")
-            total_users = db.session.execute(text(
-                f"SELECT COUNT(*) FROM users WHERE department_id IN ({dept_ids_str})"
-            )).scalar() or 0
-            print(f"DEBUG: total_users: {total_users}")
-            companies_count = 1  # Manager sees only their company context
-            departments_count = len(managed_dept_ids)  # Manager sees their managed departments
-            regions_count = 1  # Manager sees only their region context
-            sites_count = 1  # Manager sees only their site context
-            total_time_entries = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-            leave_applications = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM leave_applications la 
-                JOIN users u ON la.user_id = u.id 
-                WHERE u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-        else:
-            # Employees or managers without departments see minimal data
-            total_users = 1  # Only themselves
-            companies_count = 1
-            departments_count = 1
-            regions_count = 1
-            sites_count = 1
-            total_time_entries = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 0
-            leave_applications = db.session.execute(text(
-                "SELECT COUNT(*) FROM leave_applications WHERE user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 0
-        
-        # Calculate actual system statistics with department filtering
-        if is_super_user:
-            # Super Users see all active users
-            active_users_24h = db.session.execute(text("""
-                SELECT COUNT(DISTINCT id) FROM users 
-                WHERE last_login >= NOW() - INTERVAL '24 hours' AND is_active = true
-            """)).scalar() or 0
-            
-            # Count actual pending tasks from workflows and approvals
-            pending_leave_approvals = db.session.execute(text(
-                "SELECT COUNT(*) FROM leave_applications WHERE status = 'Pending'"
-            )).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            # Managers see only their managed departments' active users
-            active_users_24h = db.session.execute(text(f"""
-                SELECT COUNT(DISTINCT id) FROM users 
-                WHERE last_login >= NOW() - INTERVAL '24 hours' 
-                AND is_active = true 
-                AND department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-            print(f"DEBUG: active_users_24h calculation: {active_users_24h}")
-            
-            # Count pending leave approvals for their managed departments only
-            pending_leave_approvals = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM leave_applications la 
-                JOIN users u ON la.user_id = u.id 
-                WHERE la.status = 'Pending' AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-        else:
-            # Employees see only their own data
-            active_users_24h = 1 if current_user.last_login and current_user.last_login >= datetime.now() - timedelta(hours=24) else 0
-            pending_leave_approvals = db.session.execute(text(
-                "SELECT COUNT(*) FROM leave_applications WHERE status = 'Pending' AND user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 0
-        
-        # Calculate pending overtime approvals with department filtering
-        if is_super_user:
-            pending_overtime_approvals = db.session.execute(text("""
-                SELECT COUNT(*) FROM time_entries 
-                WHERE is_overtime_approved = false 
-                AND clock_in_time IS NOT NULL 
-                AND clock_out_time IS NOT NULL
-                AND EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600 > 8
-            """)).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            pending_overtime_approvals = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE te.is_overtime_approved = false 
-                AND te.clock_in_time IS NOT NULL 
-                AND te.clock_out_time IS NOT NULL
-                AND EXTRACT(EPOCH FROM (te.clock_out_time - te.clock_in_time))/3600 > 8
-                AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
+        counters = compute_kpi_counters(scope)
+        total_users = counters['total_users']
+        
+        # Organisation counts are only queried for the all-data scope
+        if scope.kind == 'all':
+            companies_count = counters['companies']
+            regions_count = counters['regions']
+            sites_count = counters['sites']
+            departments_count = counters['departments']
+        elif scope.kind == 'departments':
+            companies_count = regions_count = sites_count = 1  # Manager sees only their own context
+            departments_count = len(managed_dept_ids)
         else:
-            pending_overtime_approvals = db.session.execute(text("""
-                SELECT COUNT(*) FROM time_entries 
-                WHERE user_id = :user_id
-                AND is_overtime_approved = false 
-                AND clock_in_time IS NOT NULL 
-                AND clock_out_time IS NOT NULL
-                AND EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600 > 8
-            """), {'user_id': current_user.id}).scalar() or 0
+            companies_count = regions_count = sites_count = departments_count = 1
         
-        total_pending_tasks = pending_leave_approvals + pending_overtime_approvals
-        
-        # Calculate data integrity based on complete vs incomplete records with department filtering
-        if is_super_user:
-            total_entries = db.session.execute(text("SELECT COUNT(*) FROM time_entries")).scalar() or 1
-            complete_entries = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE clock_out_time IS NOT NULL"
-            )).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            total_entries = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE u.department_id IN ({dept_ids_str})
-            """)).scalar() or 1
-            complete_entries = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE te.clock_out_time IS NOT NULL AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-        else:
-            total_entries = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 1
-            complete_entries = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE clock_out_time IS NOT NULL AND user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 0
+        total_pending_tasks = counters['pending_leave'] + counters['pending_overtime']
         
+        # Data integrity: complete vs incomplete records
+        total_entries = counters['total_time_entries'] or 1
+        complete_entries = counters['complete_entries']
         data_integrity_percentage = (complete_entries / total_entries * 100) if total_entries > 0 else 100
         
-        # Calculate system uptime based on successful database operations
-        # Use a high percentage based on successful data operations as a proxy
+        # Use a high percentage based on successful data operations as a proxy for uptime
         uptime_percentage = min(99.9, (complete_entries / total_entries * 100)) if total_entries > 0 else 99.9
         
         system_stats = {
             'uptime': round(uptime_percentage, 1),
-            'active_users': active_users_24h,
+            'active_users': counters['active_users_24h'],
             'pending_tasks': total_pending_tasks,
             'data_integrity': round(data_integrity_percentage, 1)
         }
         
-        # Calculate actual active employees with department filtering
-        if is_super_user:
-            active_employees = db.session.execute(text("""
-                SELECT COUNT(DISTINCT user_id) FROM time_entries 
-                WHERE clock_in_time >= CURRENT_DATE - INTERVAL '7 days'
-            """)).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            active_employees = db.session.execute(text(f"""
-                SELECT COUNT(DISTINCT te.user_id) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE te.clock_in_time >= CURRENT_DATE - INTERVAL '7 days'
-                AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-        else:
-            active_count = db.session.execute(text("""
-                SELECT COUNT(*) FROM time_entries 
-                WHERE user_id = :user_id AND clock_in_time >= CURRENT_DATE - INTERVAL '7 days'
-            """), {'user_id': current_user.id}).scalar()
-            active_employees = 1 if (active_count and active_count > 0) else 0
-        
         org_stats = {
             'companies': companies_count,
             'regions': regions_count,
             'sites': sites_count,
             'departments': departments_count,
             'total_employees': total_users,
-            'active_employees': active_employees
+            'active_employees': counters['active_employees']
         }
         
-        # User Role Statistics - Calculate from actual role data
-        # Check if users table has role-related fields
-        actual_managers = db.session.execute(text("""
-            SELECT COUNT(*) FROM users 
-            WHERE line_manager_id IS NULL AND id IN (
-                SELECT DISTINCT line_manager_id FROM users WHERE line_manager_id IS NOT NULL
-            )
-        """)).scalar() or 0
-        
         # Count users with manager responsibilities
-        managers = max(1, actual_managers)
+        managers = max(1, counters['top_managers'])
         # Estimate super users as small percentage or use actual admin count
         super_users = max(1, total_users // 20)
         employees = max(0, total_users - managers - super_users)
@@ -239,161 +99,30 @@ def get_dashboard_data():
             'active_accounts': total_users
         }
         
-        # Time & Attendance Statistics with department filtering
-        from datetime import datetime, timedelta
-        today = datetime.now().date()
-        
-        if is_super_user:
-            # Get actual today's entries for all users
-            today_entries = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE DATE(clock_in_time) = :today"
-            ), {'today': today}).scalar() or 0
-            
-            # Calculate actual overtime hours from time entries with both clock in and out
-            actual_overtime = db.session.execute(text("""
-                SELECT COALESCE(SUM(
-                    CASE WHEN EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600 > 8 
-                    THEN EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600 - 8 
-                    ELSE 0 END
-                ), 0) FROM time_entries 
-                WHERE clock_in_time IS NOT NULL AND clock_out_time IS NOT NULL
-            """)).scalar() or 0
-            
-            # Get exceptions (entries without clock out time)
-            exceptions = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE clock_out_time IS NULL"
-            )).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            # Manager sees only their managed departments' data
-            today_entries = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE DATE(te.clock_in_time) = :today AND u.department_id IN ({dept_ids_str})
-            """), {'today': today}).scalar() or 0
-            
-            actual_overtime = db.session.execute(text(f"""
-                SELECT COALESCE(SUM(
-                    CASE WHEN EXTRACT(EPOCH FROM (te.clock_out_time - te.clock_in_time))/3600 > 8 
-                    THEN EXTRACT(EPOCH FROM (te.clock_out_time - te.clock_in_time))/3600 - 8 
-                    ELSE 0 END
-                ), 0) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE te.clock_in_time IS NOT NULL AND te.clock_out_time IS NOT NULL
-                AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-            
-            exceptions = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE te.clock_out_time IS NULL AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-        else:
-            # Employee sees only their own data
-            today_entries = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE DATE(clock_in_time) = :today AND user_id = :user_id"
-            ), {'today': today, 'user_id': current_user.id}).scalar() or 0
-            
-            actual_overtime = db.session.execute(text("""
-                SELECT COALESCE(SUM(
-                    CASE WHEN EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600 > 8 
-                    THEN EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600 - 8 
-                    ELSE 0 END
-                ), 0) FROM time_entries 
-                WHERE clock_in_time IS NOT NULL AND clock_out_time IS NOT NULL
-                AND user_id = :user_id
-            """), {'user_id': current_user.id}).scalar() or 0
-            
-            exceptions = db.session.execute(text(
-                "SELECT COUNT(*) FROM time_entries WHERE clock_out_time IS NULL AND user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 0
-        
+        actual_overtime = float(counters['overtime_hours'])
         attendance_stats = {
-            'clock_ins_today': today_entries,
+            'clock_ins_today': counters['today_entries'],
             'expected_clock_ins': total_users,
-            'total_time_entries': total_time_entries,
+            'total_time_entries': counters['total_time_entries'],
             'overtime_hours': round(actual_overtime, 1),
-            'exceptions': exceptions
+            'exceptions': counters['exceptions']
         }
         
-        # Workflow Statistics
-        pending_approvals = db.session.execute(text(
-            "SELECT COUNT(*) FROM time_entries WHERE clock_out_time IS NULL"
-        )).scalar() or 0
-        
-        # Calculate actual workflow automation metrics
-        total_leave_applications = db.session.execute(text("SELECT COUNT(*) FROM leave_applications")).scalar() or 1
-        auto_approved_leaves = db.session.execute(text(
-            "SELECT COUNT(*) FROM leave_applications WHERE status = 'Approved' AND approved_at IS NOT NULL"
-        )).scalar() or 0
-        
-        total_time_calculations = db.session.execute(text("SELECT COUNT(*) FROM time_entries")).scalar() or 1
-        auto_calculated_times = db.session.execute(text(
-            "SELECT COUNT(*) FROM time_entries WHERE clock_out_time IS NOT NULL"
-        )).scalar() or 0
-        
-        # Calculate automation rate based on processed vs manual entries
-        automation_rate = ((auto_approved_leaves + auto_calculated_times) / (total_leave_applications + total_time_calculations) * 100) if (total_leave_applications + total_time_calculations) > 0 else 0
-        
-        # Count today's completed workflows
-        today_completed = db.session.execute(text("""
-            SELECT COUNT(*) FROM leave_applications 
-            WHERE DATE(approved_at) = CURRENT_DATE
-        """)).scalar() or 0
+        # Automation rate based on processed vs manual entries
+        total_leave_applications = counters['all_leave_applications'] or 1
+        total_time_calculations = counters['all_time_entries'] or 1
+        automation_rate = ((counters['approved_leave'] + counters['all_complete_entries']) / (total_leave_applications + total_time_calculations) * 100) if (total_leave_applications + total_time_calculations) > 0 else 0
         
         workflow_stats = {
             'active_workflows': 8,  # Would need workflow tracking system
             'automation_rate': round(automation_rate, 1),
-            'pending_approvals': pending_approvals,
-            'completed_today': today_completed
+            'pending_approvals': counters['all_open_entries'],
+            'completed_today': counters['completed_today']
         }
         
-        # Payroll Statistics with department filtering
-        current_month = datetime.now().month
-        current_year = datetime.now().year
-        
-        if is_super_user:
-            monthly_hours = db.session.execute(text("""
-                SELECT COALESCE(SUM(EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600), 0) 
-                FROM time_entries 
-                WHERE EXTRACT(MONTH FROM clock_in_time) = :month 
-                AND EXTRACT(YEAR FROM clock_in_time) = :year
-                AND clock_in_time IS NOT NULL AND clock_out_time IS NOT NULL
-            """), {'month': current_month, 'year': current_year}).scalar() or 0
-            
-            avg_hourly_rate = db.session.execute(text("""
-                SELECT COALESCE(AVG(hourly_rate), 150) FROM users 
-                WHERE hourly_rate IS NOT NULL AND is_active = true
-            """)).scalar() or 150
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            monthly_hours = db.session.execute(text(f"""
-                SELECT COALESCE(SUM(EXTRACT(EPOCH FROM (te.clock_out_time - te.clock_in_time))/3600), 0) 
-                FROM time_entries te 
-                JOIN users u ON te.user_id = u.id 
-                WHERE EXTRACT(MONTH FROM te.clock_in_time) = :month 
-                AND EXTRACT(YEAR FROM te.clock_in_time) = :year
-                AND te.clock_in_time IS NOT NULL AND te.clock_out_time IS NOT NULL
-                AND u.department_id IN ({dept_ids_str})
-            """), {'month': current_month, 'year': current_year}).scalar() or 0
-            
-            avg_hourly_rate = db.session.execute(text(f"""
-                SELECT COALESCE(AVG(hourly_rate), 150) FROM users 
-                WHERE hourly_rate IS NOT NULL AND is_active = true AND department_id IN ({dept_ids_str})
-            """)).scalar() or 150
-        else:
-            monthly_hours = db.session.execute(text("""
-                SELECT COALESCE(SUM(EXTRACT(EPOCH FROM (clock_out_time - clock_in_time))/3600), 0) 
-                FROM time_entries 
-                WHERE EXTRACT(MONTH FROM clock_in_time) = :month 
-                AND EXTRACT(YEAR FROM clock_in_time) = :year
-                AND clock_in_time IS NOT NULL AND clock_out_time IS NOT NULL
-                AND user_id = :user_id
-            """), {'month': current_month, 'year': current_year, 'user_id': current_user.id}).scalar() or 0
-            
-            avg_hourly_rate = getattr(current_user, 'hourly_rate', 150) or 150
-        
-        estimated_payroll = float(monthly_hours) * float(avg_hourly_rate)
+        monthly_hours = float(counters['monthly_hours'])
+        avg_hourly_rate = float(counters['avg_hourly_rate'] or 150)
+        estimated_payroll = monthly_hours * avg_hourly_rate
         
         # Calculate overtime percentage
         overtime_percentage = (actual_overtime / monthly_hours * 100) if monthly_hours > 0 else 0
@@ -401,149 +130,25 @@ def get_dashboard_data():
         payroll_stats = {
             'total_payroll': round(estimated_payroll),
             'overtime_cost': round(overtime_percentage, 1),
-            'pending_calculations': exceptions,  # Use actual incomplete entries
+            'pending_calculations': counters['exceptions'],  # Use actual incomplete entries
             'processed_employees': total_users
         }
         
-        # Leave Management Statistics with department filtering
-        if is_super_user:
-            pending_applications = db.session.execute(text(
-                "SELECT COUNT(*) FROM leave_applications WHERE status = 'Pending'"
-            )).scalar() or 0
-            
-            approved_month = db.session.execute(text("""
-                SELECT COUNT(*) FROM leave_applications 
-                WHERE status = 'Approved' 
-                AND EXTRACT(MONTH FROM created_at) = :month
-                AND EXTRACT(YEAR FROM created_at) = :year
-            """), {'month': current_month, 'year': current_year}).scalar() or 0
-            
-            balance_issues = db.session.execute(text("""
-                SELECT COUNT(DISTINCT user_id) FROM leave_balances 
-                WHERE balance < 0
-            """)).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            pending_applications = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM leave_applications la 
-                JOIN users u ON la.user_id = u.id 
-                WHERE la.status = 'Pending' AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-            
-            approved_month = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM leave_applications la 
-                JOIN users u ON la.user_id = u.id 
-                WHERE la.status = 'Approved' 
-                AND EXTRACT(MONTH FROM la.created_at) = :month
-                AND EXTRACT(YEAR FROM la.created_at) = :year
-                AND u.department_id IN ({dept_ids_str})
-            """), {'month': current_month, 'year': current_year}).scalar() or 0
-            
-            balance_issues = db.session.execute(text(f"""
-                SELECT COUNT(DISTINCT lb.user_id) FROM leave_balances lb 
-                JOIN users u ON lb.user_id = u.id 
-                WHERE lb.balance < 0 AND u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-        else:
-            pending_applications = db.session.execute(text(
-                "SELECT COUNT(*) FROM leave_applications WHERE status = 'Pending' AND user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 0
-            
-            approved_month = db.session.execute(text("""
-                SELECT COUNT(*) FROM leave_applications 
-                WHERE status = 'Approved' 
-                AND EXTRACT(MONTH FROM created_at) = :month
-                AND EXTRACT(YEAR FROM created_at) = :year
-                AND user_id = :user_id
-            """), {'month': current_month, 'year': current_year, 'user_id': current_user.id}).scalar() or 0
-            
-            balance_issues = db.session.execute(text("""
-                SELECT COUNT(*) FROM leave_balances 
-                WHERE balance < 0 AND user_id = :user_id
-            """), {'user_id': current_user.id}).scalar() or 0
-        
         leave_stats = {
-            'pending_applications': pending_applications,
-            'approved_month': approved_month,
-            'balance_issues': balance_issues
+            'pending_applications': counters['pending_leave'],
+            'approved_month': counters['approved_month'],
+            'balance_issues': counters['balance_issues']
         }
         
-        # Schedule Statistics with department filtering
-        if is_super_user:
-            total_schedules = db.session.execute(text("SELECT COUNT(*) FROM schedules")).scalar() or 0
-            
-            shifts_today = db.session.execute(text("""
-                SELECT COUNT(*) FROM schedules 
-                WHERE DATE(start_time) = :today
-            """), {'today': today}).scalar() or 0
-            
-            next_week = today + timedelta(days=7)
-            upcoming_shifts = db.session.execute(text("""
-                SELECT COUNT(*) FROM schedules 
-                WHERE DATE(start_time) BETWEEN :today AND :next_week
-            """), {'today': today, 'next_week': next_week}).scalar() or 0
-        elif is_manager and managed_dept_ids:
-            dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-            total_schedules = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM schedules s 
-                JOIN users u ON s.user_id = u.id 
-                WHERE u.department_id IN ({dept_ids_str})
-            """)).scalar() or 0
-            
-            shifts_today = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM schedules s 
-                JOIN users u ON s.user_id = u.id 
-                WHERE DATE(s.start_time) = :today AND u.department_id IN ({dept_ids_str})
-            """), {'today': today}).scalar() or 0
-            
-            next_week = today + timedelta(days=7)
-            upcoming_shifts = db.session.execute(text(f"""
-                SELECT COUNT(*) FROM schedules s 
-                JOIN users u ON s.user_id = u.id 
-                WHERE DATE(s.start_time) BETWEEN :today AND :next_week
-                AND u.department_id IN ({dept_ids_str})
-            """), {'today': today, 'next_week': next_week}).scalar() or 0
-        else:
-            total_schedules = db.session.execute(text(
-                "SELECT COUNT(*) FROM schedules WHERE user_id = :user_id"
-            ), {'user_id': current_user.id}).scalar() or 0
-            
-            shifts_today = db.session.execute(text("""
-                SELECT COUNT(*) FROM schedules 
-                WHERE DATE(start_time) = :today AND user_id = :user_id
-            """), {'today': today, 'user_id': current_user.id}).scalar() or 0
-            
-            next_week = today + timedelta(days=7)
-            upcoming_shifts = db.session.execute(text("""
-                SELECT COUNT(*) FROM schedules 
-                WHERE DATE(start_time) BETWEEN :today AND :next_week
-                AND user_id = :user_id
-            """), {'today': today, 'next_week': next_week, 'user_id': current_user.id}).scalar() or 0
-        
-        # Calculate coverage rate based on scheduled vs actual attendance
-        coverage_rate = min(100, (today_entries / max(1, shifts_today)) * 100) if shifts_today > 0 else 100
-        
-        # Calculate actual scheduling conflicts
-        # Check for overlapping schedules for the same employee
-        conflicts = db.session.execute(text("""
-            WITH overlapping_schedules AS (
-                SELECT DISTINCT s1.user_id
-                FROM schedules s1
-                JOIN schedules s2 ON s1.user_id = s2.user_id 
-                AND s1.id != s2.id
-                AND s1.start_time < s2.end_time 
-                AND s1.end_time > s2.start_time
-                WHERE s1.status = 'Active' AND s2.status = 'Active'
-                AND DATE(s1.start_time) >= CURRENT_DATE - INTERVAL '7 days'
-            )
-            SELECT COUNT(*) FROM overlapping_schedules
-        """)).scalar() or 0
+        # Coverage rate based on scheduled vs actual attendance
+        shifts_today = counters['shifts_today']
+        coverage_rate = min(100, (counters['today_entries'] / max(1, shifts_today)) * 100) if shifts_today > 0 else 100
         
         schedule_stats = {
             'shifts_today': shifts_today,
             'coverage_rate': round(coverage_rate, 1),
-            'conflicts': conflicts,
-            'upcoming_shifts': upcoming_shifts
+            'conflicts': counters['conflicts'],
+            'upcoming_shifts': counters['upcoming_shifts']
         }
         
         return {
@@ -558,27 +163,21 @@ def get_dashboard_data():
         }
         
     except Exception as e:
-        print(f"Exception in get_dashboard_data: {e}")
-        import traceback
-        traceback.print_exc()
-        # Log more details for debugging
-        print(f"Current user: {current_user.id if current_user else 'None'}")
-        try:
-            print(f"Is manager: {is_manager}")
-            print(f"Managed dept IDs: {managed_dept_ids}")
-        except NameError:
-            print("Variables not defined before exception")
-        # Return minimal safe data if database query fails
-        return {
-            'system_stats': {'uptime': 99.9, 'active_users': 0, 'pending_tasks': 0, 'data_integrity': 100},
-            'org_stats': {'companies': 0, 'regions': 0, 'sites': 0, 'departments': 0, 'total_employees': 0, 'active_employees': 0},
-            'user_stats': {'super_users': 0, 'managers': 0, 'employees': 0, 'recent_logins': 0, 'active_accounts': 0},
-            'attendance_stats': {'clock_ins_today': 0, 'expected_clock_ins': 0, 'on_time_percentage': 0, 'overtime_hours': 0, 'exceptions': 0},
-            'workflow_stats': {'active_workflows': 0, 'automation_rate': 0, 'pending_approvals': 0, 'completed_today': 0},
-            'payroll_stats': {'total_payroll': 0, 'overtime_cost': 0, 'pending_calculations': 0, 'processed_employees': 0},
-            'leave_stats': {'pending_applications': 0, 'approved_month': 0, 'balance_issues': 0},
-            'schedule_stats': {'shifts_today': 0, 'coverage_rate': 0, 'conflicts': 0, 'upcoming_shifts': 0}
-        }
+        logging.error(f"Error collecting dashboard data for scope {scope}: {e}", exc_info=True)
+        return None
+
+def empty_dashboard_data():
+    """Minimal safe data for when the database queries fail"""
+    return {
+        'system_stats': {'uptime': 99.9, 'active_users': 0, 'pending_tasks': 0, 'data_integrity': 100},
+        'org_stats': {'companies': 0, 'regions': 0, 'sites': 0, 'departments': 0, 'total_employees': 0, 'active_employees': 0},
+        'user_stats': {'super_users': 0, 'managers': 0, 'employees': 0, 'recent_logins': 0, 'active_accounts': 0},
+        'attendance_stats': {'clock_ins_today': 0, 'expected_clock_ins': 0, 'on_time_percentage': 0, 'overtime_hours': 0, 'exceptions': 0},
+        'workflow_stats': {'active_workflows': 0, 'automation_rate': 0, 'pending_approvals': 0, 'completed_today': 0},
+        'payroll_stats': {'total_payroll': 0, 'overtime_cost': 0, 'pending_calculations': 0, 'processed_employees': 0},
+        'leave_stats': {'pending_applications': 0, 'approved_month': 0, 'balance_issues': 0},
+        'schedule_stats': {'shifts_today': 0, 'coverage_rate': 0, 'conflicts': 0, 'upcoming_shifts': 0}
+    }
 
 def get_user_role():
     """Get the current user's primary role for dashboard selection"""
@@ -657,59 +256,18 @@ def manager_dashboard():
         if roles.get('manager', True):
             visible_sections.append(section_id)
     
-    # Get manager-specific data - Use department-filtered authentic data
-    is_super_user = current_user.has_role('Super User')
-    is_manager = current_user.has_role('Manager')
-    
-    # Import the proper function to get managed departments
-    from routes import get_managed_departments
-    managed_dept_ids = get_managed_departments(current_user.id) if is_manager else []
-    
-    if is_manager and managed_dept_ids and not is_super_user:
-        # Manager sees only their managed departments' team
-        dept_ids_str = ','.join(str(id) for id in managed_dept_ids)
-        
-        # Get managed department names
-        managed_departments = db.session.execute(text(f"""
-            SELECT name FROM departments WHERE id IN ({dept_ids_str})
-        """)).fetchall()
-        managed_dept_names = [dept.name for dept in managed_departments]
-        
-        team_size = db.session.execute(text(f"""
-            SELECT COUNT(*) FROM users WHERE department_id IN ({dept_ids_str}) AND is_active = true
-        """)).scalar() or 0
-        
-        # Present today - users who clocked in today in manager's departments
-        today = datetime.now().date()
-        present_today = db.session.execute(text(f"""
-            SELECT COUNT(DISTINCT te.user_id) FROM time_entries te 
-            JOIN users u ON te.user_id = u.id 
-            WHERE u.department_id IN ({dept_ids_str})
-            AND DATE(te.clock_in_time) = :today
-        """), {'today': today}).scalar() or 0
-        
-        # Pending approvals - open entries for manager's departments
-        pending_approvals = db.session.execute(text(f"""
-            SELECT COUNT(*) FROM time_entries te 
-            JOIN users u ON te.user_id = u.id 
-            WHERE u.department_id IN ({dept_ids_str}) AND te.clock_out_time IS NULL
-        """)).scalar() or 0
+    # Team counters for the manager's departments in one parameterised, cached statement
+    scope, managed_dept_ids = get_dashboard_scope()
+    if scope.kind == 'departments':
+        managed_dept_names = db.session.execute(
+            db.select(Department.name).where(Department.id.in_(managed_dept_ids)).order_by(Department.name)
+        ).scalars().all()
     else:
-        # Super user or non-manager sees full system data
+        # Super user or manager without departments sees full system data
+        scope = AnalyticsScope('all')
         managed_dept_names = ['All Departments']
-        team_size = db.session.execute(text("SELECT COUNT(*) FROM users WHERE is_active = true")).scalar() or 0
-        today = datetime.now().date()
-        present_today = db.session.execute(text("""
-            SELECT COUNT(DISTINCT user_id) FROM time_entries 
-            WHERE DATE(clock_in_time) = :today
-        """), {'today': today}).scalar() or 0
-        pending_approvals = db.session.execute(text("SELECT COUNT(*) FROM time_entries WHERE clock_out_time IS NULL")).scalar() or 0
     
-    team_stats = {
-        'team_size': team_size,
-        'present_today': present_today,
-        'pending_approvals': pending_approvals
-    }
+    team_stats = get_team_stats(scope)
     
     dashboard_data['team_stats'] = team_stats
     
@@ -739,7 +297,7 @@ def employee_dashboard():
     today_entries = TimeEntry.query.filter(
         and_(
             TimeEntry.user_id == current_user.id,
-            func.date(TimeEntry.clock_in_time) == today
+            TimeEntry.work_date == today
         )
     ).all()
     
@@ -753,7 +311,7 @@ def employee_dashboard():
     week_entries = TimeEntry.query.filter(
         and_(
             TimeEntry.user_id == current_user.id,
-            func.date(TimeEntry.clock_in_time) >= week_start,
+            TimeEntry.work_date >= week_start,
             TimeEntry.clock_out_time.isnot(None)
         )
     ).all()
@@ -5,33 +5,113 @@ Handles CSV import of employee data with validation and organizational assignmen
 
 import csv
 import io
-from datetime import datetime
+import logging
+import uuid
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 from flask import Blueprint, request, render_template, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
-from werkzeug.security import generate_password_hash
-from sqlalchemy import or_
+from password_hashing import hash_password
+from sqlalchemy import or_, func, insert, literal
 
 from app import db
-from models import User, Company, Region, Site, Department, Role
+from models import User, Company, Region, Site, Department, Role, user_roles, EmployeeImportStaging
 from auth import role_required
 
 # Create blueprint
 import_bp = Blueprint('employee_import', __name__, url_prefix='/employee-import')
 
+# Rows hashed and staged, or role links inserted, per bulk INSERT statement
+IMPORT_INSERT_CHUNK_SIZE = 1000
+
+# Row-level validation errors kept for display; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+# Rows shown on the confirmation page
+PREVIEW_ROW_COUNT = 10
+
+# Staged batches that were never confirmed are purged after this long
+STAGING_RETENTION = timedelta(hours=24)
+
+# Below this many passwords, hashing serially is cheaper than starting a process pool
+PARALLEL_HASH_THRESHOLD = 200
+
+
+def hash_passwords(passwords, executor=None):
+    """Hash a list of passwords, spreading the work across executor's processes for large batches"""
+    if executor is None or len(passwords) < PARALLEL_HASH_THRESHOLD:
+        return [hash_password(password) for password in passwords]
+    
+    try:
+        return list(executor.map(hash_password, passwords, chunksize=64))
+    except (OSError, RuntimeError) as e:
+        logging.warning(f"Parallel password hashing unavailable, hashing serially: {e}")
+        return [hash_password(password) for password in passwords]
+
+
+def parse_hire_date(value):
+    """Parse a hire date in YYYY-MM-DD or MM/DD/YYYY format"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        return datetime.strptime(value, '%m/%d/%Y').date()
+
+
+def load_active_departments():
+    """Map active department codes to (id, name) in a single query"""
+    rows = db.session.execute(
+        db.select(Department.code, Department.id, Department.name).where(Department.is_active == True)
+    ).all()
+    return {row.code: (row.id, row.name) for row in rows}
+
 class EmployeeImportValidator:
     """Validates employee data for import"""
     
     def __init__(self):
         self.errors = []
         self.warnings = []
-        self.valid_rows = []
         self.total_rows = 0
+        self.valid_count = 0
+        self.error_count = 0
+        self.preview_rows = []
+        self.department_counts = Counter()
+        self.batch_id = None
+        self._staged_buffer = []
+        self._hash_executor = None
+        self.existing_employee_ids = set()
+        self.existing_emails = set()
+        self.departments = {}
+        
+    def prefetch_lookups(self):
+        """Load existing employee numbers, emails and department codes once per file"""
+        self.existing_employee_ids = set(db.session.execute(
+            db.select(User.employee_number).where(User.employee_number.isnot(None))
+        ).scalars())
+        self.existing_emails = set(db.session.execute(
+            db.select(func.lower(User.email))
+        ).scalars())
+        self.departments = load_active_departments()
+        
+    def validate_csv_stream(self, stream, batch_id=None):
+        """Validate CSV rows read incrementally from a text stream.
         
-    def validate_csv_file(self, file_content):
-        """Validate CSV file format and content"""
+        When a batch_id is given, valid rows are written to the staging table in
+        chunks, so memory only holds the error summary and a short preview;
+        without one the file is only validated.
+        """
+        try:
+            return self._validate_csv_stream(stream, batch_id)
+        finally:
+            self._shutdown_hash_executor()
+    
+    def _validate_csv_stream(self, stream, batch_id):
+        self.batch_id = batch_id
         try:
             # Parse CSV
-            csv_reader = csv.DictReader(io.StringIO(file_content))
+            csv_reader = csv.DictReader(stream)
             
             # Check required headers
             required_headers = ['employee_id', 'first_name', 'last_name', 'email', 'department_code']
@@ -47,6 +127,8 @@ class EmployeeImportValidator:
                 self.errors.append(f"Missing required columns: {', '.join(missing_headers)}")
                 return False
             
+            self.prefetch_lookups()
+            
             # Validate each row
             row_number = 1
             employee_ids = set()
@@ -67,8 +149,7 @@ class EmployeeImportValidator:
                     employee_ids.add(employee_id)
                     
                 # Check if employee_id already exists in database
-                existing_user = User.query.filter_by(employee_id=employee_id).first()
-                if existing_user:
+                if employee_id and employee_id in self.existing_employee_ids:
                     row_errors.append(f"Employee ID {employee_id} already exists in database")
                 
                 first_name = row.get('first_name', '').strip()
@@ -90,8 +171,7 @@ class EmployeeImportValidator:
                     emails.add(email)
                     
                 # Check if email already exists in database
-                existing_email = User.query.filter_by(email=email).first()
-                if existing_email:
+                if email and email in self.existing_emails:
                     row_errors.append(f"Email {email} already exists in database")
                 
                 department_code = row.get('department_code', '').strip()
@@ -99,8 +179,7 @@ class EmployeeImportValidator:
                     row_errors.append("Department code is required")
                 else:
                     # Validate department exists
-                    department = Department.query.filter_by(code=department_code, is_active=True).first()
-                    if not department:
+                    if department_code not in self.departments:
                         row_errors.append(f"Department with code '{department_code}' not found")
                 
                 # Validate optional fields
@@ -141,7 +220,9 @@ class EmployeeImportValidator:
                         row_errors.append("Hourly rate must be a valid number")
                 
                 if row_errors:
-                    self.errors.append(f"Row {row_number}: {'; '.join(row_errors)}")
+                    self.error_count += 1
+                    if self.error_count <= MAX_REPORTED_ERRORS:
+                        self.errors.append(f"Row {row_number}: {'; '.join(row_errors)}")
                 else:
                     # Add valid row for processing
                     processed_row = {
@@ -158,90 +239,157 @@ class EmployeeImportValidator:
                         'salary': float(salary) if salary else None,
                         'hourly_rate': float(hourly_rate) if hourly_rate else None
                     }
-                    self.valid_rows.append(processed_row)
+                    self._accept_row(row_number, processed_row)
+            
+            if self.error_count > MAX_REPORTED_ERRORS:
+                self.errors.append(f"... and {self.error_count - MAX_REPORTED_ERRORS} more rows with errors")
+            
+            if self.batch_id:
+                if self.error_count == 0:
+                    self._flush_staged_rows()
+                    db.session.commit()
+                else:
+                    self.discard_staged_batch()
             
             return len(self.errors) == 0
             
         except Exception as e:
+            if self.batch_id:
+                self.discard_staged_batch()
             self.errors.append(f"Error processing CSV file: {str(e)}")
             return False
     
-    def import_employees(self):
-        """Import validated employee data to database"""
-        imported_count = 0
+    def _accept_row(self, row_number, processed_row):
+        """Record a valid row, staging it when validating into a batch"""
+        self.valid_count += 1
+        self.department_counts[processed_row['department_code']] += 1
+        if len(self.preview_rows) < PREVIEW_ROW_COUNT:
+            self.preview_rows.append(processed_row)
         
-        try:
-            # Get default employee role
-            employee_role = Role.query.filter_by(name='Employee').first()
-            if not employee_role:
-                # Create Employee role if it doesn't exist
-                employee_role = Role(name='Employee', description='Standard employee role')
-                db.session.add(employee_role)
-                db.session.flush()
-            
-            for row_data in self.valid_rows:
-                try:
-                    # Find department
-                    department = Department.query.filter_by(
-                        code=row_data['department_code'], 
-                        is_active=True
-                    ).first()
-                    
-                    if not department:
-                        self.errors.append(f"Department {row_data['department_code']} not found for employee {row_data['employee_id']}")
-                        continue
-                    
-                    # Parse hire date
-                    hire_date = None
-                    if row_data['hire_date']:
-                        try:
-                            hire_date = datetime.strptime(row_data['hire_date'], '%Y-%m-%d').date()
-                        except ValueError:
-                            hire_date = datetime.strptime(row_data['hire_date'], '%m/%d/%Y').date()
-                    
-                    # Create user
-                    user = User(
-                        employee_id=row_data['employee_id'],
-                        username=row_data['username'],
-                        first_name=row_data['first_name'],
-                        last_name=row_data['last_name'],
-                        email=row_data['email'],
-                        department_id=department.id,
-                        department=department.name,  # Legacy field
-                        phone_number=row_data['phone_number'],
-                        position=row_data['position'],
-                        hire_date=hire_date,
-                        employment_type=row_data['employment_type'],
-                        salary=row_data['salary'],
-                        hourly_rate=row_data['hourly_rate'],
-                        is_active=True,
-                        created_at=datetime.utcnow()
-                    )
-                    
-                    # Set default password (employee can change later)
-                    default_password = f"{row_data['first_name'].lower()}{row_data['employee_id']}"
-                    user.set_password(default_password)
-                    
-                    # Add employee role
-                    user.roles.append(employee_role)
-                    
-                    db.session.add(user)
-                    imported_count += 1
-                    
-                except Exception as e:
-                    self.errors.append(f"Error importing employee {row_data['employee_id']}: {str(e)}")
-                    continue
-            
-            if imported_count > 0:
-                db.session.commit()
-                current_app.logger.info(f"Successfully imported {imported_count} employees")
-            
-            return imported_count
-            
-        except Exception as e:
-            db.session.rollback()
-            self.errors.append(f"Database error during import: {str(e)}")
-            return 0
+        if not self.batch_id:
+            return
+        
+        # Once a file has errors nothing will be imported, so stop staging
+        if self.error_count:
+            self._staged_buffer = []
+            return
+        
+        self._staged_buffer.append((row_number, processed_row))
+        if len(self._staged_buffer) >= IMPORT_INSERT_CHUNK_SIZE:
+            self._flush_staged_rows()
+    
+    def _flush_staged_rows(self):
+        """Hash passwords for buffered rows and bulk insert them into the staging table"""
+        if not self._staged_buffer:
+            return
+        
+        passwords = [f"{row['first_name'].lower()}{row['employee_id']}" for _, row in self._staged_buffer]
+        staged = []
+        password_hashes = hash_passwords(passwords, self._get_hash_executor(len(passwords)))
+        for (row_number, row), password_hash in zip(self._staged_buffer, password_hashes):
+            staged.append({
+                'batch_id': self.batch_id,
+                'row_number': row_number,
+                'employee_number': row['employee_id'],
+                'username': row['username'],
+                'first_name': row['first_name'],
+                'last_name': row['last_name'],
+                'email': row['email'],
+                'department_id': self.departments[row['department_code']][0],
+                'phone': row['phone_number'] or None,
+                'position': row['position'] or None,
+                'hire_date': parse_hire_date(row['hire_date']),
+                'employment_type': row['employment_type'],
+                'annual_salary': row['salary'],
+                'hourly_rate': row['hourly_rate'],
+                'password_hash': password_hash,
+                'created_at': datetime.utcnow()
+            })
+        
+        db.session.execute(insert(EmployeeImportStaging), staged)
+        self._staged_buffer = []
+    
+    def _get_hash_executor(self, batch_size):
+        """Process pool shared by every chunk of this pass, started by the first chunk large enough to need it"""
+        if self._hash_executor is None and batch_size >= PARALLEL_HASH_THRESHOLD:
+            try:
+                self._hash_executor = ProcessPoolExecutor()
+            except (OSError, RuntimeError) as e:
+                logging.warning(f"Parallel password hashing unavailable, hashing serially: {e}")
+                self._hash_executor = False
+        return self._hash_executor or None
+    
+    def _shutdown_hash_executor(self):
+        if self._hash_executor:
+            self._hash_executor.shutdown()
+        self._hash_executor = None
+    
+    def discard_staged_batch(self):
+        """Remove any rows staged for this validator's batch"""
+        db.session.rollback()
+        db.session.execute(
+            db.delete(EmployeeImportStaging).where(EmployeeImportStaging.batch_id == self.batch_id)
+        )
+        db.session.commit()
+        self._staged_buffer = []
+
+def get_employee_role():
+    """Return the default Employee role, creating it if it doesn't exist"""
+    employee_role = Role.query.filter_by(name='Employee').first()
+    if not employee_role:
+        employee_role = Role(name='Employee', description='Standard employee role')
+        db.session.add(employee_role)
+        db.session.flush()
+    return employee_role
+
+
+def promote_staged_batch(batch_id):
+    """Move a staged import batch into users with INSERT ... SELECT ... RETURNING, then link their roles"""
+    employee_role = get_employee_role()
+    staging = EmployeeImportStaging.__table__
+    
+    user_columns = ['employee_number', 'username', 'first_name', 'last_name', 'email',
+                    'department_id', 'phone', 'hire_date', 'employment_type', 'annual_salary',
+                    'hourly_rate', 'password_hash', 'is_active', 'employment_status', 'created_at']
+    staged_users = (
+        db.select(
+            staging.c.employee_number, staging.c.username, staging.c.first_name,
+            staging.c.last_name, staging.c.email, staging.c.department_id, staging.c.phone,
+            staging.c.hire_date, staging.c.employment_type, staging.c.annual_salary,
+            staging.c.hourly_rate, staging.c.password_hash, literal(True), literal('active'),
+            staging.c.created_at
+        )
+        .join(Department.__table__, Department.id == staging.c.department_id)
+        .where(staging.c.batch_id == batch_id, Department.is_active == True)
+        .order_by(staging.c.row_number)
+    )
+    # Role links use exactly the ids just inserted; employee numbers are not unique in users
+    user_ids = db.session.execute(
+        User.__table__.insert().from_select(user_columns, staged_users).returning(User.__table__.c.id)
+    ).scalars().all()
+    imported_count = len(user_ids)
+    
+    for start in range(0, imported_count, IMPORT_INSERT_CHUNK_SIZE):
+        db.session.execute(
+            user_roles.insert(),
+            [{'user_id': user_id, 'role_id': employee_role.id} for user_id in user_ids[start:start + IMPORT_INSERT_CHUNK_SIZE]]
+        )
+    
+    db.session.execute(db.delete(staging).where(staging.c.batch_id == batch_id))
+    db.session.commit()
+    
+    current_app.logger.info(f"Successfully imported {imported_count} employees from batch {batch_id}")
+    return imported_count
+
+
+def purge_stale_staging():
+    """Drop staged batches that were uploaded but never confirmed"""
+    db.session.execute(
+        db.delete(EmployeeImportStaging).where(
+            EmployeeImportStaging.created_at < datetime.utcnow() - STAGING_RETENTION
+        )
+    )
+    db.session.commit()
 
 @import_bp.route('/')
 @login_required
@@ -271,25 +419,27 @@ def upload_csv():
             return redirect(request.url)
         
         try:
-            # Read file content
-            file_content = file.read().decode('utf-8')
+            purge_stale_staging()
             
-            # Validate CSV
+            # Validate CSV incrementally, staging valid rows under a new batch id
+            stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
             validator = EmployeeImportValidator()
-            is_valid = validator.validate_csv_file(file_content)
+            is_valid = validator.validate_csv_stream(stream, batch_id=str(uuid.uuid4()))
             
             if is_valid:
-                # Store validation results in session for confirmation
-                import json
+                # Only the batch reference and a small summary live in the session
                 from flask import session
                 
                 session['import_data'] = {
-                    'valid_rows': validator.valid_rows,
+                    'batch_id': validator.batch_id,
+                    'valid_count': validator.valid_count,
                     'total_rows': validator.total_rows,
-                    'filename': file.filename
+                    'filename': file.filename,
+                    'preview_rows': validator.preview_rows,
+                    'department_counts': dict(validator.department_counts)
                 }
                 
-                flash(f'CSV validation successful! {len(validator.valid_rows)} employees ready for import.', 'success')
+                flash(f'CSV validation successful! {validator.valid_count} employees ready for import.', 'success')
                 return redirect(url_for('employee_import.confirm_import'))
             else:
                 # Show validation errors
@@ -318,11 +468,8 @@ def confirm_import():
     
     if request.method == 'POST':
         try:
-            # Execute import
-            validator = EmployeeImportValidator()
-            validator.valid_rows = import_data['valid_rows']
-            
-            imported_count = validator.import_employees()
+            # Promote the staged batch in set-based statements
+            imported_count = promote_staged_batch(import_data['batch_id'])
             
             if imported_count > 0:
                 flash(f'Successfully imported {imported_count} employees!', 'success')
@@ -332,9 +479,10 @@ def confirm_import():
             else:
                 return render_template('employee_import/confirm.html',
                                      import_data=import_data,
-                                     errors=validator.errors)
+                                     errors=['No staged employees could be imported. Please upload the file again.'])
         
         except Exception as e:
+            db.session.rollback()
             flash(f'Import failed: {str(e)}', 'error')
             return render_template('employee_import/confirm.html',
                                  import_data=import_data,
@@ -5,7 +5,7 @@ Fix All User Passwords Script
 Resets passwords for all users with proper hashing
 """
 
-from werkzeug.security import generate_password_hash
+from password_hashing import hash_password
 from app import app, db
 from models import User
 
@@ -30,7 +30,7 @@ def fix_all_passwords():
                 new_password = password_map.get(user.username, 'password123')
                 
                 # Generate proper password hash
-                user.password_hash = generate_password_hash(new_password)
+                user.password_hash = hash_password(new_password)
                 fixed_count += 1
                 
                 print(f"✅ Fixed password for user: {user.username}")
@@ -5,7 +5,7 @@ for the Time & Attendance System.
 """
 
 from sqlalchemy import text
-from app import app, db
+from app import create_app, db
 
 def add_user_columns_and_indexes():
     """Add new User columns and comprehensive indexes"""
@@ -123,9 +123,88 @@ def add_leave_balance_indexes():
     ]
     return migrations
 
-def run_migration():
-    """Execute all migration scripts"""
-    with app.app_context():
+def add_punch_ingest_constraints():
+    """Add idempotency key columns and the one-open-entry-per-user guarantee"""
+    migrations = [
+        "ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS clock_in_idempotency_key VARCHAR(64);",
+        "ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS clock_out_idempotency_key VARCHAR(64);",
+        
+        # Older duplicate open entries become exceptions so the unique index can be built
+        """UPDATE time_entries SET status = 'Exception'
+           WHERE status = 'Open' AND id NOT IN (
+               SELECT MAX(id) FROM time_entries WHERE status = 'Open' GROUP BY user_id
+           );""",
+        
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_time_entries_open_per_user ON time_entries(user_id) WHERE status = 'Open';",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_time_entries_clock_in_key ON time_entries(user_id, clock_in_idempotency_key) WHERE clock_in_idempotency_key IS NOT NULL;",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_time_entries_clock_out_key ON time_entries(user_id, clock_out_idempotency_key) WHERE clock_out_idempotency_key IS NOT NULL;",
+    ]
+    return migrations
+
+def add_time_entry_generated_columns():
+    """Add stored work_date / clock_in_hour / worked_hours columns and their indexes"""
+    migrations = [
+        "ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS work_date DATE GENERATED ALWAYS AS (date(clock_in_time)) STORED;",
+        "ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS clock_in_hour INTEGER GENERATED ALWAYS AS (EXTRACT(hour FROM clock_in_time)) STORED;",
+        """ALTER TABLE time_entries ADD COLUMN IF NOT EXISTS worked_hours DOUBLE PRECISION GENERATED ALWAYS AS (
+               CASE WHEN clock_out_time IS NULL THEN NULL
+               ELSE (EXTRACT(epoch FROM clock_out_time) - EXTRACT(epoch FROM clock_in_time)) / 3600.0
+                    - COALESCE(total_break_minutes, 0) / 60.0
+               END) STORED;""",
+        
+        "CREATE INDEX IF NOT EXISTS idx_time_entries_work_date ON time_entries(work_date, user_id);",
+        "CREATE INDEX IF NOT EXISTS idx_time_entries_user_work_date ON time_entries(user_id, work_date);",
+        "CREATE INDEX IF NOT EXISTS idx_time_entries_clock_in_hour ON time_entries(clock_in_hour, clock_in_time);",
+        "CREATE INDEX IF NOT EXISTS idx_time_entries_pending_overtime ON time_entries(work_date, user_id) WHERE worked_hours > 8 AND is_overtime_approved = false;",
+    ]
+    return migrations
+
+def add_tenant_columns_and_indexes():
+    """Add tenant_id to the hot tables, backfill it from the owning user and index it first"""
+    migrations = []
+    for table in ('time_entries', 'schedules', 'leave_applications', 'notifications'):
+        migrations.extend([
+            f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS tenant_id INTEGER REFERENCES tenants(id);",
+            f"""UPDATE {table} t SET tenant_id = u.tenant_id FROM users u
+                WHERE t.user_id = u.id AND t.tenant_id IS NULL AND u.tenant_id IS NOT NULL;""",
+        ])
+    migrations.extend([
+        "CREATE INDEX IF NOT EXISTS idx_time_entries_tenant_user_date ON time_entries(tenant_id, user_id, clock_in_time);",
+        "CREATE INDEX IF NOT EXISTS idx_time_entries_tenant_work_date ON time_entries(tenant_id, work_date);",
+        "CREATE INDEX IF NOT EXISTS idx_schedules_tenant_user_date ON schedules(tenant_id, user_id, start_time);",
+        "CREATE INDEX IF NOT EXISTS idx_schedules_tenant_date ON schedules(tenant_id, start_time, end_time);",
+        "CREATE INDEX IF NOT EXISTS idx_leave_applications_tenant_user_date ON leave_applications(tenant_id, user_id, start_date);",
+        "CREATE INDEX IF NOT EXISTS idx_leave_applications_tenant_status ON leave_applications(tenant_id, status, created_at);",
+        "CREATE INDEX IF NOT EXISTS idx_notifications_tenant_user_created ON notifications(tenant_id, user_id, is_read, created_at);",
+    ])
+    return migrations
+
+def add_tenant_user_counter():
+    """Add the maintained Tenant.user_count column and seed it from the users table"""
+    migrations = [
+        "ALTER TABLE tenants ADD COLUMN IF NOT EXISTS user_count INTEGER NOT NULL DEFAULT 0;",
+        "UPDATE tenants SET user_count = (SELECT COUNT(*) FROM users WHERE users.tenant_id = tenants.id);",
+    ]
+    return migrations
+
+def add_user_pay_code_column():
+    """Add the employee pay code column the pay code admin assigns in bulk"""
+    migrations = [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS pay_code VARCHAR(32);",
+        "CREATE INDEX IF NOT EXISTS ix_users_pay_code ON users(pay_code);",
+    ]
+    return migrations
+
+def add_schedule_job_updated_at():
+    """Add the schedule job heartbeat used to detect jobs orphaned by a restart"""
+    migrations = [
+        "ALTER TABLE schedule_generation_jobs ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();",
+    ]
+    return migrations
+
+def run_migration(app=None):
+    """Execute all migration scripts against app, or a new app when run as a script"""
+    with (app or create_app()).app_context():
         try:
             # Collect all migrations
             all_migrations = []
@@ -134,6 +213,12 @@ def run_migration():
             all_migrations.extend(add_schedule_indexes())
             all_migrations.extend(add_leave_application_indexes())
             all_migrations.extend(add_leave_balance_indexes())
+            all_migrations.extend(add_punch_ingest_constraints())
+            all_migrations.extend(add_time_entry_generated_columns())
+            all_migrations.extend(add_tenant_columns_and_indexes())
+            all_migrations.extend(add_tenant_user_counter())
+            all_migrations.extend(add_user_pay_code_column())
+            all_migrations.extend(add_schedule_job_updated_at())
             
             print("Starting database indexing migration...")
             
@@ -155,6 +240,10 @@ def run_migration():
             print("• Schedule table: user+date combinations, conflict detection, shift management")
             print("• LeaveApplication table: user+date+status, overlap detection, approval workflows")
             print("• LeaveBalance table: user+type+year combinations for balance tracking")
+            print("• TimeEntry punches: one open entry per user, idempotency keys applied once")
+            print("• TimeEntry generated columns: work_date, clock_in_hour, worked_hours, pending overtime")
+            print("• Tenant scope: tenant_id on time entries, schedules, leave and notifications, tenant-leading indexes")
+            print("• Tenant user counter: tenants.user_count maintained on user changes")
             
         except Exception as e:
             print(f"Migration failed: {e}")
@@ -1,8 +1,12 @@
 from datetime import datetime, timedelta
 from app import db
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy.orm import relationship
+from password_hashing import password_hasher
+from sqlalchemy.ext.hybrid import hybrid_property
+from collections import defaultdict
+from sqlalchemy import event
+from sqlalchemy.orm import Session, column_property, relationship
+from tenant_scope import current_tenant_id
 import json
 
 # Organizational Hierarchy Models
@@ -254,6 +258,9 @@ class Tenant(db.Model):
     phone = db.Column(db.String(20), nullable=True)
     address = db.Column(db.Text, nullable=True)
     
+    # Number of users assigned to the tenant, kept current by _maintain_tenant_user_counts
+    user_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    
     # Audit fields
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -261,10 +268,9 @@ class Tenant(db.Model):
     def __repr__(self):
         return f'<Tenant {self.name}>'
     
-    @property
-    def user_count(self):
-        """Get current user count for this tenant"""
-        return User.query.filter_by(tenant_id=self.id).count()
+    def recount_users(self):
+        """Reset the counter from the users table"""
+        self.user_count = User.query.filter_by(tenant_id=self.id).count()
     
     @property
     def is_over_limit(self):
@@ -317,6 +323,15 @@ class TenantSettings(db.Model):
     
     def __repr__(self):
         return f'<TenantSettings for {self.tenant.name}>'
+    
+    @classmethod
+    def with_defaults(cls, tenant_id):
+        """Unsaved settings carrying the column defaults, for tenants that never saved any"""
+        settings = cls(tenant_id=tenant_id)
+        for column in cls.__table__.columns:
+            if column.default is not None and column.default.is_scalar:
+                setattr(settings, column.key, column.default.arg)
+        return settings
 
 # Association table for many-to-many relationship between users and roles
 user_roles = db.Table('user_roles',
@@ -343,7 +358,9 @@ class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
     id = db.Column(db.Integer, primary_key=True)
-    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True, index=True)  # Multi-tenant support
+    # Multi-tenant support; active_history keeps the previous tenant for the user counter
+    tenant_id = column_property(db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True, index=True),
+                                active_history=True)
     username = db.Column(db.String(64), nullable=False, index=True)  # Unique per tenant
     email = db.Column(db.String(120), nullable=False, index=True)  # Unique per tenant
     password_hash = db.Column(db.String(256))
@@ -389,6 +406,7 @@ class User(UserMixin, db.Model):
     passport_number = db.Column(db.String(50), nullable=True)
     
     # Payroll integration
+    pay_code = db.Column(db.String(32), nullable=True, index=True)  # PayCode.code; set in bulk by pay_code_assignment
     hourly_rate = db.Column(db.Float, nullable=True)
     annual_salary = db.Column(db.Float, nullable=True)
     pay_frequency = db.Column(db.String(20), nullable=True)
@@ -419,11 +437,18 @@ class User(UserMixin, db.Model):
     
     def set_password(self, password):
         """Hash and set password"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
     
     def check_password(self, password):
-        """Check if provided password matches hash"""
-        return check_password_hash(self.password_hash, password)
+        """Check if provided password matches hash, upgrading hashes made with outdated parameters.
+        
+        The upgraded hash is saved with the caller's next commit.
+        """
+        if not password_hasher.verify(self.password_hash, password):
+            return False
+        if password_hasher.needs_rehash(self.password_hash):
+            self.password_hash = password_hasher.hash(password)
+        return True
     
     def has_role(self, role_name):
         """Check if user has a specific role"""
@@ -467,6 +492,43 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+@event.listens_for(Session, 'after_flush')
+def _maintain_tenant_user_counts(session, flush_context):
+    """Apply user additions, removals and tenant moves to Tenant.user_count in the same transaction"""
+    deltas = defaultdict(int)
+    for user in session.new:
+        if isinstance(user, User) and user.tenant_id is not None:
+            deltas[user.tenant_id] += 1
+    for user in session.deleted:
+        if isinstance(user, User):
+            history = db.inspect(user).attrs.tenant_id.history
+            tenant_id = (history.deleted or history.unchanged or [user.tenant_id])[0]
+            if tenant_id is not None:
+                deltas[tenant_id] -= 1
+    for user in session.dirty:
+        if isinstance(user, User):
+            history = db.inspect(user).attrs.tenant_id.history
+            if history.has_changes():
+                for tenant_id in history.deleted:
+                    if tenant_id is not None:
+                        deltas[tenant_id] -= 1
+                for tenant_id in history.added:
+                    if tenant_id is not None:
+                        deltas[tenant_id] += 1
+    
+    tenants = Tenant.__table__
+    for tenant_id, delta in deltas.items():
+        if delta:
+            session.connection().execute(
+                tenants.update().where(tenants.c.id == tenant_id)
+                .values(user_count=tenants.c.user_count + delta)
+            )
+    # Loaded tenants re-read the counter on next access
+    for tenant_id in deltas:
+        tenant = session.identity_map.get(db.inspect(Tenant).identity_key_from_primary_key((tenant_id,)))
+        if tenant is not None:
+            session.expire(tenant, ['user_count'])
+
 class Post(db.Model):
     """Sample Post model to demonstrate relationships"""
     
@@ -511,6 +573,7 @@ class TimeEntry(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True, default=current_tenant_id)  # Stamped and filtered by tenant_scope
     clock_in_time = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     clock_out_time = db.Column(db.DateTime, nullable=True)
     status = db.Column(db.String(20), default='Open', nullable=False)  # 'Open', 'Closed', 'Exception'
@@ -540,6 +603,22 @@ class TimeEntry(db.Model):
     absence_approved_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     absence_approved_at = db.Column(db.DateTime, nullable=True)
     
+    # Client-supplied idempotency keys so retried punches are applied once
+    clock_in_idempotency_key = db.Column(db.String(64), nullable=True)
+    clock_out_idempotency_key = db.Column(db.String(64), nullable=True)
+    
+    # Stored generated columns so date, hour and worked-hours filters can use indexes.
+    # worked_hours matches total_hours: clocked time less breaks, NULL while open.
+    _work_date = db.Column('work_date', db.Date,
+                           db.Computed(db.func.date(clock_in_time), persisted=True))
+    clock_in_hour = db.Column(db.Integer,
+                              db.Computed(db.extract('hour', clock_in_time), persisted=True))
+    worked_hours = db.Column(db.Float, db.Computed(db.case(
+        (clock_out_time.is_(None), None),
+        else_=(db.extract('epoch', clock_out_time) - db.extract('epoch', clock_in_time)) / 3600.0
+              - db.func.coalesce(total_break_minutes, 0) / 60.0
+    ), persisted=True))
+    
     # Relationships
     employee = db.relationship('User', foreign_keys=[user_id], backref='time_entries')
     approved_by = db.relationship('User', foreign_keys=[approved_by_manager_id])
@@ -569,13 +648,44 @@ class TimeEntry(db.Model):
         
         # Geographic indexes for mobile tracking
         db.Index('idx_time_entries_location', 'clock_in_latitude', 'clock_in_longitude'),     # GPS location queries
+        
+        # Punch ingest guarantees: one open entry per user, each idempotency key applied once
+        db.Index('uq_time_entries_open_per_user', 'user_id', unique=True,
+                 postgresql_where=db.text("status = 'Open'"), sqlite_where=db.text("status = 'Open'")),
+        db.Index('uq_time_entries_clock_in_key', 'user_id', 'clock_in_idempotency_key', unique=True,
+                 postgresql_where=db.text('clock_in_idempotency_key IS NOT NULL'),
+                 sqlite_where=db.text('clock_in_idempotency_key IS NOT NULL')),
+        db.Index('uq_time_entries_clock_out_key', 'user_id', 'clock_out_idempotency_key', unique=True,
+                 postgresql_where=db.text('clock_out_idempotency_key IS NOT NULL'),
+                 sqlite_where=db.text('clock_out_idempotency_key IS NOT NULL')),
+        
+        # Generated column indexes: daily, hourly and overtime filters
+        db.Index('idx_time_entries_work_date', 'work_date', 'user_id'),              # Daily filters
+        db.Index('idx_time_entries_user_work_date', 'user_id', 'work_date'),         # User's days
+        db.Index('idx_time_entries_clock_in_hour', 'clock_in_hour', 'clock_in_time'), # Hourly drill-downs
+        db.Index('idx_time_entries_pending_overtime', 'work_date', 'user_id',
+                 postgresql_where=db.text('worked_hours > 8 AND is_overtime_approved = false'),
+                 sqlite_where=db.text('worked_hours > 8 AND is_overtime_approved = 0')),
+        
+        # Tenant-leading indexes so each tenant's plans only touch its own rows
+        db.Index('idx_time_entries_tenant_user_date', 'tenant_id', 'user_id', 'clock_in_time'),
+        db.Index('idx_time_entries_tenant_work_date', 'tenant_id', 'work_date'),
     )
     
+    # Fetch generated columns with RETURNING on insert/update instead of lazily per row
+    __mapper_args__ = {'eager_defaults': True}
+    
+    def _uses_stored_values(self):
+        """Generated columns are current once persisted and not modified since"""
+        return self._work_date is not None and not db.inspect(self).modified
+    
     @property
     def total_hours(self):
-        """Calculate total hours worked"""
+        """Total hours worked, read from the stored worked_hours column when current"""
         if not self.clock_out_time:
             return 0
+        if self._uses_stored_values() and self.worked_hours is not None:
+            return round(self.worked_hours, 2)
         
         total_time = self.clock_out_time - self.clock_in_time
         total_minutes = total_time.total_seconds() / 60
@@ -601,11 +711,17 @@ class TimeEntry(db.Model):
         """Calculate regular hours (up to 8)"""
         return min(8, self.total_hours)
     
-    @property
+    @hybrid_property
     def work_date(self):
-        """Get the work date (date of clock-in)"""
+        """Get the work date (date of clock-in); the stored column in queries"""
+        if self._uses_stored_values():
+            return self._work_date
         return self.clock_in_time.date()
     
+    @work_date.expression
+    def work_date(cls):
+        return cls._work_date
+    
     def can_be_approved_by(self, user):
         """Check if a user can approve this time entry"""
         # Super Users and Admins can approve any entry
@@ -664,6 +780,7 @@ class Schedule(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True, default=current_tenant_id)  # Stamped and filtered by tenant_scope
     shift_type_id = db.Column(db.Integer, db.ForeignKey('shift_types.id'), nullable=True)
     start_time = db.Column(db.DateTime, nullable=False)
     end_time = db.Column(db.DateTime, nullable=False)
@@ -703,6 +820,10 @@ class Schedule(db.Model):
         
         # Conflict detection indexes
         db.Index('idx_schedules_overlap_check', 'user_id', 'start_time', 'end_time'),      # Overlap detection
+        
+        # Tenant-leading indexes so each tenant's plans only touch its own rows
+        db.Index('idx_schedules_tenant_user_date', 'tenant_id', 'user_id', 'start_time'),
+        db.Index('idx_schedules_tenant_date', 'tenant_id', 'start_time', 'end_time'),
     )
     
     def duration_hours(self):
@@ -758,6 +879,7 @@ class LeaveApplication(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True, default=current_tenant_id)  # Stamped and filtered by tenant_scope
     leave_type_id = db.Column(db.Integer, db.ForeignKey('leave_types.id'), nullable=False)
     start_date = db.Column(db.Date, nullable=False)
     end_date = db.Column(db.Date, nullable=False)
@@ -801,6 +923,10 @@ class LeaveApplication(db.Model):
         # Overlap detection and conflict resolution indexes
         db.Index('idx_leave_applications_overlap_check', 'user_id', 'start_date', 'end_date'),        # Overlap detection
         db.Index('idx_leave_applications_pending_approval', 'status', 'created_at'),                  # Pending approval queue
+        
+        # Tenant-leading indexes so each tenant's plans only touch its own rows
+        db.Index('idx_leave_applications_tenant_user_date', 'tenant_id', 'user_id', 'start_date'),
+        db.Index('idx_leave_applications_tenant_status', 'tenant_id', 'status', 'created_at'),
     )
     
     def total_days(self):
@@ -1375,6 +1501,7 @@ class Notification(db.Model):
     
     # Target user
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    tenant_id = db.Column(db.Integer, db.ForeignKey('tenants.id'), nullable=True, default=current_tenant_id)  # Stamped and filtered by tenant_scope
     
     # Notification details
     type_id = db.Column(db.Integer, db.ForeignKey('notification_types.id'), nullable=False)
@@ -1405,6 +1532,11 @@ class Notification(db.Model):
     user = db.relationship('User', backref='notifications')
     notification_type = db.relationship('NotificationType', backref='notifications')
     
+    __table_args__ = (
+        # Tenant-leading index for the per-user inbox queries
+        db.Index('idx_notifications_tenant_user_created', 'tenant_id', 'user_id', 'is_read', 'created_at'),
+    )
+    
     def mark_as_read(self):
         """Mark notification as read"""
         self.is_read = True
@@ -1549,3 +1681,176 @@ class WorkflowExecution(db.Model):
     
     def __repr__(self):
         return f'<WorkflowExecution {self.workflow_type} {self.status}>'
+
+class EmployeeImportStaging(db.Model):
+    """Validated employee import rows held between CSV upload and confirmation"""
+    
+    __tablename__ = 'employee_import_staging'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(36), nullable=False)
+    row_number = db.Column(db.Integer, nullable=False)
+    
+    # Validated employee fields
+    employee_number = db.Column(db.String(20), nullable=False)
+    username = db.Column(db.String(64), nullable=False)
+    first_name = db.Column(db.String(64), nullable=False)
+    last_name = db.Column(db.String(64), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=False)
+    phone = db.Column(db.String(20), nullable=True)
+    position = db.Column(db.String(100), nullable=True)
+    hire_date = db.Column(db.Date, nullable=True)
+    employment_type = db.Column(db.String(20), nullable=False, default='full_time')
+    annual_salary = db.Column(db.Float, nullable=True)
+    hourly_rate = db.Column(db.Float, nullable=True)
+    password_hash = db.Column(db.String(256), nullable=False)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_employee_import_staging_batch', 'batch_id', 'row_number'),
+        db.Index('idx_employee_import_staging_created_at', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<EmployeeImportStaging {self.batch_id} row {self.row_number}>'
+
+class TimeClockImportStaging(db.Model):
+    """Paired terminal punches loaded in bulk before promotion into time_entries"""
+    
+    __tablename__ = 'time_clock_import_staging'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(36), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    clock_in_time = db.Column(db.DateTime, nullable=False)
+    clock_out_time = db.Column(db.DateTime, nullable=True)
+    status = db.Column(db.String(20), nullable=False)
+    notes = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_time_clock_import_staging_batch', 'batch_id', 'user_id', 'clock_in_time'),
+    )
+    
+    def __repr__(self):
+        return f'<TimeClockImportStaging {self.batch_id} user {self.user_id}>'
+
+class EmployeeAvailabilityFeature(db.Model):
+    """Precomputed scheduling features per employee, refreshed in batches"""
+    
+    __tablename__ = 'employee_availability_features'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    
+    # Histograms stored as JSON strings: {weekday: count}, {hour: count}
+    preferred_days = db.Column(db.Text, nullable=True)
+    preferred_shifts = db.Column(db.Text, nullable=True)
+    hour_distribution = db.Column(db.Text, nullable=True)
+    
+    preferred_start_hour = db.Column(db.Integer, default=9, nullable=False)
+    average_hours_per_week = db.Column(db.Float, default=0.0, nullable=False)
+    schedule_count = db.Column(db.Integer, default=0, nullable=False)
+    leave_count = db.Column(db.Integer, default=0, nullable=False)
+    availability_score = db.Column(db.Integer, default=100, nullable=False)
+    
+    # Set when the employee's schedules, entries or leave change
+    is_stale = db.Column(db.Boolean, default=False, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    
+    __table_args__ = (
+        db.Index('idx_availability_features_refresh', 'is_stale', 'computed_at'),
+    )
+    
+    @staticmethod
+    def _load_histogram(value):
+        """Parse a JSON histogram back into integer keys"""
+        try:
+            return {int(key): count for key, count in json.loads(value).items()} if value else {}
+        except (json.JSONDecodeError, ValueError):
+            return {}
+    
+    def to_availability(self):
+        """Return the feature set in the shape used by SchedulingAI"""
+        return {
+            'employee_id': self.user_id,
+            'historical_patterns': {
+                'preferred_days': self._load_histogram(self.preferred_days),
+                'preferred_shifts': self._load_histogram(self.preferred_shifts),
+                'average_hours_per_week': self.average_hours_per_week
+            },
+            'preferred_hours': {
+                'preferred_start_hour': self.preferred_start_hour,
+                'hour_distribution': self._load_histogram(self.hour_distribution)
+            },
+            'availability_score': self.availability_score
+        }
+    
+    def __repr__(self):
+        return f'<EmployeeAvailabilityFeature user {self.user_id}>'
+
+
+class ScheduleGenerationJob(db.Model):
+    """Background AI schedule generation run with progress and stored result"""
+    
+    __tablename__ = 'schedule_generation_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    department_id = db.Column(db.Integer, db.ForeignKey('departments.id'), nullable=True)
+    start_date = db.Column(db.Date, nullable=False)
+    end_date = db.Column(db.Date, nullable=False)
+    
+    status = db.Column(db.String(20), default='Queued', nullable=False)  # 'Queued', 'Running', 'Completed', 'Failed', 'Cancelled'
+    progress = db.Column(db.Integer, default=0, nullable=False)  # 0-100
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    
+    # JSON string: generate_optimized_schedule() result
+    result = db.Column(db.Text, nullable=True)
+    error_message = db.Column(db.Text, nullable=True)
+    applied_count = db.Column(db.Integer, nullable=True)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    applied_at = db.Column(db.DateTime, nullable=True)
+    # Moves with every status or progress write; a live job never goes quiet for long
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+    
+    requested_by = db.relationship('User', foreign_keys=[requested_by_id])
+    department = db.relationship('Department')
+    
+    __table_args__ = (
+        db.Index('idx_schedule_jobs_requester', 'requested_by_id', 'created_at'),  # User's recent jobs
+        db.Index('idx_schedule_jobs_status', 'status'),                            # Queued / running jobs
+    )
+    
+    @property
+    def is_finished(self):
+        """True once the job can no longer change"""
+        return self.status in ('Completed', 'Failed', 'Cancelled')
+    
+    def get_result(self):
+        """Return the parsed schedule result, or None while the job is unfinished"""
+        return json.loads(self.result) if self.result else None
+    
+    def to_dict(self):
+        """Status payload for the job API"""
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': self.progress,
+            'department_id': self.department_id,
+            'start_date': self.start_date.isoformat(),
+            'end_date': self.end_date.isoformat(),
+            'error': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'completed_at': self.completed_at.isoformat() if self.completed_at else None,
+            'applied_at': self.applied_at.isoformat() if self.applied_at else None,
+            'applied_count': self.applied_count
+        }
+    
+    def __repr__(self):
+        return f'<ScheduleGenerationJob {self.id} {self.status}>'
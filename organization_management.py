@@ -690,7 +690,7 @@ def my_department():
     for member in team_members:
         latest_entry = TimeEntry.query.filter(
             TimeEntry.user_id == member.id,
-            func.date(TimeEntry.clock_in_time) == today
+            TimeEntry.work_date == today
         ).order_by(TimeEntry.created_at.desc()).first()
         
         if latest_entry:
@@ -705,7 +705,7 @@ def my_department():
     for member in team_members:
         entries = TimeEntry.query.filter(
             TimeEntry.user_id == member.id,
-            func.date(TimeEntry.clock_in_time) == today
+            TimeEntry.work_date == today
         ).all()
         
         total_hours = 0
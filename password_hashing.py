@@ -0,0 +1,209 @@
+"""
+Password Hashing
+Pluggable password hashers with tunable cost, rehash-on-login and a sliding-window login throttle
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from argon2 import PasswordHasher as Argon2PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+except ImportError:  # pragma: no cover - optional dependency
+    Argon2PasswordHasher = None
+
+logger = logging.getLogger(__name__)
+
+# Hasher for new hashes: 'werkzeug' (scrypt/pbkdf2) or 'argon2' (requires argon2-cffi)
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'werkzeug')
+
+# Werkzeug method string, including cost: e.g. scrypt:32768:8:1 or pbkdf2:sha256:600000
+PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_SALT_LENGTH = int(os.environ.get('PASSWORD_SALT_LENGTH', '16'))
+
+# Argon2id cost parameters
+ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST', '2'))
+ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST', '19456'))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM', '1'))
+
+# Failed logins allowed within the window, per username and per client address.
+# The address limit is higher because shared kiosks and NAT put many users behind one address.
+LOGIN_MAX_FAILURES_PER_USER = int(os.environ.get('LOGIN_MAX_FAILURES_PER_USER', '5'))
+LOGIN_MAX_FAILURES_PER_ADDRESS = int(os.environ.get('LOGIN_MAX_FAILURES_PER_ADDRESS', '50'))
+LOGIN_FAILURE_WINDOW = int(os.environ.get('LOGIN_FAILURE_WINDOW', '300'))
+
+
+class WerkzeugHasher:
+    """scrypt / pbkdf2 hashes in werkzeug's "method$salt$hash" format"""
+
+    def __init__(self, method: str = PASSWORD_HASH_METHOD, salt_length: int = PASSWORD_SALT_LENGTH):
+        self.method = method
+        self.salt_length = salt_length
+        # werkzeug fills in default cost parameters, so compare against what it actually writes
+        self._prefix = generate_password_hash('', method, salt_length).split('$', 1)[0]
+
+    def identify(self, password_hash: str) -> bool:
+        return not password_hash.startswith('$')
+
+    def hash(self, password: str) -> str:
+        return generate_password_hash(password, self.method, self.salt_length)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        return check_password_hash(password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        method, _, salt_and_hash = password_hash.partition('$')
+        return method != self._prefix or len(salt_and_hash.split('$', 1)[0]) != self.salt_length
+
+
+class Argon2Hasher:
+    """Argon2id hashes in the standard "$argon2id$..." format"""
+
+    def __init__(self, time_cost: int = ARGON2_TIME_COST, memory_cost: int = ARGON2_MEMORY_COST,
+                 parallelism: int = ARGON2_PARALLELISM):
+        if Argon2PasswordHasher is None:
+            raise RuntimeError('argon2-cffi is not installed')
+        self._hasher = Argon2PasswordHasher(time_cost=time_cost, memory_cost=memory_cost,
+                                            parallelism=parallelism)
+
+    def identify(self, password_hash: str) -> bool:
+        return password_hash.startswith('$argon2')
+
+    def hash(self, password: str) -> str:
+        return self._hasher.hash(password)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        try:
+            return self._hasher.verify(password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        return self._hasher.check_needs_rehash(password_hash)
+
+
+class PasswordHasher:
+    """
+    Hashes with the configured hasher and verifies hashes written by any known
+    hasher, so changing PASSWORD_HASHER or its cost upgrades users as they log in.
+    """
+
+    def __init__(self, primary, legacy=()):
+        self.primary = primary
+        self.hashers = [primary, *legacy]
+
+    def _hasher_for(self, password_hash: str):
+        for hasher in self.hashers:
+            if hasher.identify(password_hash):
+                return hasher
+        return None
+
+    def hash(self, password: str) -> str:
+        return self.primary.hash(password)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        if not password_hash:
+            return False
+        hasher = self._hasher_for(password_hash)
+        return hasher is not None and hasher.verify(password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """True when the hash was written by another hasher or with other cost parameters"""
+        return self._hasher_for(password_hash) is not self.primary or self.primary.needs_rehash(password_hash)
+
+
+def _build_password_hasher() -> PasswordHasher:
+    werkzeug_hasher = WerkzeugHasher()
+    if PASSWORD_HASHER == 'argon2':
+        try:
+            return PasswordHasher(Argon2Hasher(), legacy=[werkzeug_hasher])
+        except RuntimeError as e:
+            logger.warning(f"Argon2 password hashing unavailable, using werkzeug: {e}")
+    return PasswordHasher(werkzeug_hasher)
+
+
+password_hasher = _build_password_hasher()
+
+
+def hash_password(password: str) -> str:
+    """Hash with the configured hasher (module-level so process pools can pickle it)"""
+    return password_hasher.hash(password)
+
+
+class LoginThrottle:
+    """
+    Sliding-window count of failed logins per key (username, client address).
+    Keys over the limit are rejected before any password hash is computed.
+    """
+
+    def __init__(self, max_failures: int, window: float = LOGIN_FAILURE_WINDOW,
+                 max_keys: int = 100000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self._failures = OrderedDict()  # key -> deque of failure timestamps
+        self._lock = threading.Lock()
+
+    def _prune(self, failures: deque, now: float):
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+
+    def retry_after(self, *keys) -> int:
+        """Seconds until any of the keys may try again; 0 when none are throttled"""
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for key in keys:
+                failures = self._failures.get(key)
+                if not failures:
+                    continue
+                self._prune(failures, now)
+                if len(failures) >= self.max_failures:
+                    wait = max(wait, failures[0] + self.window - now)
+        return int(wait) + 1 if wait > 0 else 0
+
+    def record_failure(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                failures = self._failures.get(key)
+                if failures is None:
+                    failures = self._failures[key] = deque(maxlen=self.max_failures)
+                self._prune(failures, now)
+                failures.append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def reset(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._failures.pop(key, None)
+
+
+user_login_throttle = LoginThrottle(LOGIN_MAX_FAILURES_PER_USER)
+address_login_throttle = LoginThrottle(LOGIN_MAX_FAILURES_PER_ADDRESS)
+
+
+def _username_key(username):
+    return (username or '').strip().lower()
+
+
+def login_retry_after(username, remote_addr) -> int:
+    """Seconds before this username or address may attempt another login; 0 when allowed"""
+    return max(user_login_throttle.retry_after(_username_key(username)),
+               address_login_throttle.retry_after(remote_addr or 'unknown'))
+
+
+def record_login_failure(username, remote_addr):
+    user_login_throttle.record_failure(_username_key(username))
+    address_login_throttle.record_failure(remote_addr or 'unknown')
+
+
+def record_login_success(username):
+    user_login_throttle.reset(_username_key(username))
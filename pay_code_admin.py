@@ -9,6 +9,7 @@ from sqlalchemy import func, desc
 from app import db
 from models import User, Department, PayCode
 from auth_simple import role_required, super_user_required
+from pay_code_assignment import assign_pay_codes as apply_pay_code_assignments, clear_pay_code, UPDATED, SUPERSEDED
 from datetime import datetime, date
 
 # Create pay code admin blueprint
@@ -195,40 +196,27 @@ def assign_pay_codes():
 def assign_individual_pay_code():
     """Assign pay code to individual employee"""
     try:
-        data = request.json
+        data = request.json or {}
         employee_id = data.get('employee_id')
-        pay_code_id = data.get('pay_code_id')
         
-        if not employee_id or not pay_code_id:
+        if not employee_id or not (data.get('pay_code_id') or data.get('pay_code')):
             return jsonify({
                 'success': False,
                 'message': 'Employee ID and Pay Code ID are required'
             }), 400
         
-        # Get employee and pay code
-        employee = User.query.get(employee_id)
-        pay_code = PayCode.query.get(pay_code_id)
-        
-        if not employee or not pay_code:
+        result = apply_pay_code_assignments([data])[0]
+        if result['status'] != UPDATED:
             return jsonify({
                 'success': False,
-                'message': 'Employee or Pay Code not found'
+                'message': 'Employee or Pay Code not found',
+                'result': result
             }), 404
         
-        # Check if already assigned
-        if pay_code in employee.pay_codes:
-            return jsonify({
-                'success': False,
-                'message': 'Pay code already assigned to this employee'
-            }), 400
-        
-        # Assign pay code
-        employee.pay_codes.append(pay_code)
-        db.session.commit()
-        
         return jsonify({
             'success': True,
-            'message': f'Pay code {pay_code.code} assigned to {employee.username}'
+            'message': f"Pay code {result['pay_code']} assigned to employee {result['employee_id']}",
+            'result': result
         })
         
     except Exception as e:
@@ -243,40 +231,36 @@ def assign_individual_pay_code():
 def remove_pay_code_assignment():
     """Remove pay code assignment from employee"""
     try:
-        data = request.json
+        data = request.json or {}
         employee_id = data.get('employee_id')
         pay_code_id = data.get('pay_code_id')
+        code = (data.get('pay_code') or '').strip().upper() or None
         
-        if not employee_id or not pay_code_id:
+        if not employee_id or not (pay_code_id or code):
             return jsonify({
                 'success': False,
                 'message': 'Employee ID and Pay Code ID are required'
             }), 400
         
-        # Get employee and pay code
-        employee = User.query.get(employee_id)
-        pay_code = PayCode.query.get(pay_code_id)
-        
-        if not employee or not pay_code:
-            return jsonify({
-                'success': False,
-                'message': 'Employee or Pay Code not found'
-            }), 404
+        if pay_code_id:
+            pay_code = db.session.get(PayCode, pay_code_id)
+            if not pay_code:
+                return jsonify({
+                    'success': False,
+                    'message': 'Employee or Pay Code not found'
+                }), 404
+            code = pay_code.code
         
-        # Check if assigned
-        if pay_code not in employee.pay_codes:
+        # Only clears the code the caller saw, so a concurrent reassignment is not undone
+        if not clear_pay_code(int(employee_id), code):
             return jsonify({
                 'success': False,
                 'message': 'Pay code not assigned to this employee'
             }), 400
         
-        # Remove pay code
-        employee.pay_codes.remove(pay_code)
-        db.session.commit()
-        
         return jsonify({
             'success': True,
-            'message': f'Pay code {pay_code.code} removed from {employee.username}'
+            'message': f'Pay code {code} removed from employee {employee_id}'
         })
         
     except Exception as e:
@@ -289,26 +273,30 @@ def remove_pay_code_assignment():
 @pay_code_admin_bp.route('/assign/bulk', methods=['POST'])
 @role_required('Admin', 'Super User')
 def bulk_assign_pay_codes():
-    """Process bulk pay code assignments"""
+    """Process bulk pay code assignments in one statement, reporting each row's outcome"""
     
     try:
-        assignments = request.json.get('assignments', [])
+        assignments = (request.json or {}).get('assignments', [])
+        if not isinstance(assignments, list):
+            return jsonify({
+                'success': False,
+                'message': 'Assignments must be a list.'
+            }), 400
         
-        updated_count = 0
-        for assignment in assignments:
-            employee_id = assignment.get('employee_id')
-            pay_code = assignment.get('pay_code')
-            
-            employee = User.query.get(employee_id)
-            if employee:
-                employee.pay_code = pay_code if pay_code else None
-                updated_count += 1
+        results = apply_pay_code_assignments(assignments)
+        updated_count = sum(1 for result in results if result['status'] == UPDATED)
+        rejected_count = sum(1 for result in results if result['status'] not in (UPDATED, SUPERSEDED))
         
-        db.session.commit()
+        message = f'Successfully updated pay codes for {updated_count} employees.'
+        if rejected_count:
+            message += f' {rejected_count} assignment(s) were rejected.'
         
         return jsonify({
             'success': True,
-            'message': f'Successfully updated pay codes for {updated_count} employees.'
+            'message': message,
+            'assigned_count': updated_count,
+            'rejected_count': rejected_count,
+            'results': results
         })
         
     except Exception as e:
@@ -0,0 +1,165 @@
+"""
+Pay Code Assignment
+Assigns employee pay codes in bulk with one UPDATE ... FROM (VALUES ...) statement, validated against a cached
+set of active pay codes, reporting an outcome for every requested row
+"""
+
+import os
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import Integer, String, column, event, values
+from sqlalchemy.orm import Session
+
+from app import db
+from models import PayCode, User
+from tenant_scope import current_tenant_id
+from ttl_cache import TTLCache
+
+# Seconds the active pay code set is reused; pay code edits in this process clear it straight away
+ACTIVE_PAY_CODES_TTL = int(os.environ.get('ACTIVE_PAY_CODES_TTL', '300'))
+
+# Rows per UPDATE statement; two bound parameters per row keeps each well under driver limits
+ASSIGNMENT_BATCH_ROWS = int(os.environ.get('ASSIGNMENT_BATCH_ROWS', '10000'))
+
+# Per-row outcomes
+UPDATED = 'updated'
+UNKNOWN_EMPLOYEE = 'unknown_employee'
+INVALID_PAY_CODE = 'invalid_pay_code'
+INVALID_ROW = 'invalid_row'
+SUPERSEDED = 'superseded'
+
+_active_pay_codes_cache = TTLCache(ttl=ACTIVE_PAY_CODES_TTL, max_entries=16)
+
+
+def active_pay_codes() -> Dict[str, int]:
+    """Active pay code -> id, read once per TTL"""
+    return _active_pay_codes_cache.get_or_set(
+        'active',
+        lambda: dict(db.session.execute(
+            db.select(PayCode.code, PayCode.id).where(PayCode.is_active == True)
+        ).all())
+    )
+
+
+def invalidate_active_pay_codes():
+    _active_pay_codes_cache.clear()
+
+
+def _requested_code(row: dict, codes_by_id: Dict[int, str]):
+    """(code, valid) for a payload row; a row may name its code or send the pay code id, blank clears it"""
+    if row.get('pay_code_id') not in (None, ''):
+        try:
+            code = codes_by_id.get(int(row['pay_code_id']))
+        except (TypeError, ValueError):
+            return None, False
+        return code, code is not None
+    code = (row.get('pay_code') or '').strip().upper()
+    if not code:
+        return None, True
+    return code, code in codes_by_id.values()
+
+
+def _assignment_statement(pairs: List[tuple]):
+    """One UPDATE setting users.pay_code for every (employee id, code) pair, returning the ids it matched"""
+    if db.session.get_bind().dialect.name == 'postgresql':
+        assignment = values(
+            column('employee_id', Integer), column('pay_code', String(32)), name='assignment'
+        ).data(pairs)
+        statement = db.update(User).where(User.id == assignment.c.employee_id).values(pay_code=assignment.c.pay_code)
+    else:
+        # SQLite cannot alias VALUES with column names; a CASE over the ids is the same single statement
+        statement = db.update(User).where(User.id.in_([employee_id for employee_id, _ in pairs])).values(
+            pay_code=db.case(dict(pairs), value=User.id)
+        )
+    tenant_id = current_tenant_id()
+    if tenant_id is not None:
+        statement = statement.where(User.tenant_id == tenant_id)
+    return statement.returning(User.id).execution_options(synchronize_session=False)
+
+
+def _apply(pairs: List[tuple]) -> set:
+    """Write the pairs ASSIGNMENT_BATCH_ROWS at a time, returning the ids that matched a user"""
+    updated = set()
+    for start in range(0, len(pairs), ASSIGNMENT_BATCH_ROWS):
+        updated.update(db.session.execute(_assignment_statement(pairs[start:start + ASSIGNMENT_BATCH_ROWS])).scalars())
+    return updated
+
+
+def assign_pay_codes(assignments: Iterable[dict]) -> List[dict]:
+    """Apply a whole assignment set and report what happened to each row, in request order.
+
+    Rows are {'employee_id', 'pay_code'} or {'employee_id', 'pay_code_id'}; a blank code
+    clears the assignment. Valid rows are written in one statement per ASSIGNMENT_BATCH_ROWS
+    and committed together; when an employee appears more than once the last row wins.
+    """
+    codes_by_id = {pay_code_id: code for code, pay_code_id in active_pay_codes().items()}
+    results = []
+    latest = {}
+    for row in assignments:
+        row = row if isinstance(row, dict) else {}
+        result = {'employee_id': row.get('employee_id'), 'pay_code': None, 'status': INVALID_ROW}
+        results.append(result)
+        try:
+            employee_id = int(row.get('employee_id'))
+        except (TypeError, ValueError):
+            continue
+        code, valid = _requested_code(row, codes_by_id)
+        result.update(employee_id=employee_id, pay_code=code)
+        if not valid:
+            result['status'] = INVALID_PAY_CODE
+            continue
+        if employee_id in latest:
+            latest[employee_id]['status'] = SUPERSEDED
+        latest[employee_id] = result
+
+    if latest:
+        updated = _apply([(employee_id, result['pay_code']) for employee_id, result in latest.items()])
+        db.session.commit()
+        _forget_cached_users(updated)
+        for employee_id, result in latest.items():
+            result['status'] = UPDATED if employee_id in updated else UNKNOWN_EMPLOYEE
+    return results
+
+
+def clear_pay_code(employee_id: int, code: Optional[str] = None) -> bool:
+    """Remove an employee's pay code, only if it is still code when one is given"""
+    statement = (
+        db.update(User)
+        .where(User.id == employee_id)
+        .values(pay_code=None)
+        .returning(User.id)
+        .execution_options(synchronize_session=False)
+    )
+    if code:
+        statement = statement.where(User.pay_code == code)
+    tenant_id = current_tenant_id()
+    if tenant_id is not None:
+        statement = statement.where(User.tenant_id == tenant_id)
+    cleared = set(db.session.execute(statement).scalars())
+    db.session.commit()
+    _forget_cached_users(cleared)
+    return bool(cleared)
+
+
+def _forget_cached_users(user_ids):
+    """Bulk UPDATEs skip the flush events user_cache listens to, so drop the identities here"""
+    from user_cache import invalidate_user
+    for user_id in user_ids:
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_pay_code_changes(session, flush_context):
+    if any(isinstance(obj, PayCode) for obj in list(session.new) + list(session.dirty) + list(session.deleted)):
+        session.info['pay_codes_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_pay_codes(session):
+    if session.info.pop('pay_codes_changed', False):
+        invalidate_active_pay_codes()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_pay_code_changes(session):
+    session.info.pop('pay_codes_changed', None)
@@ -240,7 +240,7 @@ def manage_absences():
     
     if date_filter:
         filter_date = datetime.strptime(date_filter, '%Y-%m-%d').date()
-        query = query.filter(func.date(TimeEntry.clock_in_time) == filter_date)
+        query = query.filter(TimeEntry.work_date == filter_date)
     
     # Managers can only see their team's absences (unless Super User/Admin)
     if not (current_user.has_role('Super User') or current_user.has_role('Admin')):
@@ -332,7 +332,7 @@ def log_absence():
             existing_entry = TimeEntry.query.filter(
                 and_(
                     TimeEntry.user_id == employee_id,
-                    func.date(TimeEntry.clock_in_time) == absence_date
+                    TimeEntry.work_date == absence_date
                 )
             ).first()
             
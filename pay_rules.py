@@ -289,8 +289,8 @@ def test_rules():
             
             test_entries = TimeEntry.query.filter(
                 and_(
-                    func.date(TimeEntry.clock_in_time) >= start_date,
-                    func.date(TimeEntry.clock_in_time) <= end_date,
+                    TimeEntry.work_date >= start_date,
+                    TimeEntry.work_date <= end_date,
                     TimeEntry.status == 'Closed'
                 )
             ).limit(50).all()  # Limit for testing
@@ -339,8 +339,8 @@ def calculate_pay():
             # Build query
             query = TimeEntry.query.filter(
                 and_(
-                    func.date(TimeEntry.clock_in_time) >= start_date,
-                    func.date(TimeEntry.clock_in_time) <= end_date,
+                    TimeEntry.work_date >= start_date,
+                    TimeEntry.work_date <= end_date,
                     TimeEntry.status == 'Closed'
                 )
             )
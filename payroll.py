@@ -3,7 +3,7 @@ Payroll Processing and Reporting Blueprint
 Handles payroll preparation, processing, and advanced reporting functionality
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from app import db
 from models import User, TimeEntry, PayCode, PayRule, LeaveApplication, Schedule
@@ -13,8 +13,6 @@ from auth import role_required, super_user_required
 from datetime import datetime, timedelta
 from sqlalchemy import and_, func, or_
 import logging
-import csv
-import io
 import json
 
 # Create blueprint for payroll routes
@@ -185,18 +183,141 @@ def payroll_processing():
         flash("An error occurred while processing payroll data.", "error")
         return redirect(url_for('main.index'))
 
+# Columns of the payroll export before any per pay code columns
+PAYROLL_EXPORT_COLUMNS = [
+    ('Employee ID', 'int'), ('Employee Name', 'string'), ('Username', 'string'), ('Email', 'string'),
+    ('Regular Hours', 'hours'), ('OT 1.5x Hours', 'hours'), ('OT 2.0x Hours', 'hours'), ('Total Hours', 'hours'),
+    ('Regular Pay', 'amount'), ('OT 1.5x Pay', 'amount'), ('OT 2.0x Pay', 'amount'), ('Gross Pay', 'amount'),
+    ('Deductions', 'amount'), ('Net Pay', 'amount')
+]
+
+def _pay_code_rates(base_rate):
+    """Hourly rate per active pay code: the base rate scaled by its configured pay_rate_factor"""
+    rates = {}
+    for pay_code in PayCode.query.filter_by(is_active=True).all():
+        rate = base_rate
+        if pay_code.configuration:
+            try:
+                rate = base_rate * json.loads(pay_code.configuration).get('pay_rate_factor', 1.0)
+            except:
+                rate = base_rate
+        rates.setdefault(pay_code.code, rate)
+    return rates
+
+def payroll_export_lines(start_date, end_date, employee_filter=None, include_codes=()):
+    """One payroll calculation per employee with entries in the period, as raw numbers.
+    
+    Entries come from one query ordered by employee, read in chunks and folded
+    one employee at a time, so memory does not grow with the period.
+    """
+    from csv_export import group_by_user
+    
+    base_rate = 150.0  # Base rate in ZAR
+    rates = _pay_code_rates(base_rate)
+    deduction_rate = current_app.config['PAYROLL_DEDUCTION_RATE']
+    
+    query = db.select(
+        User.id.label('user_id'), User.first_name, User.last_name, User.username, User.email,
+        TimeEntry.clock_in_time, TimeEntry.clock_out_time, PayCode.code.label('pay_code')
+    ).join(User, User.id == TimeEntry.user_id).outerjoin(
+        PayCode, PayCode.id == TimeEntry.pay_code_id
+    ).where(
+        TimeEntry.clock_in_time >= start_date,
+        TimeEntry.clock_in_time < end_date + timedelta(days=1)
+    ).order_by(User.id, TimeEntry.clock_in_time).execution_options(yield_per=1000)
+    
+    # Apply employee filter if specified
+    if employee_filter:
+        query = query.where(User.id == employee_filter)
+    
+    for employee, entries in group_by_user(db.session.execute(query)):
+        # Calculate totals
+        total_hours = 0
+        pay_code_data = {}
+        
+        for entry in entries:
+            if entry.clock_in_time and entry.clock_out_time:
+                hours = (entry.clock_out_time - entry.clock_in_time).total_seconds() / 3600
+            else:
+                hours = 8.0
+            
+            total_hours += hours
+            
+            # Track by pay code
+            code_name = entry.pay_code or 'REGULAR'
+            if code_name not in pay_code_data:
+                pay_code_data[code_name] = {'hours': 0, 'amount': 0, 'rate': rates.get(code_name, base_rate)}
+            
+            pay_code_data[code_name]['hours'] += hours
+            pay_code_data[code_name]['amount'] += hours * pay_code_data[code_name]['rate']
+        
+        # Calculate breakdown for display
+        regular_hours = pay_code_data.get('REGULAR', {}).get('hours', 0)
+        ot_15_hours = pay_code_data.get('OVERTIME', {}).get('hours', 0)
+        ot_20_hours = pay_code_data.get('DT', {}).get('hours', 0)
+        
+        # If all hours are REGULAR, apply automatic overtime calculation
+        if len(pay_code_data) == 1 and 'REGULAR' in pay_code_data:
+            regular_hours = min(total_hours, 40)
+            ot_15_hours = max(0, min(total_hours - 40, 8))
+            ot_20_hours = max(0, total_hours - 48)
+            
+            regular_pay = regular_hours * base_rate
+            ot_15_pay = ot_15_hours * (base_rate * 1.5)
+            ot_20_pay = ot_20_hours * (base_rate * 2.0)
+            gross_pay = regular_pay + ot_15_pay + ot_20_pay
+        else:
+            # Use pay code calculations
+            regular_pay = pay_code_data.get('REGULAR', {}).get('amount', 0)
+            ot_15_pay = pay_code_data.get('OVERTIME', {}).get('amount', 0)
+            ot_20_pay = pay_code_data.get('DT', {}).get('amount', 0)
+            gross_pay = sum([data['amount'] for data in pay_code_data.values()])
+        
+        deductions = gross_pay * deduction_rate
+        net_pay = gross_pay - deductions
+        
+        line = [
+            employee.user_id,
+            f"{employee.first_name} {employee.last_name}" if employee.first_name else employee.username,
+            employee.username,
+            employee.email,
+            round(regular_hours, 2),
+            round(ot_15_hours, 2),
+            round(ot_20_hours, 2),
+            round(total_hours, 2),
+            regular_pay,
+            ot_15_pay,
+            ot_20_pay,
+            gross_pay,
+            deductions,
+            net_pay
+        ]
+        
+        # Add pay code data if requested
+        for code in include_codes:
+            if code in pay_code_data:
+                line.extend([round(pay_code_data[code]['hours'], 2), pay_code_data[code]['amount']])
+            else:
+                line.extend([0, 0])
+        
+        yield line
+
 @payroll_bp.route('/export-payroll')
 @login_required
 @role_required('Super User')
 def export_payroll():
-    """Export processed payroll data to CSV"""
+    """Export processed payroll data to CSV, or typed Parquet/Arrow with ?format="""
     try:
+        from csv_export import stream_csv, wants_gzip
+        from columnar_export import COLUMNAR_FORMATS, requested_format, stream_columnar
+        
         # Get parameters
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         employee_filter = request.args.get('employee_filter')
         include_codes = request.args.getlist('include_codes')
         exclude_codes = request.args.getlist('exclude_codes')
+        export_format = requested_format(request)
         
         if not start_date or not end_date:
             flash("Start and end dates are required for export.", "error")
@@ -205,155 +326,28 @@ def export_payroll():
         start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
         end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
         
-        # Build query for employees with time entries in the period
-        employees_query = db.session.query(User).join(
-            TimeEntry, User.id == TimeEntry.user_id
-        ).filter(
-            and_(
-                TimeEntry.clock_in_time >= start_date,
-                TimeEntry.clock_in_time <= end_date + timedelta(days=1)
-            )
-        )
-        
-        # Apply employee filter if specified
-        if employee_filter:
-            employees_query = employees_query.filter(User.id == employee_filter)
-        
-        employees_with_entries = employees_query.distinct().all()
-        
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        header = [
-            'Employee ID', 'Employee Name', 'Username', 'Email',
-            'Regular Hours', 'OT 1.5x Hours', 'OT 2.0x Hours', 'Total Hours',
-            'Regular Pay', 'OT 1.5x Pay', 'OT 2.0x Pay', 'Gross Pay', 'Deductions', 'Net Pay'
-        ]
-        
         # Add pay code columns if specified
-        if include_codes:
-            for code in include_codes:
-                header.extend([f'{code} Hours', f'{code} Amount'])
-        
-        writer.writerow(header)
-        
-        # Process each employee
-        for employee in employees_with_entries:
-            time_entries = TimeEntry.query.filter(
-                and_(
-                    TimeEntry.user_id == employee.id,
-                    TimeEntry.clock_in_time >= start_date,
-                    TimeEntry.clock_in_time <= end_date + timedelta(days=1)
-                )
-            ).all()
-            
-            # Calculate totals
-            total_hours = 0
-            pay_code_data = {}
-            
-            for entry in time_entries:
-                if entry.clock_in_time and entry.clock_out_time:
-                    hours = (entry.clock_out_time - entry.clock_in_time).total_seconds() / 3600
-                else:
-                    hours = 8.0
-                
-                total_hours += hours
-                
-                # Track by pay code
-                if entry.pay_code_id:
-                    pay_code = PayCode.query.get(entry.pay_code_id)
-                    code_name = pay_code.code if pay_code else 'REGULAR'
-                else:
-                    code_name = 'REGULAR'
-                
-                if code_name not in pay_code_data:
-                    # Get actual pay code rate from database
-                    pay_code = PayCode.query.filter_by(code=code_name, is_active=True).first()
-                    base_rate = 150.0  # Base rate in ZAR
-                    
-                    # Calculate rate based on pay code factor
-                    if pay_code and pay_code.configuration:
-                        try:
-                            import json
-                            config = json.loads(pay_code.configuration)
-                            pay_rate_factor = config.get('pay_rate_factor', 1.0)
-                            actual_rate = base_rate * pay_rate_factor
-                        except:
-                            actual_rate = base_rate
-                    else:
-                        actual_rate = base_rate
-                    
-                    pay_code_data[code_name] = {'hours': 0, 'amount': 0, 'rate': actual_rate}
-                
-                pay_code_data[code_name]['hours'] += hours
-                pay_code_data[code_name]['amount'] += hours * pay_code_data[code_name]['rate']
-            
-            # Calculate breakdown for display
-            regular_hours = pay_code_data.get('REGULAR', {}).get('hours', 0)
-            ot_15_hours = pay_code_data.get('OVERTIME', {}).get('hours', 0)
-            ot_20_hours = pay_code_data.get('DT', {}).get('hours', 0)
-            
-            # If all hours are REGULAR, apply automatic overtime calculation
-            if len(pay_code_data) == 1 and 'REGULAR' in pay_code_data:
-                regular_hours = min(total_hours, 40)
-                ot_15_hours = max(0, min(total_hours - 40, 8))
-                ot_20_hours = max(0, total_hours - 48)
-                
-                base_rate = 150.0
-                regular_pay = regular_hours * base_rate
-                ot_15_pay = ot_15_hours * (base_rate * 1.5)
-                ot_20_pay = ot_20_hours * (base_rate * 2.0)
-                gross_pay = regular_pay + ot_15_pay + ot_20_pay
-            else:
-                # Use pay code calculations
-                regular_pay = pay_code_data.get('REGULAR', {}).get('amount', 0)
-                ot_15_pay = pay_code_data.get('OVERTIME', {}).get('amount', 0)
-                ot_20_pay = pay_code_data.get('DT', {}).get('amount', 0)
-                gross_pay = sum([data['amount'] for data in pay_code_data.values()])
-            
-            deductions = gross_pay * current_app.config['PAYROLL_DEDUCTION_RATE']
-            net_pay = gross_pay - deductions
-            
-            # Build row data
-            row = [
-                employee.id,
-                f"{employee.first_name} {employee.last_name}" if employee.first_name else employee.username,
-                employee.username,
-                employee.email,
-                round(regular_hours, 2),
-                round(ot_15_hours, 2),
-                round(ot_20_hours, 2),
-                round(total_hours, 2),
-                f"${regular_pay:.2f}",
-                f"${ot_15_pay:.2f}",
-                f"${ot_20_pay:.2f}",
-                f"${gross_pay:.2f}",
-                f"${deductions:.2f}",
-                f"${net_pay:.2f}"
-            ]
-            
-            # Add pay code data if requested
-            if include_codes:
-                for code in include_codes:
-                    if code in pay_code_data:
-                        row.extend([
-                            round(pay_code_data[code]['hours'], 2),
-                            f"R{pay_code_data[code]['amount']:.2f}"
-                        ])
-                    else:
-                        row.extend([0, "R0.00"])
-            
-            writer.writerow(row)
-        
-        # Create response
-        output.seek(0)
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv'
-        response.headers['Content-Disposition'] = f'attachment; filename=payroll_export_{start_date}_{end_date}.csv'
-        
-        return response
+        columns = list(PAYROLL_EXPORT_COLUMNS)
+        for code in include_codes:
+            columns.extend([(f'{code} Hours', 'hours'), (f'{code} Amount', 'amount')])
+        
+        lines = payroll_export_lines(start_date, end_date, employee_filter, include_codes)
+        filename = f'payroll_export_{start_date}_{end_date}'
+        
+        if export_format in COLUMNAR_FORMATS:
+            return stream_columnar(filename, columns, lines, export_format)
+        
+        def csv_rows():
+            code_amounts = range(len(PAYROLL_EXPORT_COLUMNS) + 1, len(columns), 2)
+            for line in lines:
+                for i in range(8, 14):
+                    line[i] = f"${line[i]:.2f}"
+                for i in code_amounts:
+                    line[i] = f"R{line[i]:.2f}"
+                yield line
+        
+        return stream_csv(f'{filename}.csv', [name for name, _ in columns], csv_rows(),
+                          compress=wants_gzip(request))
         
     except Exception as e:
         logging.error(f"Error exporting payroll: {e}")
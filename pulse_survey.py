@@ -5,10 +5,15 @@ Provides one-click pulse surveys for team communication assessment
 
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
 from flask_login import login_required, current_user
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
+from typing import Dict, List
+import os
 from app import db
-from models import User
+from models import User, Department
 from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import joinedload
+from ttl_cache import TTLCache
 import json
 
 # Create blueprint for pulse surveys
@@ -59,6 +64,16 @@ PULSE_SURVEY_QUESTIONS = [
     }
 ]
 
+# Survey statistics are dropped when a response is submitted; the TTL bounds staleness
+# across worker processes and changes in the target audience
+PULSE_STATS_TTL = int(os.environ.get('PULSE_STATS_TTL', '300'))
+
+survey_stats_cache = TTLCache(ttl=PULSE_STATS_TTL, max_entries=512)
+
+def department_name(user):
+    """Name of the user's department; surveys target departments by name"""
+    return user.employee_department.name if user.employee_department else None
+
 # Database Models for Pulse Surveys
 class PulseSurvey(db.Model):
     """Pulse Survey model for tracking survey instances"""
@@ -89,20 +104,11 @@ class PulseSurvey(db.Model):
     
     def get_response_count(self):
         """Get total number of responses"""
-        return PulseSurveyResponse.query.filter_by(survey_id=self.id).count()
+        return load_survey_stats([self])[self.id].response_count
     
     def get_completion_rate(self):
         """Calculate completion rate based on target audience"""
-        if self.target_department:
-            target_users = User.query.filter_by(department=self.target_department, is_active=True).count()
-        else:
-            target_users = User.query.filter_by(is_active=True).count()
-        
-        if target_users == 0:
-            return 0
-        
-        responses = self.get_response_count()
-        return round((responses / target_users) * 100, 1)
+        return load_survey_stats([self])[self.id].completion_rate
     
     def is_expired(self):
         """Check if survey has expired"""
@@ -113,7 +119,7 @@ class PulseSurvey(db.Model):
         if not self.is_active or self.is_expired():
             return False
         
-        if self.target_department and user.department != self.target_department:
+        if self.target_department and department_name(user) != self.target_department:
             return False
         
         # Check if user already responded
@@ -123,6 +129,23 @@ class PulseSurvey(db.Model):
         ).first()
         
         return existing_response is None
+    
+    @staticmethod
+    def respondable_by(user, surveys):
+        """Filter surveys to those the user can still answer, with one lookup for existing responses"""
+        candidates = [s for s in surveys
+                      if s.is_active and not s.is_expired()
+                      and (not s.target_department or department_name(user) == s.target_department)]
+        if not candidates:
+            return []
+        
+        answered = set(db.session.execute(
+            db.select(PulseSurveyResponse.survey_id).where(
+                PulseSurveyResponse.user_id == user.id,
+                PulseSurveyResponse.survey_id.in_([s.id for s in candidates])
+            )
+        ).scalars())
+        return [s for s in candidates if s.id not in answered]
 
 class PulseSurveyResponse(db.Model):
     """Pulse Survey Response model for storing individual responses"""
@@ -137,6 +160,7 @@ class PulseSurveyResponse(db.Model):
     
     # Relationships
     user = db.relationship('User', foreign_keys=[user_id])
+    answers = db.relationship('PulseSurveyAnswer', backref='response', cascade='all, delete-orphan')
     
     # Indexes for performance
     __table_args__ = (
@@ -149,6 +173,241 @@ class PulseSurveyResponse(db.Model):
     def get_responses_dict(self):
         """Get responses as dictionary"""
         return json.loads(self.responses)
+    
+    def set_responses(self, responses):
+        """Store answers as the JSON blob and as one PulseSurveyAnswer row per answered question"""
+        self.responses = json.dumps(responses)
+        self.answers = build_answers(self.survey_id, responses)
+
+class PulseSurveyAnswer(db.Model):
+    """One answer of a response, normalised so results can be aggregated in SQL"""
+    
+    __tablename__ = 'pulse_survey_answers'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    response_id = db.Column(db.Integer, db.ForeignKey('pulse_survey_responses.id', ondelete='CASCADE'), nullable=False)
+    survey_id = db.Column(db.Integer, db.ForeignKey('pulse_surveys.id'), nullable=False)  # Denormalised for survey-wide aggregates
+    question_key = db.Column(db.String(64), nullable=False)
+    numeric_value = db.Column(db.Integer, nullable=True)  # Scale questions
+    text_value = db.Column(db.Text, nullable=True)        # Free-text questions
+    
+    __table_args__ = (
+        db.Index('idx_pulse_answers_survey_question_value', 'survey_id', 'question_key', 'numeric_value'),  # Distributions
+        db.Index('idx_pulse_answers_response', 'response_id'),                                            # Per-response lookups
+    )
+
+QUESTION_TYPES = {question['id']: question['type'] for question in PULSE_SURVEY_QUESTIONS}
+
+def build_answers(survey_id, responses):
+    """Answer rows for a response dict; blank and unknown answers are skipped"""
+    answers = []
+    for question_key, answer in responses.items():
+        question_type = QUESTION_TYPES.get(question_key)
+        if not answer or question_type is None:
+            continue
+        if question_type == 'scale':
+            answers.append(PulseSurveyAnswer(survey_id=survey_id, question_key=question_key,
+                                             numeric_value=int(answer)))
+        else:
+            answers.append(PulseSurveyAnswer(survey_id=survey_id, question_key=question_key,
+                                             text_value=answer))
+    return answers
+
+@dataclass
+class SurveyStats:
+    """Response count, audience size and per-question results of one survey"""
+    survey_id: int
+    target_size: int
+    response_count: int = 0
+    results: Dict[str, dict] = field(default_factory=dict)
+    
+    @property
+    def completion_rate(self):
+        if self.target_size == 0:
+            return 0
+        return round((self.response_count / self.target_size) * 100, 1)
+
+def _empty_results():
+    """Result skeleton for every configured question"""
+    results = {}
+    for question in PULSE_SURVEY_QUESTIONS:
+        if question['type'] == 'scale':
+            results[question['id']] = {
+                'question': question['question'],
+                'type': 'scale',
+                'labels': question['labels'],
+                'scores': [0] * question['scale'],
+                'average': 0,
+                'total_responses': 0
+            }
+        elif question['type'] == 'text':
+            results[question['id']] = {
+                'question': question['question'],
+                'type': 'text',
+                'responses': []
+            }
+    return results
+
+def _finish_results(results):
+    """Calculate averages for scale questions"""
+    for result in results.values():
+        if result['type'] == 'scale' and result['total_responses'] > 0:
+            total_score = sum(score * (index + 1) for index, score in enumerate(result['scores']))
+            result['average'] = round(total_score / result['total_responses'], 1)
+
+def load_survey_stats(surveys: List[PulseSurvey]) -> Dict[int, SurveyStats]:
+    """
+    Statistics for each survey, from the cache where possible. Uncached surveys
+    are computed together with grouped queries over the answer table: audience
+    sizes, response counts, score distributions and free-text answers.
+    """
+    stats = {}
+    missing = []
+    for survey in surveys:
+        cached = survey_stats_cache.get(survey.id)
+        if cached is not None:
+            stats[survey.id] = cached
+        else:
+            missing.append(survey)
+    if not missing:
+        return stats
+    
+    active_by_department = dict(db.session.execute(
+        db.select(Department.name, func.count(User.id))
+        .select_from(User)
+        .outerjoin(Department, Department.id == User.department_id)
+        .where(User.is_active == True)
+        .group_by(Department.name)
+    ).all())
+    all_active = sum(active_by_department.values())
+    
+    for survey in missing:
+        target_size = (active_by_department.get(survey.target_department, 0)
+                       if survey.target_department else all_active)
+        stats[survey.id] = SurveyStats(survey_id=survey.id, target_size=target_size, results=_empty_results())
+    
+    survey_ids = [s.id for s in missing]
+    for survey_id, response_count in db.session.execute(
+        db.select(PulseSurveyResponse.survey_id, func.count(PulseSurveyResponse.id))
+        .where(PulseSurveyResponse.survey_id.in_(survey_ids))
+        .group_by(PulseSurveyResponse.survey_id)
+    ):
+        stats[survey_id].response_count = response_count
+    
+    for survey_id, question_key, value, count in db.session.execute(
+        db.select(PulseSurveyAnswer.survey_id, PulseSurveyAnswer.question_key,
+                  PulseSurveyAnswer.numeric_value, func.count(PulseSurveyAnswer.id))
+        .where(PulseSurveyAnswer.survey_id.in_(survey_ids), PulseSurveyAnswer.numeric_value.isnot(None))
+        .group_by(PulseSurveyAnswer.survey_id, PulseSurveyAnswer.question_key, PulseSurveyAnswer.numeric_value)
+    ):
+        result = stats[survey_id].results.get(question_key)
+        if result and result['type'] == 'scale' and 1 <= value <= len(result['scores']):
+            result['scores'][value - 1] += count
+            result['total_responses'] += count
+    
+    for survey_id, question_key, text in db.session.execute(
+        db.select(PulseSurveyAnswer.survey_id, PulseSurveyAnswer.question_key, PulseSurveyAnswer.text_value)
+        .where(PulseSurveyAnswer.survey_id.in_(survey_ids), PulseSurveyAnswer.text_value.isnot(None))
+        .order_by(PulseSurveyAnswer.response_id)
+    ):
+        result = stats[survey_id].results.get(question_key)
+        if result and result['type'] == 'text':
+            result['responses'].append(text)
+    
+    for survey in missing:
+        _finish_results(stats[survey.id].results)
+        survey_stats_cache.set(survey.id, stats[survey.id])
+    return stats
+
+# Department breakdowns of anonymous surveys hide departments with fewer responses than this
+MIN_BREAKDOWN_GROUP = int(os.environ.get('PULSE_MIN_BREAKDOWN_GROUP', '3'))
+
+def department_breakdown(survey):
+    """Per-department response counts and scale-question averages, aggregated in SQL"""
+    department = func.coalesce(Department.name, 'Unassigned')
+    
+    breakdown = {}
+    for name, responses in db.session.execute(
+        db.select(department, func.count(PulseSurveyResponse.id))
+        .select_from(PulseSurveyResponse)
+        .join(User, User.id == PulseSurveyResponse.user_id)
+        .outerjoin(Department, Department.id == User.department_id)
+        .where(PulseSurveyResponse.survey_id == survey.id)
+        .group_by(department)
+    ):
+        if survey.is_anonymous and responses < MIN_BREAKDOWN_GROUP:
+            continue
+        breakdown[name] = {'department': name, 'responses': responses, 'averages': {}}
+    
+    if breakdown:
+        for name, question_key, average in db.session.execute(
+            db.select(department, PulseSurveyAnswer.question_key, func.avg(PulseSurveyAnswer.numeric_value))
+            .select_from(PulseSurveyAnswer)
+            .join(PulseSurveyResponse, PulseSurveyResponse.id == PulseSurveyAnswer.response_id)
+            .join(User, User.id == PulseSurveyResponse.user_id)
+            .outerjoin(Department, Department.id == User.department_id)
+            .where(PulseSurveyAnswer.survey_id == survey.id, PulseSurveyAnswer.numeric_value.isnot(None))
+            .group_by(department, PulseSurveyAnswer.question_key)
+        ):
+            if name in breakdown:
+                breakdown[name]['averages'][question_key] = round(float(average), 2)
+    
+    return sorted(breakdown.values(), key=lambda row: row['department'])
+
+def survey_results(survey, include_departments=True):
+    """Results API payload: distributions, averages and optional department breakdown"""
+    stats = load_survey_stats([survey])[survey.id]
+    
+    questions = {}
+    for question_key, result in stats.results.items():
+        if result['type'] == 'scale':
+            questions[question_key] = {
+                'question': result['question'],
+                'type': 'scale',
+                'distribution': dict(zip(result['labels'], result['scores'])),
+                'average': result['average'],
+                'total_responses': result['total_responses']
+            }
+        else:
+            questions[question_key] = {
+                'question': result['question'],
+                'type': 'text',
+                'responses': result['responses']
+            }
+    
+    payload = {
+        'survey_id': survey.id,
+        'title': survey.title,
+        'is_anonymous': survey.is_anonymous,
+        'response_count': stats.response_count,
+        'target_size': stats.target_size,
+        'completion_rate': stats.completion_rate,
+        'questions': questions
+    }
+    if include_departments:
+        payload['departments'] = department_breakdown(survey)
+    return payload
+
+def backfill_answers(batch_size=500):
+    """Write answer rows for responses stored before the answer table existed"""
+    written = 0
+    last_id = 0
+    while True:
+        batch = PulseSurveyResponse.query.filter(
+            PulseSurveyResponse.id > last_id,
+            ~PulseSurveyResponse.answers.any()
+        ).order_by(PulseSurveyResponse.id).limit(batch_size).all()
+        if not batch:
+            break
+        
+        for response in batch:
+            response.answers = build_answers(response.survey_id, response.get_responses_dict())
+        db.session.commit()
+        written += len(batch)
+        last_id = batch[-1].id
+    
+    survey_stats_cache.clear()
+    return written
 
 # Routes
 @pulse_survey_bp.route('/dashboard')
@@ -162,25 +421,31 @@ def pulse_dashboard():
         ).order_by(PulseSurvey.created_at.desc()).all()
         
         # Get surveys user can respond to
-        available_surveys = [s for s in active_surveys if s.can_user_respond(current_user)]
+        available_surveys = PulseSurvey.respondable_by(current_user, active_surveys)
         
         # Get surveys created by current user (for managers)
         my_surveys = []
+        survey_stats = {}
         if current_user.has_role('Manager') or current_user.has_role('Super User'):
             my_surveys = PulseSurvey.query.filter_by(created_by_id=current_user.id).order_by(
                 PulseSurvey.created_at.desc()
             ).limit(10).all()
+            survey_stats = load_survey_stats(my_surveys)
         
         # Get recent responses (for managers)
         recent_responses = []
         if current_user.has_role('Manager') or current_user.has_role('Super User'):
             recent_responses = PulseSurveyResponse.query.join(PulseSurvey).filter(
                 PulseSurvey.created_by_id == current_user.id
+            ).options(
+                joinedload(PulseSurveyResponse.survey),
+                joinedload(PulseSurveyResponse.user)
             ).order_by(PulseSurveyResponse.submitted_at.desc()).limit(5).all()
         
         return render_template('pulse_survey/dashboard.html',
                              available_surveys=available_surveys,
                              my_surveys=my_surveys,
+                             survey_stats=survey_stats,
                              recent_responses=recent_responses)
     
     except Exception as e:
@@ -231,8 +496,9 @@ def create_survey():
             flash(f"Error creating survey: {str(e)}", "error")
     
     # Get departments for dropdown
-    departments = db.session.query(User.department).filter(
-        User.department.isnot(None),
+    departments = db.session.query(Department.name).join(
+        User, User.department_id == Department.id
+    ).filter(
         User.is_active == True
     ).distinct().all()
     departments = [d[0] for d in departments if d[0]]
@@ -253,57 +519,33 @@ def view_survey(survey_id):
         flash("You don't have permission to view this survey.", "error")
         return redirect(url_for('pulse_survey.pulse_dashboard'))
     
-    # Get survey statistics
-    total_responses = survey.get_response_count()
-    completion_rate = survey.get_completion_rate()
-    
-    # Get aggregated results
-    responses = PulseSurveyResponse.query.filter_by(survey_id=survey_id).all()
-    
-    # Process results
-    results = {}
-    for question in PULSE_SURVEY_QUESTIONS:
-        if question['type'] == 'scale':
-            results[question['id']] = {
-                'question': question['question'],
-                'type': 'scale',
-                'labels': question['labels'],
-                'scores': [0] * question['scale'],
-                'average': 0,
-                'total_responses': 0
-            }
-        elif question['type'] == 'text':
-            results[question['id']] = {
-                'question': question['question'],
-                'type': 'text',
-                'responses': []
-            }
-    
-    # Aggregate responses
-    for response in responses:
-        response_data = response.get_responses_dict()
-        
-        for question_id, answer in response_data.items():
-            if question_id in results:
-                if results[question_id]['type'] == 'scale' and answer:
-                    score = int(answer) - 1  # Convert to 0-based index
-                    if 0 <= score < len(results[question_id]['scores']):
-                        results[question_id]['scores'][score] += 1
-                        results[question_id]['total_responses'] += 1
-                elif results[question_id]['type'] == 'text' and answer:
-                    results[question_id]['responses'].append(answer)
-    
-    # Calculate averages for scale questions
-    for question_id, result in results.items():
-        if result['type'] == 'scale' and result['total_responses'] > 0:
-            total_score = sum(score * (index + 1) for index, score in enumerate(result['scores']))
-            result['average'] = round(total_score / result['total_responses'], 1)
+    # Get survey statistics and aggregated results
+    stats = load_survey_stats([survey])[survey.id]
     
     return render_template('pulse_survey/view.html',
                          survey=survey,
-                         results=results,
-                         total_responses=total_responses,
-                         completion_rate=completion_rate)
+                         results=stats.results,
+                         total_responses=stats.response_count,
+                         completion_rate=stats.completion_rate)
+
+@pulse_survey_bp.route('/api/survey/<int:survey_id>/results')
+@login_required
+def api_survey_results(survey_id):
+    """Survey results as JSON, aggregated from the answer table"""
+    survey = PulseSurvey.query.get_or_404(survey_id)
+    
+    if not (current_user.has_role('Manager') or current_user.has_role('Super User') or 
+            survey.created_by_id == current_user.id):
+        return jsonify({
+            'success': False,
+            'message': "You don't have permission to view this survey."
+        }), 403
+    
+    include_departments = request.args.get('departments', 'true').lower() != 'false'
+    return jsonify({
+        'success': True,
+        'data': survey_results(survey, include_departments=include_departments)
+    })
 
 @pulse_survey_bp.route('/respond/<int:survey_id>', methods=['GET', 'POST'])
 @login_required
@@ -335,12 +577,13 @@ def respond_survey(survey_id):
             # Save response
             survey_response = PulseSurveyResponse(
                 survey_id=survey_id,
-                user_id=current_user.id,
-                responses=json.dumps(responses)
+                user_id=current_user.id
             )
+            survey_response.set_responses(responses)
             
             db.session.add(survey_response)
             db.session.commit()
+            survey_stats_cache.delete(survey_id)
             
             flash("Thank you for your response!", "success")
             return redirect(url_for('pulse_survey.pulse_dashboard'))
@@ -374,7 +617,7 @@ def one_click_survey():
             created_by_id=current_user.id,
             ends_at=datetime.utcnow() + timedelta(hours=24),  # 24-hour window
             is_anonymous=True,
-            target_department=current_user.department  # Target user's department
+            target_department=department_name(current_user)  # Target user's department
         )
         
         db.session.add(survey)
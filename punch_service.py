@@ -0,0 +1,192 @@
+"""
+Punch Ingest Service
+Single round-trip, idempotent clock-in / clock-out writes shared by every punch endpoint
+"""
+
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from flask import request
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import TimeEntry
+from scheduling_features import mark_features_stale
+
+# Maximum accepted length of a client-supplied idempotency key
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+
+# Punch outcomes
+CREATED = 'created'
+CLOSED = 'closed'
+REPLAYED = 'replayed'
+ALREADY_OPEN = 'already_open'
+NOT_OPEN = 'not_open'
+
+
+@dataclass
+class PunchResult:
+    """Outcome of a clock-in or clock-out punch"""
+    outcome: str
+    entry_id: Optional[int] = None
+    clock_in_time: Optional[datetime] = None
+    clock_out_time: Optional[datetime] = None
+    total_break_minutes: int = 0
+
+    @property
+    def ok(self) -> bool:
+        """True when the punch was applied now or on an earlier retry with the same key"""
+        return self.outcome in (CREATED, CLOSED, REPLAYED)
+
+    @property
+    def total_hours(self) -> float:
+        """Worked hours for a closed entry"""
+        if not (self.clock_in_time and self.clock_out_time):
+            return 0
+        total_minutes = (self.clock_out_time - self.clock_in_time).total_seconds() / 60
+        return round((total_minutes - (self.total_break_minutes or 0)) / 60, 2)
+
+
+def get_idempotency_key(json_data=None) -> Optional[str]:
+    """Read the client idempotency key from the Idempotency-Key header or JSON body"""
+    key = request.headers.get('Idempotency-Key')
+    if not key and json_data:
+        key = json_data.get('idempotency_key')
+    if not key:
+        return None
+    key = str(key).strip()
+    if len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise ValueError(f'Idempotency key must be at most {MAX_IDEMPOTENCY_KEY_LENGTH} characters')
+    return key or None
+
+
+def _insert_statement(values):
+    """Dialect-specific INSERT that supports ON CONFLICT DO NOTHING"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(TimeEntry.__table__).values(**values)
+    return postgresql.insert(TimeEntry.__table__).values(**values)
+
+
+def punch_in(user_id: int, punched_at: datetime, idempotency_key: Optional[str] = None,
+             notes: Optional[str] = None, latitude: Optional[float] = None,
+             longitude: Optional[float] = None) -> PunchResult:
+    """Open a time entry for the user with a single INSERT ... ON CONFLICT DO NOTHING.
+
+    The partial unique index on open entries guarantees at most one open entry per
+    user, so concurrent or retried punches can never create duplicates. When the
+    insert is skipped, the existing open entry is inspected to tell a retry (same
+    idempotency key) from a genuine second clock-in.
+    """
+    entries = TimeEntry.__table__
+    now = datetime.utcnow()
+    statement = _insert_statement({
+        'user_id': user_id,
+        'clock_in_time': punched_at,
+        'status': 'Open',
+        'notes': notes,
+        'clock_in_latitude': latitude,
+        'clock_in_longitude': longitude,
+        'clock_in_idempotency_key': idempotency_key,
+        'total_break_minutes': 0,
+        'is_overtime_approved': False,
+        'created_at': now,
+        'updated_at': now
+    }).on_conflict_do_nothing().returning(entries.c.id, entries.c.clock_in_time)
+
+    row = db.session.execute(statement).first()
+    if row:
+        mark_features_stale([user_id])
+    db.session.commit()
+    if row:
+        return PunchResult(CREATED, row.id, row.clock_in_time)
+
+    # Conflict path only: find the entry that blocked the insert
+    conditions = [entries.c.status == 'Open']
+    if idempotency_key:
+        conditions = [db.or_(entries.c.status == 'Open', entries.c.clock_in_idempotency_key == idempotency_key)]
+    existing = db.session.execute(
+        db.select(entries.c.id, entries.c.clock_in_time, entries.c.clock_out_time,
+                  entries.c.clock_in_idempotency_key)
+        .where(entries.c.user_id == user_id, *conditions)
+        .order_by(entries.c.clock_in_time.desc())
+        .limit(1)
+    ).first()
+
+    if existing and idempotency_key and existing.clock_in_idempotency_key == idempotency_key:
+        return PunchResult(REPLAYED, existing.id, existing.clock_in_time, existing.clock_out_time)
+    return PunchResult(ALREADY_OPEN, existing.id if existing else None,
+                       existing.clock_in_time if existing else None)
+
+
+def _replayed_clock_out(user_id: int, idempotency_key: str) -> Optional[PunchResult]:
+    """The entry an earlier clock-out with this key closed, if any"""
+    entries = TimeEntry.__table__
+    replayed = db.session.execute(
+        db.select(entries.c.id, entries.c.clock_in_time, entries.c.clock_out_time,
+                  entries.c.total_break_minutes)
+        .where(entries.c.user_id == user_id, entries.c.clock_out_idempotency_key == idempotency_key)
+    ).first()
+    if replayed:
+        return PunchResult(REPLAYED, replayed.id, replayed.clock_in_time, replayed.clock_out_time,
+                           replayed.total_break_minutes or 0)
+    return None
+
+
+def punch_out(user_id: int, punched_at: datetime, idempotency_key: Optional[str] = None,
+              notes_suffix: Optional[str] = None, latitude: Optional[float] = None,
+              longitude: Optional[float] = None) -> PunchResult:
+    """Close the user's open time entry with a single UPDATE ... RETURNING.
+
+    A key that already closed an entry never closes another one, so a retry that
+    arrives after the user clocked in again replays the first clock-out instead
+    of closing the new entry. notes_suffix is appended to the entry's existing
+    notes as given, so callers keep their own separator format.
+    """
+    entries = TimeEntry.__table__
+    values = {
+        'clock_out_time': punched_at,
+        'status': 'Closed',
+        'clock_out_latitude': latitude,
+        'clock_out_longitude': longitude,
+        'clock_out_idempotency_key': idempotency_key,
+        'updated_at': datetime.utcnow()
+    }
+    if notes_suffix:
+        values['notes'] = db.func.coalesce(entries.c.notes, '') + notes_suffix
+
+    conditions = [entries.c.user_id == user_id, entries.c.status == 'Open']
+    if idempotency_key:
+        used = entries.alias('used_key')
+        conditions.append(~db.exists().where(
+            used.c.user_id == user_id, used.c.clock_out_idempotency_key == idempotency_key
+        ))
+
+    try:
+        row = db.session.execute(
+            entries.update()
+            .where(*conditions)
+            .values(**values)
+            .returning(entries.c.id, entries.c.clock_in_time, entries.c.clock_out_time,
+                       entries.c.total_break_minutes)
+        ).first()
+        if row:
+            mark_features_stale([user_id])
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent retry with the same key committed first
+        db.session.rollback()
+        if not idempotency_key:
+            raise
+        row = None
+    if row:
+        return PunchResult(CLOSED, row.id, row.clock_in_time, row.clock_out_time,
+                           row.total_break_minutes or 0)
+
+    if idempotency_key:
+        replayed = _replayed_clock_out(user_id, idempotency_key)
+        if replayed:
+            return replayed
+    return PunchResult(NOT_OPEN)
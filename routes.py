@@ -1,12 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, make_response
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from app import db
 from models import User, TimeEntry, Schedule, LeaveApplication, PayRule, PayCode, LeaveBalance, Department
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
 import logging
-import csv
-import io
 import json
 
 # Create blueprint for main routes
@@ -22,149 +20,14 @@ def get_managed_departments(user_id):
 def generate_dashboard_analytics(is_manager_or_admin, user_id=None):
     """Generate comprehensive analytics data for dashboard charts"""
     try:
-        # Time range for analytics - last 30 days
-        end_date = datetime.now().date()
-        start_date = end_date - timedelta(days=30)
-        
         # Determine filtering scope based on user role
         from flask_login import current_user
-        is_super_user = current_user.has_role('Super User')
-        is_manager = current_user.has_role('Manager')
+        from dashboard_analytics import resolve_scope, get_dashboard_analytics
+        is_manager = current_user.has_role('Manager') and not current_user.has_role('Super User')
         managed_dept_ids = get_managed_departments(current_user.id) if is_manager else []
         
-        # Base query filters with department filtering
-        base_filter = TimeEntry.clock_in_time >= start_date
-        if is_super_user:
-            # Super users see all data
-            pass
-        elif is_manager and managed_dept_ids:
-            # Managers see only their managed departments
-            base_filter = and_(
-                base_filter,
-                TimeEntry.user_id.in_(
-                    db.session.query(User.id).filter(User.department_id.in_(managed_dept_ids))
-                )
-            )
-        elif user_id:
-            # Employees see only their own data
-            base_filter = and_(base_filter, TimeEntry.user_id == user_id)
-        
-        # 1. Daily attendance trends (last 7 days)
-        daily_data = []
-        for i in range(7):
-            day = end_date - timedelta(days=i)
-            day_entries = TimeEntry.query.filter(
-                and_(
-                    func.date(TimeEntry.clock_in_time) == day,
-                    base_filter
-                )
-            ).count()
-            daily_data.append({
-                'date': day.strftime('%m/%d'),
-                'entries': day_entries
-            })
-        daily_data.reverse()
-        
-        # 2. Weekly hours distribution
-        weekly_hours = []
-        week_labels = []
-        for i in range(4):  # Last 4 weeks
-            week_start = end_date - timedelta(days=end_date.weekday() + (7 * i))
-            week_end = week_start + timedelta(days=6)
-            
-            week_entries = TimeEntry.query.filter(
-                and_(
-                    TimeEntry.clock_in_time >= week_start,
-                    TimeEntry.clock_in_time <= week_end + timedelta(days=1),
-                    base_filter
-                )
-            ).count()
-            
-            weekly_hours.append(week_entries * 8)  # Assume 8 hours per entry
-            week_labels.append(f"Week {week_start.strftime('%m/%d')}")
-        
-        weekly_hours.reverse()
-        week_labels.reverse()
-        
-        # 3. Leave application status distribution with proper filtering
-        if is_super_user:
-            leave_stats = {
-                'pending': LeaveApplication.query.filter_by(status='pending').count(),
-                'approved': LeaveApplication.query.filter_by(status='approved').count(),
-                'rejected': LeaveApplication.query.filter_by(status='rejected').count()
-            }
-        elif is_manager and managed_dept_ids:
-            # Managers see only leave applications from their managed departments
-            leave_stats = {
-                'pending': LeaveApplication.query.join(User).filter(
-                    and_(LeaveApplication.status == 'pending', User.department_id.in_(managed_dept_ids))
-                ).count(),
-                'approved': LeaveApplication.query.join(User).filter(
-                    and_(LeaveApplication.status == 'approved', User.department_id.in_(managed_dept_ids))
-                ).count(),
-                'rejected': LeaveApplication.query.join(User).filter(
-                    and_(LeaveApplication.status == 'rejected', User.department_id.in_(managed_dept_ids))
-                ).count()
-            }
-        else:
-            leave_stats = {
-                'pending': LeaveApplication.query.filter_by(user_id=user_id, status='pending').count(),
-                'approved': LeaveApplication.query.filter_by(user_id=user_id, status='approved').count(),
-                'rejected': LeaveApplication.query.filter_by(user_id=user_id, status='rejected').count()
-            }
-        
-        # 4. Employee productivity insights (for managers)
-        productivity_data = []
-        if is_manager_or_admin:
-            # Get top 5 most active employees with explicit join condition
-            active_employees = db.session.query(
-                User.username,
-                func.count(TimeEntry.id).label('entry_count')
-            ).join(TimeEntry, User.id == TimeEntry.user_id).filter(
-                TimeEntry.clock_in_time >= start_date
-            ).group_by(User.id, User.username).order_by(
-                func.count(TimeEntry.id).desc()
-            ).limit(5).all()
-            
-            productivity_data = [
-                {'name': emp.username, 'hours': emp.entry_count * 8}
-                for emp in active_employees
-            ]
-        
-        # 5. Time tracking patterns (hourly distribution)
-        hourly_patterns = [0] * 24
-        time_entries = TimeEntry.query.filter(base_filter).all()
-        
-        for entry in time_entries:
-            if entry.clock_in_time:
-                hour = entry.clock_in_time.hour
-                hourly_patterns[hour] += 1
-        
-        return {
-            'daily_attendance': {
-                'labels': [d['date'] for d in daily_data],
-                'data': [d['entries'] for d in daily_data]
-            },
-            'weekly_hours': {
-                'labels': week_labels,
-                'data': weekly_hours
-            },
-            'leave_distribution': {
-                'labels': ['Pending', 'Approved', 'Rejected'],
-                'data': [leave_stats['pending'], leave_stats['approved'], leave_stats['rejected']]
-            },
-            'productivity_insights': productivity_data,
-            'hourly_patterns': {
-                'labels': [f"{i}:00" for i in range(24)],
-                'data': hourly_patterns
-            },
-            'insights': {
-                'peak_hour': hourly_patterns.index(max(hourly_patterns)) if hourly_patterns else 9,
-                'total_entries_month': sum([d['entries'] for d in daily_data]),
-                'avg_daily_entries': sum([d['entries'] for d in daily_data]) / len(daily_data) if daily_data else 0,
-                'most_productive_day': max(daily_data, key=lambda x: x['entries'])['date'] if daily_data else 'N/A'
-            }
-        }
+        scope = resolve_scope(current_user, managed_dept_ids, user_id)
+        return get_dashboard_analytics(scope, include_productivity=is_manager_or_admin)
     except Exception as e:
         logging.error(f"Error generating analytics: {e}")
         return {
@@ -373,6 +236,10 @@ def reports():
 def export_csv():
     """Export attendance report to CSV with proper employee data restrictions"""
     try:
+        from csv_export import stream_csv, user_entry_rows, group_by_user, display_name, wants_gzip
+        from columnar_export import COLUMNAR_FORMATS, requested_format, stream_columnar
+        from dashboard_analytics import AnalyticsScope
+        
         # Check user role for data access control
         is_manager_or_admin = (hasattr(current_user, 'has_role') and 
                               (current_user.has_role('Manager') or 
@@ -380,74 +247,32 @@ def export_csv():
                                current_user.has_role('Super User')))
         
         # Get the same data as reports page
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
-        
-        if not start_date or not end_date:
-            today = datetime.now().date()
-            start_date = today.replace(day=1)
-            end_date = today
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-
-        # Apply user-specific filters for data access
-        base_time_filter = and_(
-            TimeEntry.clock_in_time >= start_date,
-            TimeEntry.clock_in_time <= end_date + timedelta(days=1)
-        )
-        
-        if not is_manager_or_admin:
-            # Restrict employees to only their own data
-            base_time_filter = and_(
-                base_time_filter,
-                TimeEntry.user_id == current_user.id
-            )
-
-        # Get attendance data based on user role
-        if is_manager_or_admin:
-            users_with_entries = db.session.query(User).join(
-                TimeEntry, User.id == TimeEntry.user_id
-            ).filter(base_time_filter).distinct().all()
-        else:
-            # Employees can only export their own data
-            users_with_entries = [current_user]
-
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['Employee', 'Email', 'Total Days', 'Total Hours', 'Average Hours/Day'])
-        
-        # Write data rows
-        for user in users_with_entries:
-            user_entries = TimeEntry.query.filter(
-                and_(
-                    TimeEntry.user_id == user.id,
-                    TimeEntry.clock_in_time >= start_date,
-                    TimeEntry.clock_in_time <= end_date + timedelta(days=1)
-                )
-            ).all()
-            
-            if user_entries:  # Only include users with entries
-                days_worked = len(user_entries)
-                total_hours = sum(entry.total_hours or 0 for entry in user_entries)
+        start_date, end_date = _export_date_range()
+        
+        # Employees can only export their own data
+        scope = AnalyticsScope('all') if is_manager_or_admin else AnalyticsScope('user', user_id=current_user.id)
+        
+        def rows():
+            for user, entries in group_by_user(user_entry_rows(start_date, end_date, scope)):
+                days_worked = 0
+                total_hours = 0
+                for entry in entries:
+                    days_worked += 1
+                    if entry.clock_out_time and entry.worked_hours is not None:
+                        total_hours += round(entry.worked_hours, 2)
                 avg_hours = total_hours / days_worked if days_worked > 0 else 0
-                
-                user_name = f"{user.first_name} {user.last_name}".strip() if hasattr(user, 'first_name') and user.first_name else user.username
-                writer.writerow([user_name, user.email, days_worked, round(total_hours, 2), round(avg_hours, 2)])
-
-        # Create response
-        output.seek(0)
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv'
+                yield [display_name(user), user.email, days_worked, round(total_hours, 2), round(avg_hours, 2)]
         
         # Add role context to filename
         role_context = "manager" if is_manager_or_admin else "employee"
-        response.headers['Content-Disposition'] = f'attachment; filename={role_context}_attendance_report_{start_date}_{end_date}.csv'
+        filename = f'{role_context}_attendance_report_{start_date}_{end_date}'
+        columns = [('Employee', 'string'), ('Email', 'string'), ('Total Days', 'int'),
+                   ('Total Hours', 'hours'), ('Average Hours/Day', 'hours')]
         
-        return response
+        export_format = requested_format(request)
+        if export_format in COLUMNAR_FORMATS:
+            return stream_columnar(filename, columns, rows(), export_format)
+        return stream_csv(f'{filename}.csv', [name for name, _ in columns], rows(), compress=wants_gzip(request))
         
     except Exception as e:
         logging.error(f"Error exporting CSV: {e}")
@@ -459,18 +284,12 @@ def export_csv():
 def export_payroll_csv():
     """Export payroll report to CSV with proper role-based filtering"""
     try:
+        from csv_export import stream_csv, user_entry_rows, group_by_user, display_name, wants_gzip
+        from dashboard_analytics import AnalyticsScope
+        
         # Get the same data as reports page
-        start_date = request.args.get('start_date')
-        end_date = request.args.get('end_date')
+        start_date, end_date = _export_date_range()
         
-        if not start_date or not end_date:
-            today = datetime.now().date()
-            start_date = today.replace(day=1)
-            end_date = today
-        else:
-            start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-
         # Apply role-based filtering (same logic as reports page)
         from dashboard_management import get_managed_departments
         
@@ -478,95 +297,87 @@ def export_payroll_csv():
         user_roles = [role.name for role in current_user.roles]
         is_manager_or_admin = any(role in ['Manager', 'Admin', 'Super User'] for role in user_roles)
         
-        if is_manager_or_admin:
-            # Managers see their department employees, Admins/Super Users see all
-            if 'Admin' in user_roles or 'Super User' in user_roles:
-                # Admin/Super User: get all users with time entries
-                users_with_entries = db.session.query(User).join(
-                    TimeEntry, User.id == TimeEntry.user_id
-                ).filter(
-                    and_(
-                        TimeEntry.clock_in_time >= start_date,
-                        TimeEntry.clock_in_time <= end_date + timedelta(days=1)
-                    )
-                ).distinct().all()
-            else:
-                # Manager: get only their department employees
-                managed_dept_ids = get_managed_departments(current_user.id)
-                if managed_dept_ids:
-                    users_with_entries = db.session.query(User).join(
-                        TimeEntry, User.id == TimeEntry.user_id
-                    ).filter(
-                        and_(
-                            TimeEntry.clock_in_time >= start_date,
-                            TimeEntry.clock_in_time <= end_date + timedelta(days=1),
-                            User.department_id.in_(managed_dept_ids)
-                        )
-                    ).distinct().all()
-                else:
-                    users_with_entries = []
+        if 'Admin' in user_roles or 'Super User' in user_roles:
+            # Admin/Super User: all users with time entries
+            scope = AnalyticsScope('all')
+        elif is_manager_or_admin:
+            # Manager: only their department employees (none when they manage no department)
+            scope = AnalyticsScope('departments', department_ids=tuple(get_managed_departments(current_user.id)))
         else:
             # Employee: only see their own data
-            users_with_entries = db.session.query(User).join(
-                TimeEntry, User.id == TimeEntry.user_id
-            ).filter(
-                and_(
-                    TimeEntry.clock_in_time >= start_date,
-                    TimeEntry.clock_in_time <= end_date + timedelta(days=1),
-                    User.id == current_user.id
-                )
-            ).distinct().all()
-
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['Employee', 'Period Start', 'Period End', 'Regular Hours', 'Overtime Hours', 'Total Hours', 'Gross Pay'])
-        
-        # Write data rows
-        for user in users_with_entries:
-            user_entries = TimeEntry.query.filter(
-                and_(
-                    TimeEntry.user_id == user.id,
-                    TimeEntry.clock_in_time >= start_date,
-                    TimeEntry.clock_in_time <= end_date + timedelta(days=1)
-                )
-            ).all()
-            
-            total_hours = len(user_entries) * 8  # Simplified calculation
-            regular_hours = min(total_hours, 40)
-            overtime_hours = max(0, total_hours - 40)
-            gross_pay = total_hours * 15.0  # R15/hour base rate
-            
-            user_name = f"{user.first_name} {user.last_name}".strip() if hasattr(user, 'first_name') and user.first_name else user.username
-            
-            writer.writerow([
-                user_name, 
-                start_date.strftime('%Y-%m-%d'), 
-                end_date.strftime('%Y-%m-%d'), 
-                regular_hours, 
-                overtime_hours, 
-                total_hours, 
-                f"R{gross_pay:.2f}"
-            ])
-
-        # Create response
-        output.seek(0)
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv'
+            scope = AnalyticsScope('user', user_id=current_user.id)
+        
+        def rows():
+            for user, entries in group_by_user(user_entry_rows(start_date, end_date, scope)):
+                total_hours = sum(1 for _ in entries) * 8  # Simplified calculation
+                regular_hours = min(total_hours, 40)
+                overtime_hours = max(0, total_hours - 40)
+                gross_pay = total_hours * 15.0  # R15/hour base rate
+                
+                yield [
+                    display_name(user), 
+                    start_date.strftime('%Y-%m-%d'), 
+                    end_date.strftime('%Y-%m-%d'), 
+                    regular_hours, 
+                    overtime_hours, 
+                    total_hours, 
+                    f"R{gross_pay:.2f}"
+                ]
         
         # Add role context to filename
         role_context = "admin" if 'Admin' in user_roles or 'Super User' in user_roles else ("manager" if is_manager_or_admin else "employee")
-        response.headers['Content-Disposition'] = f'attachment; filename={role_context}_payroll_report_{start_date}_{end_date}.csv'
-        
-        return response
+        return stream_csv(
+            f'{role_context}_payroll_report_{start_date}_{end_date}.csv',
+            ['Employee', 'Period Start', 'Period End', 'Regular Hours', 'Overtime Hours', 'Total Hours', 'Gross Pay'],
+            rows(),
+            compress=wants_gzip(request)
+        )
         
     except Exception as e:
         logging.error(f"Error exporting payroll CSV: {e}")
         flash("Error generating payroll CSV export.", "error")
         return redirect(url_for('main.reports'))
 
+@main_bp.route('/export-time-entries')
+@login_required
+def export_time_entries():
+    """Export individual time entries as typed Parquet (default) or Arrow for analytics tooling"""
+    try:
+        from columnar_export import TIME_ENTRY_COLUMNS, requested_format, stream_columnar, time_entry_rows
+        from dashboard_analytics import AnalyticsScope
+        
+        start_date, end_date = _export_date_range()
+        export_format = requested_format(request, default='parquet')
+        if export_format == 'csv':
+            export_format = 'parquet'
+        
+        # Same access rules as the reports page: managers their departments, employees themselves
+        is_super_user = current_user.has_role('Super User') or current_user.has_role('Admin')
+        if is_super_user:
+            scope = AnalyticsScope('all')
+        elif current_user.has_role('Manager'):
+            scope = AnalyticsScope('departments', department_ids=tuple(get_managed_departments(current_user.id)))
+        else:
+            scope = AnalyticsScope('user', user_id=current_user.id)
+        
+        return stream_columnar(f'time_entries_{start_date}_{end_date}', TIME_ENTRY_COLUMNS,
+                               time_entry_rows(start_date, end_date, scope), export_format)
+        
+    except Exception as e:
+        logging.error(f"Error exporting time entries: {e}")
+        flash("Error generating time entry export.", "error")
+        return redirect(url_for('main.reports'))
+
+def _export_date_range():
+    """Export period from the start_date/end_date arguments, defaulting to month to date"""
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    
+    if not start_date or not end_date:
+        today = datetime.now().date()
+        return today.replace(day=1), today
+    return datetime.strptime(start_date, '%Y-%m-%d').date(), datetime.strptime(end_date, '%Y-%m-%d').date()
+
 @main_bp.route('/quick-actions')
 @login_required
 def quick_actions():
@@ -8,15 +8,19 @@ import json
 import logging
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
+from sqlalchemy import func
 from app import db
-from models import User, TimeEntry, PayCalculation, LeaveApplication, Schedule
+from models import User, TimeEntry, PayCalculation, LeaveApplication, Schedule, Department, PayCode
 import os
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rows fetched per round-trip when exporting time entries
+TIME_ENTRY_EXPORT_CHUNK_SIZE = int(os.environ.get('SAGE_VIP_EXPORT_CHUNK_SIZE', '5000'))
+
 @dataclass
 class SAGEEmployee:
     """SAGE VIP Employee data structure"""
@@ -188,51 +192,70 @@ class SAGEVIPIntegration:
             raise Exception("Failed to authenticate with SAGE VIP")
         
         try:
-            # Get time entries from WFM database
-            time_entries = TimeEntry.query.filter(
-                TimeEntry.clock_in_time.between(start_date, end_date),
-                TimeEntry.status == 'completed'
-            ).all()
-            
-            sage_time_entries = []
-            
-            for entry in time_entries:
-                if entry.user and entry.user.employee_id:
-                    # Calculate hours worked
-                    hours_worked = self._calculate_hours_worked(entry)
-                    overtime_hours = self._calculate_overtime_hours(entry)
-                    
-                    sage_entry = SAGETimeEntry(
-                        employee_id=entry.user.employee_id,
-                        date=entry.clock_in_time.strftime('%Y-%m-%d'),
-                        hours_worked=hours_worked,
-                        overtime_hours=overtime_hours,
-                        pay_code=entry.pay_code.code if entry.pay_code else 'REGULAR',
-                        cost_center=entry.user.department or 'DEFAULT',
-                        notes=entry.notes or ''
-                    )
-                    
-                    sage_time_entries.append(sage_entry)
+            # Read in chunks, but send the period as one all-or-nothing request so a
+            # failed push can be retried without posting any entries to payroll twice
+            time_entries = []
+            for sage_time_entries in self.iter_time_entry_export_batches(start_date, end_date):
+                time_entries.extend(asdict(entry) for entry in sage_time_entries)
             
-            # Push to SAGE VIP
-            if sage_time_entries:
+            if time_entries:
                 timesheet_url = f"{self.base_url}{self.endpoints['timesheet']}"
-                payload = {
-                    'time_entries': [entry.__dict__ for entry in sage_time_entries]
-                }
-                
-                response = self.session.post(timesheet_url, json=payload)
+                response = self.session.post(timesheet_url, json={'time_entries': time_entries})
                 response.raise_for_status()
                 
-                logger.info(f"Successfully pushed {len(sage_time_entries)} time entries to SAGE VIP")
-                return True
-            
+                logger.info(f"Successfully pushed {len(time_entries)} time entries to SAGE VIP")
             return True
             
         except requests.exceptions.RequestException as e:
             logger.error(f"Failed to push time entries to SAGE VIP: {e}")
             return False
     
+    def iter_time_entry_export_batches(self, start_date: datetime, end_date: datetime,
+                                       chunk_size: int = TIME_ENTRY_EXPORT_CHUNK_SIZE):
+        """Yield lists of SAGETimeEntry built from a single streamed projection query.
+        
+        Only the columns SAGE needs are selected (joined to users, departments and
+        pay codes), so no ORM entities are loaded and no lazy loads are triggered.
+        """
+        query = (
+            db.select(
+                User.employee_number.label('employee_id'),
+                TimeEntry.clock_in_time,
+                TimeEntry.clock_out_time,
+                TimeEntry.total_break_minutes,
+                TimeEntry.notes,
+                func.coalesce(PayCode.code, 'REGULAR').label('pay_code'),
+                func.coalesce(Department.cost_center, Department.code, 'DEFAULT').label('cost_center'),
+            )
+            .join(User, TimeEntry.user_id == User.id)
+            .outerjoin(Department, User.department_id == Department.id)
+            .outerjoin(PayCode, TimeEntry.pay_code_id == PayCode.id)
+            .where(
+                TimeEntry.clock_in_time.between(start_date, end_date),
+                TimeEntry.status == 'Closed',
+                User.employee_number.isnot(None)
+            )
+            .order_by(TimeEntry.id)
+            .execution_options(yield_per=chunk_size)
+        )
+        
+        result = db.session.execute(query)
+        for rows in result.partitions():
+            batch = []
+            for row in rows:
+                hours_worked = self._worked_hours(row.clock_in_time, row.clock_out_time,
+                                                  row.total_break_minutes)
+                batch.append(SAGETimeEntry(
+                    employee_id=row.employee_id,
+                    date=row.clock_in_time.strftime('%Y-%m-%d'),
+                    hours_worked=hours_worked,
+                    overtime_hours=round(hours_worked - 8, 2) if hours_worked > 8 else 0.0,
+                    pay_code=row.pay_code,
+                    cost_center=row.cost_center,
+                    notes=row.notes or ''
+                ))
+            yield batch
+    
     def push_leave_entries_to_sage(self, start_date: datetime, end_date: datetime) -> bool:
         """Push leave applications from WFM to SAGE VIP Payroll"""
         if not self.authenticate():
@@ -331,10 +354,16 @@ class SAGEVIPIntegration:
     
     def _calculate_hours_worked(self, time_entry: TimeEntry) -> float:
         """Calculate regular hours worked from time entry"""
-        if time_entry.clock_out_time and time_entry.clock_in_time:
-            total_minutes = (time_entry.clock_out_time - time_entry.clock_in_time).total_seconds() / 60
-            break_minutes = time_entry.total_break_minutes or 0
-            worked_minutes = total_minutes - break_minutes
+        return self._worked_hours(time_entry.clock_in_time, time_entry.clock_out_time,
+                                  time_entry.total_break_minutes)
+    
+    @staticmethod
+    def _worked_hours(clock_in_time: Optional[datetime], clock_out_time: Optional[datetime],
+                      break_minutes: Optional[int]) -> float:
+        """Calculate worked hours from raw clock and break values"""
+        if clock_out_time and clock_in_time:
+            total_minutes = (clock_out_time - clock_in_time).total_seconds() / 60
+            worked_minutes = total_minutes - (break_minutes or 0)
             return round(worked_minutes / 60, 2)
         return 0.0
     
@@ -0,0 +1,294 @@
+"""
+Schedule Generation Jobs
+Runs AI schedule generation on a background thread pool with DB-backed progress tracking
+"""
+
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app, url_for
+
+from app import db
+from models import Schedule, ScheduleGenerationJob
+from scheduling_features import mark_features_stale
+from tenant_scope import current_tenant_id, tenant_context
+
+logger = logging.getLogger(__name__)
+
+# Concurrent generation runs per web process
+MAX_WORKERS = int(os.environ.get('SCHEDULE_JOB_WORKERS', '2'))
+
+# Job statuses
+QUEUED = 'Queued'
+RUNNING = 'Running'
+COMPLETED = 'Completed'
+FAILED = 'Failed'
+CANCELLED = 'Cancelled'
+
+# A queued or running job whose row has not changed for this long lost its worker (restart or deploy)
+JOB_ORPHAN_TIMEOUT = timedelta(seconds=int(os.environ.get('SCHEDULE_JOB_ORPHAN_TIMEOUT', '1800')))
+
+ORPHANED_MESSAGE = 'The worker running this job stopped (restart or deploy). Please generate the schedule again.'
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='schedule-job')
+
+# Jobs queued on or running in this process's pool; alive by definition, so never failed here
+_local_job_ids = set()
+_local_job_lock = threading.Lock()
+
+
+def submit_schedule_job(requested_by_id, start_date, end_date, department_id=None) -> ScheduleGenerationJob:
+    """Record a queued job and hand it to the worker pool"""
+    job = ScheduleGenerationJob(
+        requested_by_id=requested_by_id,
+        department_id=department_id,
+        start_date=start_date,
+        end_date=end_date,
+        status=QUEUED
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    # Clears jobs left behind by a previous process before new ones queue up
+    fail_orphaned_jobs()
+
+    with _local_job_lock:
+        _local_job_ids.add(job.id)
+    _executor.submit(_run_job, current_app._get_current_object(), job.id, current_tenant_id())
+    logger.info(f"Queued schedule generation job {job.id} for {start_date} - {end_date}")
+    return job
+
+
+def cancel_schedule_job(job: ScheduleGenerationJob) -> bool:
+    """Request cancellation; queued jobs stop immediately, running ones at the next progress step"""
+    if job.is_finished:
+        return False
+
+    job.cancel_requested = True
+    if job.status == QUEUED:
+        job.status = CANCELLED
+        job.completed_at = datetime.utcnow()
+    db.session.commit()
+    return True
+
+
+def fail_orphaned_jobs(job_ids=None) -> int:
+    """Mark queued or running jobs that have been quiet for JOB_ORPHAN_TIMEOUT as failed.
+
+    The pool is in-process, so a restart loses its jobs without a trace; without
+    this their status pages would poll forever. Limited to job_ids when given.
+    """
+    jobs = ScheduleGenerationJob.__table__
+    statement = jobs.update().where(
+        jobs.c.status.in_((QUEUED, RUNNING)),
+        jobs.c.updated_at < datetime.utcnow() - JOB_ORPHAN_TIMEOUT
+    )
+    with _local_job_lock:
+        local_ids = list(_local_job_ids)
+    if local_ids:
+        statement = statement.where(jobs.c.id.notin_(local_ids))
+    if job_ids is not None:
+        statement = statement.where(jobs.c.id.in_(job_ids))
+
+    failed = db.session.execute(
+        statement.values(status=FAILED, error_message=ORPHANED_MESSAGE, completed_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    if failed:
+        logger.warning(f"Marked {failed} orphaned schedule generation job(s) as failed")
+    return failed
+
+
+def expire_orphaned_job(job: ScheduleGenerationJob) -> ScheduleGenerationJob:
+    """Fail an unfinished job whose worker is gone, so whoever is polling it gets an answer"""
+    if not job.is_finished and fail_orphaned_jobs([job.id]):
+        db.session.refresh(job)
+    return job
+
+
+def _run_job(app, job_id, tenant_id=None):
+    """Worker entry point: run one generation job inside its own app context and the requester's tenant"""
+    from ai_scheduling import GenerationCancelled, scheduling_ai
+
+    jobs = ScheduleGenerationJob.__table__
+    with app.app_context(), tenant_context(tenant_id):
+        try:
+            # Claim the job; skipped if it was cancelled while queued
+            claimed = db.session.execute(
+                jobs.update()
+                .where(jobs.c.id == job_id, jobs.c.status == QUEUED, jobs.c.cancel_requested == False)
+                .values(status=RUNNING, started_at=datetime.utcnow())
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return
+
+            job = db.session.get(ScheduleGenerationJob, job_id)
+            last_progress = [0]
+
+            def report(percent):
+                # Write progress only when it moves; the same statement doubles as the cancel check
+                if percent <= last_progress[0]:
+                    return
+                still_wanted = db.session.execute(
+                    jobs.update()
+                    .where(jobs.c.id == job_id, jobs.c.cancel_requested == False)
+                    .values(progress=percent)
+                ).rowcount
+                db.session.commit()
+                if not still_wanted:
+                    raise GenerationCancelled()
+                last_progress[0] = percent
+
+            result = scheduling_ai.generate_optimized_schedule(
+                department_id=job.department_id,
+                start_date=job.start_date,
+                end_date=job.end_date,
+                progress_callback=report
+            )
+
+            if result['success']:
+                values = dict(status=COMPLETED, progress=100, result=json.dumps(result))
+            else:
+                values = dict(status=FAILED, error_message=result.get('error', 'Unknown error'))
+            _finish_job(job_id, **values)
+
+        except GenerationCancelled:
+            db.session.rollback()
+            _finish_job(job_id, status=CANCELLED)
+            logger.info(f"Schedule generation job {job_id} cancelled")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Schedule generation job {job_id} failed: {e}")
+            _finish_job(job_id, status=FAILED, error_message=str(e))
+        finally:
+            db.session.remove()
+            with _local_job_lock:
+                _local_job_ids.discard(job_id)
+
+
+def _finish_job(job_id, **values):
+    """Record a job's terminal state"""
+    jobs = ScheduleGenerationJob.__table__
+    db.session.execute(
+        jobs.update().where(jobs.c.id == job_id).values(completed_at=datetime.utcnow(), **values)
+    )
+    db.session.commit()
+
+
+def apply_schedule_job(job: ScheduleGenerationJob, manager_id, overwrite_existing=False,
+                       notify_employees=True) -> dict:
+    """Create schedules from a completed job's recommendations.
+
+    Recommendations that overlap an employee's existing schedule are skipped, or
+    the existing schedule is cancelled when overwrite_existing is set. A job can
+    only be applied once.
+    """
+    if job.status != COMPLETED:
+        raise ValueError(f'Job {job.id} is {job.status.lower()}, not completed')
+
+    jobs = ScheduleGenerationJob.__table__
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        jobs.update().where(jobs.c.id == job.id, jobs.c.applied_at.is_(None)).values(applied_at=now)
+    ).rowcount
+    if not claimed:
+        raise ValueError(f'Job {job.id} has already been applied')
+
+    shifts = []
+    for rec in job.get_result().get('schedule_recommendations', []):
+        start_time = datetime.strptime(f"{rec['date']} {rec['start_time']}", '%Y-%m-%d %H:%M')
+        shifts.append((rec['employee_id'], start_time, start_time + timedelta(hours=rec['hours']), rec))
+
+    # Existing schedules for everyone in the roster, fetched once for the whole period
+    existing = defaultdict(list)
+    if shifts:
+        for schedule in db.session.execute(
+            db.select(Schedule.id, Schedule.user_id, Schedule.start_time, Schedule.end_time).where(
+                Schedule.user_id.in_({user_id for user_id, _, _, _ in shifts}),
+                Schedule.start_time < max(end for _, _, end, _ in shifts),
+                Schedule.end_time > min(start for _, start, _, _ in shifts),
+                Schedule.status != 'Cancelled'
+            )
+        ):
+            existing[schedule.user_id].append(schedule)
+
+    batch_id = str(uuid.uuid4())
+    new_schedules = []
+    replaced_ids = set()
+    conflicts = 0
+    for user_id, start_time, end_time, rec in shifts:
+        overlapping = [s for s in existing[user_id] if s.start_time < end_time and s.end_time > start_time]
+        if overlapping:
+            conflicts += 1
+            if not overwrite_existing:
+                continue
+            replaced_ids.update(s.id for s in overlapping)
+
+        new_schedules.append({
+            'user_id': user_id,
+            'start_time': start_time,
+            'end_time': end_time,
+            'assigned_by_manager_id': manager_id,
+            'notes': f"AI-generated ({rec['shift_name']} shift, score {rec['ai_score']:.0f}, job {job.id})",
+            'status': 'Scheduled',
+            'batch_id': batch_id,
+            'created_at': now,
+            'updated_at': now
+        })
+
+    if replaced_ids:
+        db.session.execute(
+            db.update(Schedule).where(Schedule.id.in_(replaced_ids))
+            .values(status='Cancelled', updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+    if new_schedules:
+        db.session.execute(db.insert(Schedule), new_schedules)
+
+        mark_features_stale({s['user_id'] for s in new_schedules})
+
+    db.session.execute(jobs.update().where(jobs.c.id == job.id).values(applied_count=len(new_schedules)))
+    db.session.commit()
+
+    if notify_employees and new_schedules:
+        _notify_employees(new_schedules, job)
+
+    logger.info(f"Applied schedule generation job {job.id}: {len(new_schedules)} shifts, {conflicts} conflicts")
+    return {
+        'applied_count': len(new_schedules),
+        'conflicts': conflicts,
+        'conflicts_resolved': len(replaced_ids),
+        'batch_id': batch_id
+    }
+
+
+def _notify_employees(new_schedules, job):
+    """One notification per employee summarising their new shifts"""
+    from notifications import NotificationService
+
+    shift_counts = defaultdict(int)
+    for schedule in new_schedules:
+        shift_counts[schedule['user_id']] += 1
+
+    for user_id, count in shift_counts.items():
+        NotificationService.create_notification(
+            user_id=user_id,
+            type_name='schedule_change',
+            title='New Schedule Published',
+            message=f'You have been scheduled for {count} shift(s) between '
+                    f'{job.start_date.strftime("%b %d")} and {job.end_date.strftime("%b %d")}.',
+            action_url=url_for('scheduling.my_schedule'),
+            action_text='View Schedule',
+            priority='high',
+            category='schedule',
+            related_entity_type='ScheduleGenerationJob',
+            related_entity_id=job.id,
+            expires_hours=72
+        )
@@ -0,0 +1,178 @@
+"""
+Shift Assignment Optimizer
+Matrix-based roster optimisation for SchedulingAI using NumPy and linear assignment
+"""
+
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# NumPy and SciPy are optional and slow to import, so they are loaded on first use
+np = None
+linear_sum_assignment = None
+_solvers_loaded = False
+
+# Default weekly hours cap per employee
+DEFAULT_MAX_HOURS_PER_WEEK = 40
+
+# Cost added per hour already assigned in the period, so work is spread evenly
+FATIGUE_PENALTY_PER_HOUR = 0.5
+
+# Cost used for infeasible cells (leave days, hours cap exceeded)
+INFEASIBLE_COST = 1e9
+
+
+def _load_solvers():
+    """Import NumPy and SciPy once, leaving them None when not installed"""
+    global np, linear_sum_assignment, _solvers_loaded
+    if _solvers_loaded:
+        return
+    try:
+        import numpy
+        np = numpy
+    except ImportError:  # pragma: no cover - optional dependency
+        pass
+    try:
+        from scipy.optimize import linear_sum_assignment as solver
+        linear_sum_assignment = solver
+    except ImportError:  # pragma: no cover - optional dependency
+        pass
+    _solvers_loaded = True
+
+
+def shift_duration_hours(shift) -> float:
+    """Length of a shift in hours, handling shifts that end after midnight"""
+    start = datetime.combine(datetime.min.date(), shift['start'])
+    end = datetime.combine(datetime.min.date(), shift['end'])
+    if end < start:
+        end += timedelta(days=1)
+    return (end - start).total_seconds() / 3600
+
+
+class ShiftAssignmentOptimizer:
+    """
+    Builds an employees x (day, shift) score matrix and solves each day's coverage
+    as a linear assignment problem, carrying hours forward so weekly caps hold.
+    """
+
+    def __init__(self, shifts: List[dict], max_hours_per_week: float = DEFAULT_MAX_HOURS_PER_WEEK):
+        self.shifts = shifts
+        self.max_hours_per_week = max_hours_per_week
+
+    @staticmethod
+    def is_available() -> bool:
+        """True when NumPy is installed; SciPy is optional (greedy fallback)"""
+        _load_solvers()
+        return np is not None
+
+    def build_score_matrix(self, employee_ids: List[int], employee_availability: Dict[int, dict],
+                           days: List) -> Tuple['np.ndarray', 'np.ndarray']:
+        """Return (scores, on_leave): scores is E x D x S, on_leave is E x D"""
+        employee_count = len(employee_ids)
+        base_scores = np.zeros(employee_count)
+        day_histogram = np.zeros((employee_count, 7))
+        hour_histogram = np.zeros((employee_count, 24))
+        on_leave = np.zeros((employee_count, len(days)), dtype=bool)
+        day_ordinals = np.array([day.toordinal() for day in days])
+
+        for row, employee_id in enumerate(employee_ids):
+            availability = employee_availability[employee_id]
+            patterns = availability['historical_patterns']
+            base_scores[row] = availability['availability_score']
+            for weekday, count in patterns['preferred_days'].items():
+                day_histogram[row, int(weekday)] = count
+            for hour, count in patterns['preferred_shifts'].items():
+                hour_histogram[row, int(hour)] = count
+            for constraint in availability.get('leave_constraints', []):
+                on_leave[row] |= ((day_ordinals >= constraint['start_date'].toordinal()) &
+                                  (day_ordinals <= constraint['end_date'].toordinal()))
+
+        weekdays = np.array([day.weekday() for day in days])
+        shift_hours = np.array([shift['start'].hour for shift in self.shifts])
+
+        # Same weighting as SchedulingAI: +2 per preferred-day hit, +3 per preferred-shift hit
+        scores = (base_scores[:, None, None]
+                  + 2 * day_histogram[:, weekdays][:, :, None]
+                  + 3 * hour_histogram[:, shift_hours][:, None, :])
+        scores = np.minimum(scores, 100)
+        scores[on_leave] = 0
+        return scores, on_leave
+
+    def _assign(self, cost: 'np.ndarray') -> Tuple['np.ndarray', 'np.ndarray']:
+        """Solve one day's assignment; greedy by slot when SciPy is unavailable"""
+        if linear_sum_assignment is not None:
+            return linear_sum_assignment(cost)
+
+        rows, cols = [], []
+        taken = np.zeros(cost.shape[0], dtype=bool)
+        for col in range(cost.shape[1]):
+            column = np.where(taken, INFEASIBLE_COST, cost[:, col])
+            row = int(np.argmin(column))
+            if column[row] >= INFEASIBLE_COST:
+                continue
+            taken[row] = True
+            rows.append(row)
+            cols.append(col)
+        return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+    def solve(self, employee_ids: List[int], employee_availability: Dict[int, dict], days: List,
+              progress_callback: Optional[Callable[[int, int], None]] = None
+              ) -> List[Tuple[int, object, dict, float, int]]:
+        """
+        Assign employees to every (day, shift) slot of the period.
+
+        Returns (employee_id, day, shift, score, priority) tuples. Each employee
+        works at most one shift per day and stays within the weekly hours cap.
+        progress_callback, if given, is called with (days_done, total_days).
+        """
+        if not employee_ids or not days:
+            return []
+        _load_solvers()
+
+        scores, on_leave = self.build_score_matrix(employee_ids, employee_availability, days)
+
+        # One column per required head on each shift
+        slot_shift = np.repeat(np.arange(len(self.shifts)),
+                               [shift.get('required', 1) for shift in self.shifts])
+        durations = np.array([shift_duration_hours(shift) for shift in self.shifts])
+        slot_hours = durations[slot_shift]
+
+        period_hours = np.zeros(len(employee_ids))
+        week_hours = np.zeros(len(employee_ids))
+        current_week = None
+        assignments = []
+
+        for day_index, day in enumerate(days):
+            week = day.isocalendar()[:2]
+            if week != current_week:
+                week_hours[:] = 0
+                current_week = week
+
+            cost = -scores[:, day_index, slot_shift] + FATIGUE_PENALTY_PER_HOUR * period_hours[:, None]
+            infeasible = on_leave[:, day_index][:, None] | (
+                week_hours[:, None] + slot_hours[None, :] > self.max_hours_per_week
+            )
+            cost[infeasible] = INFEASIBLE_COST
+
+            rows, cols = self._assign(cost)
+            keep = cost[rows, cols] < INFEASIBLE_COST
+            rows, cols = rows[keep], cols[keep]
+
+            period_hours[rows] += slot_hours[cols]
+            week_hours[rows] += slot_hours[cols]
+
+            # Priority ranks the people on each shift by fit score
+            for shift_index, shift in enumerate(self.shifts):
+                on_shift = rows[slot_shift[cols] == shift_index]
+                shift_scores = scores[on_shift, day_index, shift_index]
+                for priority, order in enumerate(np.argsort(-shift_scores, kind='stable'), start=1):
+                    employee_row = on_shift[order]
+                    assignments.append((employee_ids[employee_row], day, shift,
+                                        float(shift_scores[order]), priority))
+
+            if progress_callback:
+                progress_callback(day_index + 1, len(days))
+
+        return assignments
@@ -0,0 +1,226 @@
+"""
+Scheduling Feature Store
+Precomputes per-employee availability features for SchedulingAI in batched passes
+"""
+
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+
+from sqlalchemy import event, func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app import db
+from models import EmployeeAvailabilityFeature, LeaveApplication, Schedule, TimeEntry
+
+logger = logging.getLogger(__name__)
+
+# History windows mined for each feature
+SCHEDULE_HISTORY_DAYS = 30
+TIME_ENTRY_HISTORY_DAYS = 60
+LEAVE_LOOKAHEAD_DAYS = 30
+
+# Features older than this are recomputed even if nothing marked them stale,
+# because the history windows slide forward every day
+FEATURE_MAX_AGE = timedelta(hours=24)
+
+# Leave statuses that block or penalise scheduling
+BLOCKING_LEAVE_STATUSES = ('Approved', 'Pending')
+
+
+def calculate_availability_score(schedule_count: int, leave_count: int) -> int:
+    """Overall availability score: penalise frequent leave, reward consistent scheduling"""
+    score = 100
+    if leave_count:
+        score -= min(leave_count * 5, 30)
+    if schedule_count:
+        score += min(schedule_count, 20)
+    return max(0, min(score, 100))
+
+
+def _upsert_statement():
+    """Dialect-specific INSERT ... ON CONFLICT (user_id) DO UPDATE for feature rows"""
+    table = EmployeeAvailabilityFeature.__table__
+    if db.session.get_bind().dialect.name == 'sqlite':
+        statement = sqlite.insert(table)
+    else:
+        statement = postgresql.insert(table)
+    return statement.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={column.name: statement.excluded[column.name] for column in table.columns if column.name != 'user_id'}
+    )
+
+
+class AvailabilityFeatureStore:
+    """Batched computation and lookup of EmployeeAvailabilityFeature rows"""
+
+    def get_features(self, user_ids: Iterable[int]) -> Dict[int, dict]:
+        """Return availability features for the given users, refreshing stale or missing ones"""
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return {}
+
+        cutoff = datetime.utcnow() - FEATURE_MAX_AGE
+        rows = EmployeeAvailabilityFeature.query.filter(
+            EmployeeAvailabilityFeature.user_id.in_(user_ids)
+        ).all()
+        fresh = {row.user_id: row for row in rows if not row.is_stale and row.computed_at >= cutoff}
+
+        to_refresh = [user_id for user_id in user_ids if user_id not in fresh]
+        if to_refresh:
+            fresh.update(self.refresh(to_refresh))
+
+        return {user_id: row.to_availability() for user_id, row in fresh.items()}
+
+    def refresh(self, user_ids: List[int]) -> Dict[int, EmployeeAvailabilityFeature]:
+        """Recompute features for a set of users with one query per source table.
+
+        The rows are written but not committed; the caller's transaction owns them.
+        """
+        now = datetime.utcnow()
+        today = now.date()
+        schedule_start = now - timedelta(days=SCHEDULE_HISTORY_DAYS)
+        entry_start = now - timedelta(days=TIME_ENTRY_HISTORY_DAYS)
+
+        # Schedules: one columnar fetch over the history window for every user
+        preferred_days = defaultdict(lambda: defaultdict(int))
+        preferred_shifts = defaultdict(lambda: defaultdict(int))
+        schedule_hours = defaultdict(float)
+        schedule_counts = defaultdict(int)
+        for user_id, start_time, end_time in db.session.execute(
+            db.select(Schedule.user_id, Schedule.start_time, Schedule.end_time).where(
+                Schedule.user_id.in_(user_ids),
+                Schedule.start_time >= schedule_start,
+                Schedule.start_time <= now
+            )
+        ):
+            preferred_days[user_id][start_time.weekday()] += 1
+            preferred_shifts[user_id][start_time.hour] += 1
+            schedule_counts[user_id] += 1
+            if end_time:
+                schedule_hours[user_id] += (end_time - start_time).total_seconds() / 3600
+
+        # Time entries: clock-in hour histogram aggregated in SQL
+        clock_in_hour = TimeEntry.clock_in_hour
+        hour_distribution = defaultdict(dict)
+        for user_id, hour, count in db.session.execute(
+            db.select(TimeEntry.user_id, clock_in_hour, func.count(TimeEntry.id))
+            .where(TimeEntry.user_id.in_(user_ids), TimeEntry.clock_in_time >= entry_start)
+            .group_by(TimeEntry.user_id, clock_in_hour)
+        ):
+            hour_distribution[user_id][int(hour)] = count
+
+        # Leave: count of upcoming approved or pending applications per user
+        leave_counts = dict(db.session.execute(
+            db.select(LeaveApplication.user_id, func.count(LeaveApplication.id))
+            .where(
+                LeaveApplication.user_id.in_(user_ids),
+                LeaveApplication.start_date <= today + timedelta(days=LEAVE_LOOKAHEAD_DAYS),
+                LeaveApplication.end_date >= today,
+                LeaveApplication.status.in_(BLOCKING_LEAVE_STATUSES)
+            )
+            .group_by(LeaveApplication.user_id)
+        ).all())
+
+        rows = []
+        for user_id in user_ids:
+            count = schedule_counts.get(user_id, 0)
+            hours = hour_distribution.get(user_id, {})
+            rows.append(dict(
+                user_id=user_id,
+                preferred_days=json.dumps(preferred_days.get(user_id, {})),
+                preferred_shifts=json.dumps(preferred_shifts.get(user_id, {})),
+                hour_distribution=json.dumps(hours),
+                preferred_start_hour=max(hours, key=hours.get) if hours else 9,
+                average_hours_per_week=schedule_hours[user_id] / count * 7 if count else 0,
+                schedule_count=count,
+                leave_count=leave_counts.get(user_id, 0),
+                availability_score=calculate_availability_score(count, leave_counts.get(user_id, 0)),
+                is_stale=False,
+                computed_at=now
+            ))
+
+        # One bulk upsert; concurrent refreshes of the same users both succeed, the last one wins
+        db.session.execute(_upsert_statement(), rows)
+
+        logger.info(f"Refreshed availability features for {len(user_ids)} employees")
+        return {row['user_id']: EmployeeAvailabilityFeature(**row) for row in rows}
+
+    def refresh_stale(self, batch_size: int = 500) -> int:
+        """Recompute every stale or expired feature row, committing batch by batch"""
+        cutoff = datetime.utcnow() - FEATURE_MAX_AGE
+        refreshed = 0
+        while True:
+            user_ids = db.session.execute(
+                db.select(EmployeeAvailabilityFeature.user_id)
+                .where(or_(EmployeeAvailabilityFeature.is_stale == True,
+                           EmployeeAvailabilityFeature.computed_at < cutoff))
+                .limit(batch_size)
+            ).scalars().all()
+            if not user_ids:
+                return refreshed
+            self.refresh(user_ids)
+            db.session.commit()
+            refreshed += len(user_ids)
+
+    def get_leave_constraints(self, user_ids: Iterable[int], start_date, end_date) -> Dict[int, list]:
+        """Leave constraints for the scheduling period for all users in one query"""
+        constraints = defaultdict(list)
+        user_ids = list(user_ids)
+        if not user_ids:
+            return constraints
+
+        for leave in db.session.execute(
+            db.select(LeaveApplication.user_id, LeaveApplication.start_date, LeaveApplication.end_date,
+                      LeaveApplication.leave_type_id, LeaveApplication.status)
+            .where(
+                LeaveApplication.user_id.in_(user_ids),
+                LeaveApplication.start_date <= end_date,
+                LeaveApplication.end_date >= start_date,
+                LeaveApplication.status.in_(BLOCKING_LEAVE_STATUSES)
+            )
+        ):
+            constraints[leave.user_id].append({
+                'start_date': leave.start_date,
+                'end_date': leave.end_date,
+                'type': leave.leave_type_id,
+                'status': leave.status
+            })
+        return constraints
+
+
+availability_feature_store = AvailabilityFeatureStore()
+
+
+def mark_features_stale(user_ids, connection=None):
+    """Flag the users' cached features as stale in the current transaction.
+
+    Core INSERTs and UPDATEs skip the ORM flush hook below, so writers that use
+    them call this for the users they touched. user_ids may be a collection or
+    a select of user ids.
+    """
+    statement = (
+        db.update(EmployeeAvailabilityFeature)
+        .where(
+            EmployeeAvailabilityFeature.user_id.in_(user_ids),
+            EmployeeAvailabilityFeature.is_stale == False
+        )
+        .values(is_stale=True)
+        .execution_options(synchronize_session=False)
+    )
+    (connection or db.session).execute(statement)
+
+
+@event.listens_for(Session, 'after_flush')
+def _mark_features_stale(session, flush_context):
+    """Flag cached features as stale when an employee's schedules, entries or leave change"""
+    user_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Schedule, TimeEntry, LeaveApplication)) and obj.user_id:
+            user_ids.add(obj.user_id)
+
+    if user_ids:
+        mark_features_stale(user_ids, session.connection())
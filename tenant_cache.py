@@ -0,0 +1,114 @@
+"""
+Tenant Cache
+In-process cache of resolved tenants and their settings with versioned invalidation
+"""
+
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Tenant, TenantSettings, User
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on how long another worker process can serve settings saved elsewhere
+TENANT_CACHE_TTL = int(os.environ.get('TENANT_CACHE_TTL', '60'))
+
+_tenant_cache = TTLCache(ttl=TENANT_CACHE_TTL, max_entries=1024)
+
+# Per-tenant version; bumping it orphans every cached entry built from the old state
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+@dataclass
+class TenantContext:
+    """A resolved tenant and its settings, attached to the current session"""
+    tenant: Tenant
+    settings: TenantSettings
+    settings_saved: bool
+
+
+def tenant_version(tenant_id: int) -> int:
+    with _versions_lock:
+        return _versions.get(tenant_id, 0)
+
+
+def invalidate_tenant(tenant_id: int):
+    """Drop the cached tenant and settings by moving the tenant to a new version"""
+    with _versions_lock:
+        _versions[tenant_id] = _versions.get(tenant_id, 0) + 1
+
+
+def _load_tenant(tenant_id: int):
+    """Read the tenant and its settings in a private session, so they stay detached and fully loaded"""
+    with Session(db.engine, expire_on_commit=False) as session:
+        tenant = session.get(Tenant, tenant_id)
+        if tenant is None:
+            return None
+        settings = session.execute(
+            db.select(TenantSettings).filter_by(tenant_id=tenant_id).limit(1)
+        ).scalar_one_or_none()
+        return tenant, settings
+
+
+def get_tenant_context(tenant_id: Optional[int]) -> Optional[TenantContext]:
+    """Resolve a tenant and its settings, from the cache when the version is current.
+
+    Cached instances are merged into the current session without a query. A
+    tenant that has never saved settings gets unsaved defaults rather than a
+    row written on read.
+    """
+    if not tenant_id:
+        return None
+
+    cached = _tenant_cache.get_or_set(
+        (tenant_id, tenant_version(tenant_id)),
+        lambda: _load_tenant(tenant_id),
+        cache_if=lambda loaded: loaded is not None
+    )
+    if cached is None:
+        return None
+
+    tenant, settings = cached
+    tenant = db.session.merge(tenant, load=False)
+    if settings is None:
+        return TenantContext(tenant, TenantSettings.with_defaults(tenant_id), settings_saved=False)
+    return TenantContext(tenant, db.session.merge(settings, load=False), settings_saved=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_tenants(session, flush_context):
+    """Remember tenants whose row, settings or user counter this flush changed"""
+    changed = session.info.setdefault('changed_tenant_ids', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Tenant):
+            changed.add(obj.id)
+        elif isinstance(obj, TenantSettings):
+            changed.add(obj.tenant_id)
+        elif isinstance(obj, User):
+            # Only membership changes move a tenant's user counter
+            history = db.inspect(obj).attrs.tenant_id.history
+            if obj in session.new or obj in session.deleted:
+                changed.add(obj.tenant_id)
+            changed.update(history.added)
+            changed.update(history.deleted)
+    changed.discard(None)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_tenants(session):
+    for tenant_id in session.info.pop('changed_tenant_ids', ()):
+        invalidate_tenant(tenant_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_tenants(session):
+    session.info.pop('changed_tenant_ids', None)
@@ -8,17 +8,17 @@ from flask_login import login_required, current_user
 from app import db
 from models import Tenant, TenantSettings, User, Role
 from forms import TenantForm, TenantSettingsForm
+from tenant_cache import get_tenant_context
 from datetime import datetime
 
 tenant_bp = Blueprint('tenant', __name__, url_prefix='/tenant')
 
 @tenant_bp.before_request
 def load_tenant():
-    """Load current tenant context for all requests"""
-    if current_user.is_authenticated and current_user.tenant_id:
-        g.current_tenant = Tenant.query.get(current_user.tenant_id)
-    else:
-        g.current_tenant = None
+    """Load current tenant context for all requests (cached until the tenant or its settings change)"""
+    context = get_tenant_context(current_user.tenant_id) if current_user.is_authenticated else None
+    g.tenant_context = context
+    g.current_tenant = context.tenant if context else None
 
 @tenant_bp.route('/dashboard')
 @login_required
@@ -29,20 +29,12 @@ def tenant_dashboard():
         return redirect(url_for('main.index'))
     
     # Get tenant statistics
-    total_users = User.query.filter_by(tenant_id=g.current_tenant.id).count()
+    total_users = g.current_tenant.user_count
     active_users = User.query.filter_by(tenant_id=g.current_tenant.id, is_active=True).count()
     
-    # Get tenant settings
-    settings = TenantSettings.query.filter_by(tenant_id=g.current_tenant.id).first()
-    if not settings:
-        # Create default settings if none exist
-        settings = TenantSettings(tenant_id=g.current_tenant.id)
-        db.session.add(settings)
-        db.session.commit()
-    
     return render_template('tenant/dashboard.html', 
                          tenant=g.current_tenant,
-                         settings=settings,
+                         settings=g.tenant_context.settings,
                          total_users=total_users,
                          active_users=active_users)
 
@@ -54,15 +46,13 @@ def tenant_settings():
         flash('No tenant assigned to your account.', 'warning')
         return redirect(url_for('main.index'))
     
-    settings = TenantSettings.query.filter_by(tenant_id=g.current_tenant.id).first()
-    if not settings:
-        settings = TenantSettings(tenant_id=g.current_tenant.id)
-        db.session.add(settings)
-        db.session.commit()
-    
+    settings = g.tenant_context.settings
     form = TenantSettingsForm(obj=settings)
     
     if form.validate_on_submit():
+        if not g.tenant_context.settings_saved:
+            # First save for this tenant: persist the defaults along with the edits
+            db.session.add(settings)
         form.populate_obj(settings)
         settings.updated_at = datetime.utcnow()
         db.session.commit()
@@ -206,6 +196,10 @@ def create_tenant_admin(tenant_id):
             flash('All fields are required.', 'danger')
             return render_template('tenant/create_tenant_admin.html', tenant=tenant)
         
+        if not tenant.can_add_user():
+            flash(f'{tenant.name} has reached its limit of {tenant.max_users} users.', 'danger')
+            return render_template('tenant/create_tenant_admin.html', tenant=tenant)
+        
         # Check for duplicates within tenant
         if User.query.filter_by(tenant_id=tenant_id, username=username).first():
             flash('Username already exists in this organization.', 'danger')
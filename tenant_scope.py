@@ -0,0 +1,110 @@
+"""
+Tenant Scope
+Per-request tenant context that filters and stamps tenant_id on the hot, tenant-owned tables
+"""
+
+import logging
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, with_loader_criteria
+
+logger = logging.getLogger(__name__)
+
+# Execution option that turns the automatic tenant filter off for one statement
+SKIP_TENANT_FILTER = 'skip_tenant_filter'
+
+# Tenant of the code currently running; None means unscoped (legacy users, CLI, background jobs)
+_current_tenant_id: ContextVar[Optional[int]] = ContextVar('current_tenant_id', default=None)
+
+_listeners_installed = False
+
+
+def current_tenant_id() -> Optional[int]:
+    """Tenant the current request or job is scoped to"""
+    return _current_tenant_id.get()
+
+
+@contextmanager
+def tenant_context(tenant_id: Optional[int]):
+    """Scope queries and new rows to tenant_id for the duration of the block; None lifts the scope"""
+    token = _current_tenant_id.set(tenant_id)
+    try:
+        yield
+    finally:
+        _current_tenant_id.reset(token)
+
+
+def tenant_scoped_models():
+    """Models carrying a tenant_id that is filtered automatically"""
+    from models import TimeEntry, Schedule, LeaveApplication, Notification
+    return (TimeEntry, Schedule, LeaveApplication, Notification)
+
+
+def _add_tenant_criteria(execute_state):
+    """Restrict ORM SELECT/UPDATE/DELETE statements on scoped models to the current tenant"""
+    tenant_id = _current_tenant_id.get()
+    if tenant_id is None:
+        return
+    if not (execute_state.is_select or execute_state.is_update or execute_state.is_delete):
+        return
+    if execute_state.is_column_load:
+        return  # refreshing attributes of a row that was already allowed
+    if execute_state.execution_options.get(SKIP_TENANT_FILTER, False):
+        return
+
+    execute_state.statement = execute_state.statement.options(*(
+        with_loader_criteria(model, lambda cls: cls.tenant_id == tenant_id, include_aliases=True)
+        for model in tenant_scoped_models()
+    ))
+
+
+def _stamp_tenant_ids(session, flush_context, instances):
+    """Give new scoped rows their owner's tenant when no tenant context supplied one"""
+    from models import User
+
+    scoped = tenant_scoped_models()
+    pending = [obj for obj in session.new
+               if isinstance(obj, scoped) and obj.tenant_id is None and obj.user_id is not None]
+    if not pending:
+        return
+
+    with session.no_autoflush:
+        tenants = dict(session.execute(
+            select(User.id, User.tenant_id).where(User.id.in_({obj.user_id for obj in pending}))
+        ).all())
+    for obj in pending:
+        obj.tenant_id = tenants.get(obj.user_id)
+
+
+def install_tenant_listeners():
+    """Attach the filtering and stamping hooks to every ORM session (idempotent)"""
+    global _listeners_installed
+    if _listeners_installed:
+        return
+    event.listen(Session, 'do_orm_execute', _add_tenant_criteria)
+    event.listen(Session, 'before_flush', _stamp_tenant_ids)
+    _listeners_installed = True
+
+
+def init_tenant_scope(app):
+    """Scope each request to the signed-in user's tenant"""
+    from flask import g, request
+    from flask_login import current_user
+
+    install_tenant_listeners()
+
+    @app.before_request
+    def enter_tenant_scope():
+        if request.endpoint == 'static':
+            return
+        tenant_id = current_user.tenant_id if current_user.is_authenticated else None
+        g.tenant_scope_token = _current_tenant_id.set(tenant_id)
+
+    @app.teardown_request
+    def exit_tenant_scope(exc):
+        token = g.pop('tenant_scope_token', None)
+        if token is not None:
+            _current_tenant_id.reset(token)
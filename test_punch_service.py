@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Punch Service Test Suite
+Tests that retried and concurrent punches are applied exactly once
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, db
+from models import User, TimeEntry
+from punch_service import punch_in, punch_out, CREATED, CLOSED, REPLAYED, ALREADY_OPEN, NOT_OPEN
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+import logging
+import uuid
+
+def test_punch_service():
+    """Test idempotent clock-in and clock-out"""
+
+    app = create_app()
+
+    with app.app_context():
+        user_id = None
+        try:
+            print("=" * 60)
+            print("PUNCH SERVICE TEST SUITE")
+            print("=" * 60)
+
+            print("\n1. Setting up test employee...")
+            suffix = uuid.uuid4().hex[:8]
+            user = User(username=f'punch_test_{suffix}', email=f'punch-{suffix}@test.com',
+                        first_name='Punch', last_name='Test', is_active=True)
+            user.set_password('test123')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            print(f"✓ Test employee created: {user.username}")
+
+            def entry_count():
+                return TimeEntry.query.filter_by(user_id=user_id).count()
+
+            start = datetime.now().replace(microsecond=0) - timedelta(hours=10)
+
+            print("\n2. Testing repeated clock-in key...")
+            first = punch_in(user_id, start, idempotency_key=f'in-1-{suffix}')
+            assert first.outcome == CREATED, f"First clock-in should create an entry, got {first.outcome}"
+
+            retry = punch_in(user_id, start + timedelta(seconds=5), idempotency_key=f'in-1-{suffix}')
+            assert retry.outcome == REPLAYED, f"Retried clock-in should replay, got {retry.outcome}"
+            assert retry.entry_id == first.entry_id, "Retried clock-in should return the original entry"
+            assert retry.clock_in_time == first.clock_in_time, "Retried clock-in should keep the original time"
+            assert entry_count() == 1, "Retried clock-in should not create a second entry"
+            print("✓ Repeated key returns the original entry")
+
+            print("\n3. Testing a second clock-in while open...")
+            second = punch_in(user_id, start + timedelta(minutes=1), idempotency_key=f'in-2-{suffix}')
+            assert second.outcome == ALREADY_OPEN, f"Second clock-in should be rejected, got {second.outcome}"
+            assert second.entry_id == first.entry_id, "Rejected clock-in should point at the open entry"
+            assert entry_count() == 1, "Second clock-in should not create an entry"
+
+            # A concurrent writer that skips the ON CONFLICT path still hits the open-entry index
+            db.session.add(TimeEntry(user_id=user_id, clock_in_time=start + timedelta(minutes=2), status='Open'))
+            try:
+                db.session.commit()
+                raise AssertionError("uq_time_entries_open_per_user should reject a second open entry")
+            except IntegrityError:
+                db.session.rollback()
+            assert entry_count() == 1, "Concurrent clock-in should not create an entry"
+            print("✓ At most one open entry per employee")
+
+            print("\n4. Testing repeated clock-out key...")
+            closed = punch_out(user_id, start + timedelta(hours=8), idempotency_key=f'out-1-{suffix}')
+            assert closed.outcome == CLOSED, f"First clock-out should close the entry, got {closed.outcome}"
+            assert closed.entry_id == first.entry_id, "Clock-out should close the open entry"
+
+            retry = punch_out(user_id, start + timedelta(hours=8, seconds=5), idempotency_key=f'out-1-{suffix}')
+            assert retry.outcome == REPLAYED, f"Retried clock-out should replay, got {retry.outcome}"
+            assert retry.entry_id == first.entry_id, "Retried clock-out should return the closed entry"
+            assert retry.clock_out_time == closed.clock_out_time, "Retried clock-out should keep the original time"
+
+            replayed_in = punch_in(user_id, start, idempotency_key=f'in-1-{suffix}')
+            assert replayed_in.outcome == REPLAYED, "Clock-in retried after clock-out should still replay"
+            assert entry_count() == 1, "Retries should not create entries"
+            print("✓ Repeated key returns the original closed entry")
+
+            print("\n5. Testing a late clock-out retry...")
+            new_shift = punch_in(user_id, start + timedelta(hours=9), idempotency_key=f'in-3-{suffix}')
+            assert new_shift.outcome == CREATED, f"Next clock-in should create an entry, got {new_shift.outcome}"
+
+            late = punch_out(user_id, start + timedelta(hours=9, minutes=30), idempotency_key=f'out-1-{suffix}')
+            assert late.outcome == REPLAYED, f"Late clock-out retry should replay, got {late.outcome}"
+            assert late.entry_id == first.entry_id, "Late retry should return the first entry"
+
+            db.session.expire_all()
+            open_entry = db.session.get(TimeEntry, new_shift.entry_id)
+            assert open_entry.status == 'Open' and open_entry.clock_out_time is None, \
+                "Late clock-out retry must not close the new entry"
+            print("✓ Late retry does not close the next entry")
+
+            print("\n6. Testing clock-out without an open entry...")
+            assert punch_out(user_id, start + timedelta(hours=10)).outcome == CLOSED, "Open entry should close"
+            assert punch_out(user_id, start + timedelta(hours=10)).outcome == NOT_OPEN, "Nothing left to close"
+            assert entry_count() == 2, "Exactly two entries should exist"
+            print("✓ Clock-out without an open entry rejected")
+
+            print("\n" + "=" * 60)
+            print("PUNCH SERVICE TEST RESULTS")
+            print("=" * 60)
+            print("✓ Clock-in Replay: PASSED")
+            print("✓ One Open Entry per Employee: PASSED")
+            print("✓ Clock-out Replay: PASSED")
+            print("✓ Late Clock-out Retry: PASSED")
+            print("=" * 60)
+
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"\n❌ ERROR: {e}")
+            logging.error(f"Punch service test failed: {e}")
+            return False
+
+        finally:
+            if user_id:
+                TimeEntry.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+                User.query.filter_by(id=user_id).delete(synchronize_session=False)
+                db.session.commit()
+
+if __name__ == "__main__":
+    success = test_punch_service()
+    sys.exit(0 if success else 1)
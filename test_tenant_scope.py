@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Tenant Scope Test Suite
+Tests that a tenant-scoped session can neither read nor change another tenant's
+time entries and leave, and that new rows are stamped with the right tenant
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import create_app, db
+from models import Tenant, User, TimeEntry, LeaveApplication, LeaveType
+from tenant_scope import tenant_context
+from sqlalchemy import func, select, update
+from datetime import datetime, date, timedelta
+import logging
+import uuid
+
+def _create_tenant_user(suffix, label):
+    """A tenant with one employee, one time entry and one leave application"""
+    tenant = Tenant(name=f'Scope Test {label}', subdomain=f'scope-{label.lower()}-{suffix}',
+                    admin_email=f'admin-{label.lower()}-{suffix}@test.com')
+    db.session.add(tenant)
+    db.session.flush()
+
+    user = User(username=f'scope_{label.lower()}_{suffix}', email=f'{label.lower()}-{suffix}@test.com',
+                first_name='Scope', last_name=label, tenant_id=tenant.id, is_active=True)
+    user.set_password('test123')
+    db.session.add(user)
+    db.session.flush()
+
+    leave_type = LeaveType.query.filter_by(name='Annual Leave').first()
+    if not leave_type:
+        leave_type = LeaveType(name='Annual Leave')
+        db.session.add(leave_type)
+        db.session.flush()
+
+    clock_in = datetime.now().replace(microsecond=0) - timedelta(days=1)
+    entry = TimeEntry(user_id=user.id, clock_in_time=clock_in, clock_out_time=clock_in + timedelta(hours=8),
+                      status='Closed', notes=f'{label} entry')
+    leave = LeaveApplication(user_id=user.id, leave_type_id=leave_type.id, start_date=date.today(),
+                             end_date=date.today() + timedelta(days=1), status='Pending')
+    db.session.add_all([entry, leave])
+    db.session.commit()
+    return tenant, user, entry, leave
+
+def test_tenant_scope():
+    """Test the automatic tenant filter and tenant stamping"""
+
+    app = create_app()
+
+    with app.app_context():
+        created = []
+        try:
+            print("=" * 60)
+            print("TENANT SCOPE TEST SUITE")
+            print("=" * 60)
+
+            print("\n1. Setting up two tenants...")
+            suffix = uuid.uuid4().hex[:8]
+            tenant_a, user_a, entry_a, leave_a = _create_tenant_user(suffix, 'A')
+            tenant_b, user_b, entry_b, leave_b = _create_tenant_user(suffix, 'B')
+            created = [(tenant_a.id, user_a.id), (tenant_b.id, user_b.id)]
+
+            # Rows created without a tenant context take their owner's tenant
+            assert entry_a.tenant_id == tenant_a.id, "Entry should be stamped with its owner's tenant"
+            assert leave_b.tenant_id == tenant_b.id, "Leave should be stamped with its owner's tenant"
+            print("✓ Unscoped rows stamped with their owner's tenant")
+
+            ids = {
+                'entry_a': entry_a.id, 'entry_b': entry_b.id,
+                'leave_a': leave_a.id, 'leave_b': leave_b.id,
+                'user_a': user_a.id, 'user_b': user_b.id,
+                'tenant_a': tenant_a.id
+            }
+            both_users = [ids['user_a'], ids['user_b']]
+            db.session.expunge_all()
+
+            with tenant_context(ids['tenant_a']):
+                print("\n2. Testing reads...")
+
+                entries = TimeEntry.query.filter(TimeEntry.user_id.in_(both_users)).all()
+                assert [entry.id for entry in entries] == [ids['entry_a']], "Tenant A should only see its own entry"
+                leaves = LeaveApplication.query.filter(LeaveApplication.user_id.in_(both_users)).all()
+                assert [leave.id for leave in leaves] == [ids['leave_a']], "Tenant A should only see its own leave"
+
+                assert db.session.get(TimeEntry, ids['entry_b']) is None, "Tenant A should not load B's entry by id"
+                assert db.session.get(LeaveApplication, ids['leave_b']) is None, "Tenant A should not load B's leave by id"
+
+                count = db.session.query(func.count(TimeEntry.id)).filter(TimeEntry.user_id == ids['user_b']).scalar()
+                assert count == 0, "Tenant A should not count B's entries"
+                print("✓ Direct reads, lookups by id and aggregates isolated")
+
+                print("\n3. Testing scalar subqueries and joins...")
+
+                # Users are not filtered automatically, so B's user row is visible; its entries are not
+                entry_counts = dict(db.session.execute(
+                    select(User.id, select(func.count(TimeEntry.id))
+                           .where(TimeEntry.user_id == User.id).scalar_subquery())
+                    .where(User.id.in_(both_users))
+                ).all())
+                assert entry_counts == {ids['user_a']: 1, ids['user_b']: 0}, f"Subquery leaked entries: {entry_counts}"
+
+                leave_counts = dict(db.session.execute(
+                    select(User.id, select(func.count(LeaveApplication.id))
+                           .where(LeaveApplication.user_id == User.id).scalar_subquery())
+                    .where(User.id.in_(both_users))
+                ).all())
+                assert leave_counts == {ids['user_a']: 1, ids['user_b']: 0}, f"Subquery leaked leave: {leave_counts}"
+
+                joined = db.session.execute(
+                    select(User.id, TimeEntry.id).join(TimeEntry, TimeEntry.user_id == User.id)
+                    .where(User.id.in_(both_users))
+                ).all()
+                assert joined == [(ids['user_a'], ids['entry_a'])], f"Join leaked entries: {joined}"
+
+                joined = db.session.execute(
+                    select(LeaveApplication.id, TimeEntry.id)
+                    .join(TimeEntry, TimeEntry.user_id == LeaveApplication.user_id)
+                    .where(LeaveApplication.user_id.in_(both_users))
+                ).all()
+                assert joined == [(ids['leave_a'], ids['entry_a'])], f"Join leaked rows: {joined}"
+                print("✓ Scalar subqueries and joins isolated")
+
+                print("\n4. Testing updates and deletes...")
+
+                updated = db.session.execute(
+                    update(TimeEntry).where(TimeEntry.id == ids['entry_b']).values(notes='changed by A')
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                assert updated == 0, "Tenant A should not update B's entry"
+
+                updated = db.session.execute(
+                    update(LeaveApplication).where(LeaveApplication.user_id.in_(both_users)).values(status='Rejected')
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+                assert updated == 1, "Tenant A should only update its own leave"
+
+                deleted = TimeEntry.query.filter(TimeEntry.id == ids['entry_b']).delete(synchronize_session=False)
+                assert deleted == 0, "Tenant A should not delete B's entry"
+                db.session.commit()
+                print("✓ Bulk updates and deletes isolated")
+
+                print("\n5. Testing tenant stamping inside a scope...")
+
+                entry = TimeEntry(user_id=ids['user_a'], clock_in_time=datetime.now().replace(microsecond=0),
+                                  status='Open', notes='scoped entry')
+                db.session.add(entry)
+                db.session.commit()
+                assert entry.tenant_id == ids['tenant_a'], "Entries created in a scope should carry its tenant"
+                print("✓ New rows stamped with the current tenant")
+
+            db.session.expunge_all()
+            entry_b = db.session.get(TimeEntry, ids['entry_b'])
+            leave_b = db.session.get(LeaveApplication, ids['leave_b'])
+            assert entry_b.notes == 'B entry', "B's entry should be unchanged"
+            assert leave_b.status == 'Pending', "B's leave should be unchanged"
+            assert db.session.get(LeaveApplication, ids['leave_a']).status == 'Rejected', "A's leave should be updated"
+            print("✓ Other tenant's rows unchanged")
+
+            print("\n" + "=" * 60)
+            print("TENANT SCOPE TEST RESULTS")
+            print("=" * 60)
+            print("✓ Reads and Aggregates: PASSED")
+            print("✓ Scalar Subqueries and Joins: PASSED")
+            print("✓ Updates and Deletes: PASSED")
+            print("✓ Tenant Stamping: PASSED")
+            print("=" * 60)
+
+            return True
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"\n❌ ERROR: {e}")
+            logging.error(f"Tenant scope test failed: {e}")
+            return False
+
+        finally:
+            # Remove the test tenants and everything they own
+            for tenant_id, user_id in created:
+                TimeEntry.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+                LeaveApplication.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+                User.query.filter_by(id=user_id).delete(synchronize_session=False)
+                Tenant.query.filter_by(id=tenant_id).delete(synchronize_session=False)
+            db.session.commit()
+
+if __name__ == "__main__":
+    success = test_tenant_scope()
+    sys.exit(0 if success else 1)
@@ -1,3 +1,4 @@
+import io
 from datetime import datetime, date, timedelta
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
 from flask_login import login_required, current_user
@@ -5,7 +6,8 @@ from sqlalchemy import and_, or_, func, case
 from app import db
 from models import TimeEntry, User, Department
 from auth_simple import role_required, super_user_required
-from timezone_utils import get_current_time, localize_datetime
+from timezone_utils import get_current_time, localize_datetime, current_timezone_service
+from punch_service import punch_in, punch_out, get_idempotency_key, ALREADY_OPEN, NOT_OPEN, REPLAYED
 
 def get_managed_departments(user_id):
     """Get list of department IDs that a manager oversees"""
@@ -32,13 +34,22 @@ def clock_in():
             json_data = {}
     
     try:
-        # Check if user already has an open time entry
-        open_entry = TimeEntry.query.filter_by(
-            user_id=current_user.id,
-            status='Open'
-        ).first()
+        # Get GPS coordinates if provided  
+        latitude = json_data.get('latitude') if request.is_json else None
+        longitude = json_data.get('longitude') if request.is_json else None
+        notes = json_data.get('notes', '') if request.is_json else ''
         
-        if open_entry:
+        # Open the time entry in one round-trip; retries with the same key are replayed
+        result = punch_in(
+            current_user.id,
+            get_current_time(),
+            idempotency_key=get_idempotency_key(json_data),
+            notes=notes,
+            latitude=latitude,
+            longitude=longitude
+        )
+        
+        if result.outcome == ALREADY_OPEN:
             if request.is_json:
                 return jsonify({
                     'success': False,
@@ -51,29 +62,13 @@ def clock_in():
                     return redirect(url_for('time_attendance.my_timecard'))
                 return redirect(url_for('main.index'))
         
-        # Get GPS coordinates if provided  
-        latitude = json_data.get('latitude') if request.is_json else None
-        longitude = json_data.get('longitude') if request.is_json else None
-        notes = json_data.get('notes', '') if request.is_json else ''
-        
-        # Create new time entry
-        time_entry = TimeEntry()
-        time_entry.user_id = current_user.id
-        time_entry.clock_in_time = get_current_time()
-        time_entry.status = 'Open'
-        time_entry.notes = notes
-        time_entry.clock_in_latitude = latitude
-        time_entry.clock_in_longitude = longitude
-        
-        db.session.add(time_entry)
-        db.session.commit()
-        
         if request.is_json:
             return jsonify({
                 'success': True,
                 'message': 'Successfully clocked in',
-                'time_entry_id': time_entry.id,
-                'clock_in_time': time_entry.clock_in_time.isoformat()
+                'time_entry_id': result.entry_id,
+                'clock_in_time': result.clock_in_time.isoformat(),
+                'replayed': result.outcome == REPLAYED
             })
         else:
             flash('Successfully clocked in!', 'success')
@@ -108,13 +103,22 @@ def clock_out():
                 json_data = request.get_json() or {}
             except Exception:
                 json_data = {}
-        # Find the open time entry for the user
-        open_entry = TimeEntry.query.filter_by(
-            user_id=current_user.id,
-            status='Open'
-        ).first()
+        # Get GPS coordinates if provided
+        latitude = json_data.get('latitude') if request.is_json else None
+        longitude = json_data.get('longitude') if request.is_json else None
+        notes = json_data.get('notes', '') if request.is_json else ''
         
-        if not open_entry:
+        # Close the open entry in one round-trip; retries with the same key are replayed
+        result = punch_out(
+            current_user.id,
+            get_current_time(),
+            idempotency_key=get_idempotency_key(json_data),
+            notes_suffix=f" | Clock-out notes: {notes}" if notes else None,
+            latitude=latitude,
+            longitude=longitude
+        )
+        
+        if result.outcome == NOT_OPEN:
             if request.is_json:
                 return jsonify({
                     'success': False,
@@ -127,32 +131,18 @@ def clock_out():
                     return redirect(url_for('time_attendance.my_timecard'))
                 return redirect(url_for('main.index'))
         
-        # Get GPS coordinates if provided
-        latitude = json_data.get('latitude') if request.is_json else None
-        longitude = json_data.get('longitude') if request.is_json else None
-        notes = json_data.get('notes', '') if request.is_json else ''
-        
-        # Update time entry
-        open_entry.clock_out_time = get_current_time()
-        open_entry.status = 'Closed'
-        open_entry.clock_out_latitude = latitude
-        open_entry.clock_out_longitude = longitude
-        if notes:
-            open_entry.notes = (open_entry.notes or '') + f" | Clock-out notes: {notes}"
-        
-        db.session.commit()
-        
         # Calculate duration for display
-        duration = open_entry.clock_out_time - open_entry.clock_in_time
+        duration = result.clock_out_time - result.clock_in_time
         total_hours = duration.total_seconds() / 3600
         
         if request.is_json:
             return jsonify({
                 'success': True,
                 'message': 'Successfully clocked out',
-                'time_entry_id': open_entry.id,
-                'clock_out_time': open_entry.clock_out_time.isoformat(),
-                'total_hours': round(total_hours, 2)
+                'time_entry_id': result.entry_id,
+                'clock_out_time': result.clock_out_time.isoformat(),
+                'total_hours': round(total_hours, 2),
+                'replayed': result.outcome == REPLAYED
             })
         else:
             flash(f'Successfully clocked out! Total time: {total_hours:.2f} hours', 'success')
@@ -516,8 +506,23 @@ def team_timecard():
         summary_stats['avg_hours_per_day'] = round(total_hours / len(time_entries.items), 2) if time_entries.items else 0
         summary_stats['overtime_hours'] = round(sum(entry.overtime_hours for entry in time_entries.items), 2)
     
+    # Convert the page's timestamps to the tenant's zone a column at a time rather than per cell
+    tz_service = current_timezone_service()
+    clock_ins = tz_service.convert_column(entry.clock_in_time for entry in time_entries.items)
+    clock_outs = tz_service.convert_column(entry.clock_out_time for entry in time_entries.items)
+    entry_times = {
+        entry.id: {'date': work_date, 'clock_in': clock_in, 'clock_out': clock_out}
+        for entry, work_date, clock_in, clock_out in zip(
+            time_entries.items,
+            tz_service.format_column(clock_ins, '%b %d, %Y', converted=True),
+            tz_service.format_column(clock_ins, '%I:%M %p', converted=True),
+            tz_service.format_column(clock_outs, '%I:%M %p', converted=True)
+        )
+    }
+    
     return render_template('time_attendance/team_timecard.html',
                          time_entries=time_entries,
+                         entry_times=entry_times,
                          users=users,
                          roles=roles,
                          departments=departments,
@@ -775,7 +780,7 @@ def admin_dashboard():
     
     stats = {
         'total_entries_today': TimeEntry.query.filter(
-            func.date(TimeEntry.clock_in_time) == today
+            TimeEntry.work_date == today
         ).count(),
         'open_entries': TimeEntry.query.filter_by(status='Open').count(),
         'exceptions_count': TimeEntry.query.filter_by(status='Exception').count(),
@@ -801,15 +806,70 @@ def admin_dashboard():
 @time_attendance_bp.route('/import-data', methods=['GET', 'POST'])
 @super_user_required
 def import_clock_data():
-    """Import clock data endpoint (stub for future implementation)"""
+    """Import clock data from time clock terminal punch files (CSV or NDJSON)"""
     if request.method == 'POST':
-        # Placeholder for import functionality
-        # This would handle CSV/Excel imports, external system integrations, etc.
-        flash('Import functionality will be implemented in future updates', 'info')
-        return redirect(url_for('time_attendance.admin_dashboard'))
+        upload = request.files.get('import_file')
+        if not upload or upload.filename == '':
+            flash('No file selected', 'warning')
+            return redirect(request.url)
+        
+        try:
+            from time_clock_import import TimeClockImporter, detect_punch_format
+            
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            result = TimeClockImporter().import_stream(
+                stream,
+                file_format=detect_punch_format(upload.filename, upload.mimetype),
+                validate_only=bool(request.form.get('validate_only'))
+            )
+            
+            stats = result['stats']
+            if request.form.get('validate_only'):
+                flash(f"Validation complete: {stats['entries_built']} entries built from "
+                      f"{stats['rows_read']} rows", 'info')
+            else:
+                flash(f"Imported {stats['imported']} time entries "
+                      f"({stats['duplicates']} duplicates skipped)", 'success')
+            return render_template('time_attendance/import_data.html', result=result)
+        
+        except Exception as e:
+            flash(f'Error importing clock data: {str(e)}', 'danger')
+            return redirect(request.url)
     
     return render_template('time_attendance/import_data.html')
 
+@time_attendance_bp.route('/api/import-punches', methods=['POST'])
+@super_user_required
+def api_import_punches():
+    """Bulk punch import for terminal uploads (multipart file or raw CSV/NDJSON body)"""
+    try:
+        from time_clock_import import TimeClockImporter, detect_punch_format
+        
+        upload = request.files.get('file')
+        if upload:
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            file_format = detect_punch_format(upload.filename, upload.mimetype)
+        else:
+            stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+            file_format = detect_punch_format(request.args.get('filename', ''), request.content_type)
+        
+        result = TimeClockImporter().import_stream(
+            stream,
+            file_format=request.args.get('format', file_format),
+            validate_only=request.args.get('validate_only', 'false').lower() == 'true'
+        )
+        
+        return jsonify({
+            'success': True,
+            'data': result
+        })
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error importing punches: {str(e)}'
+        }), 500
+
 @time_attendance_bp.route('/entry-details/<int:entry_id>')
 @role_required('Manager', 'Admin', 'Super User')
 def entry_details(entry_id):
@@ -0,0 +1,355 @@
+"""
+Time Clock Import Service
+Bulk loads punch files from physical time clock terminals into time entries
+"""
+
+import csv
+import io
+import json
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import exists, insert, literal
+
+from app import db
+from models import TimeEntry, User, TimeClockImportStaging
+from scheduling_features import mark_features_stale
+from tenant_scope import current_tenant_id
+from timezone_utils import SAST
+
+logger = logging.getLogger(__name__)
+
+# Punch directions accepted in the punch_type column / field
+CLOCK_IN_VALUES = {'in', 'i', 'clock_in', 'clockin', 'punch_in'}
+CLOCK_OUT_VALUES = {'out', 'o', 'clock_out', 'clockout', 'punch_out'}
+
+# An out punch further than this from the open in punch starts a new entry instead
+MAX_SHIFT_HOURS = 16
+
+# Staged rows sent per COPY / bulk insert
+STAGING_CHUNK_SIZE = 50000
+
+# Row-level problems kept for display; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+STAGING_COLUMNS = ('batch_id', 'user_id', 'clock_in_time', 'clock_out_time', 'status', 'notes', 'created_at')
+
+
+def parse_punch_time(value) -> Optional[datetime]:
+    """Parse a terminal timestamp into the naive SAST datetimes stored on time entries"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, SAST).replace(tzinfo=None)
+
+    value = str(value).strip()
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        parsed = None
+        for fmt in ('%Y/%m/%d %H:%M:%S', '%d/%m/%Y %H:%M:%S', '%Y/%m/%d %H:%M', '%d/%m/%Y %H:%M'):
+            try:
+                parsed = datetime.strptime(value, fmt)
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            raise ValueError(f"Unrecognised timestamp '{value}'")
+
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(SAST).replace(tzinfo=None)
+    return parsed
+
+
+class TimeClockImporter:
+    """Parses, pairs and loads terminal punch files in one set-based pass"""
+
+    def __init__(self):
+        self.batch_id = str(uuid.uuid4())
+        self.errors = []
+        self.stats = {
+            'rows_read': 0,
+            'punches': 0,
+            'invalid_rows': 0,
+            'unknown_employees': 0,
+            'unmatched_clock_outs': 0,
+            'missing_clock_outs': 0,
+            'entries_built': 0,
+            'duplicates': 0,
+            'imported': 0
+        }
+        self._employee_map = None
+
+    def _add_error(self, message: str):
+        """Record a row-level problem, keeping only the first few messages"""
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def load_employee_map(self) -> Dict[str, int]:
+        """Map employee numbers and usernames of the current tenant's users to user ids with a single query"""
+        if self._employee_map is None:
+            query = db.select(User.id, User.employee_number, User.username).where(User.is_active == True)
+            # Punches are only matched to employees of the tenant running the import
+            tenant_id = current_tenant_id()
+            if tenant_id is not None:
+                query = query.where(User.tenant_id == tenant_id)
+            rows = db.session.execute(query).all()
+            employee_map = {}
+            for row in rows:
+                employee_map[row.username.lower()] = row.id
+            # Employee numbers take precedence over usernames when both match
+            for row in rows:
+                if row.employee_number:
+                    employee_map[row.employee_number.strip().lower()] = row.id
+            self._employee_map = employee_map
+        return self._employee_map
+
+    # Parsing
+
+    def iter_records(self, stream, file_format: str) -> Iterator[dict]:
+        """Yield raw records from a CSV or NDJSON text stream"""
+        if file_format == 'ndjson':
+            for line_number, line in enumerate(stream, start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    self.stats['invalid_rows'] += 1
+                    self._add_error(f"Line {line_number}: invalid JSON ({e.msg})")
+                    continue
+                record['_line'] = line_number
+                yield record
+        else:
+            for line_number, record in enumerate(csv.DictReader(stream), start=2):
+                record['_line'] = line_number
+                yield record
+
+    def collect(self, records: Iterable[dict]) -> Tuple[Dict[int, list], List[tuple]]:
+        """Resolve employees and split records into raw punches and already-paired entries"""
+        employee_map = self.load_employee_map()
+        punches = defaultdict(list)
+        paired = []
+
+        for record in records:
+            self.stats['rows_read'] += 1
+            line = record.get('_line')
+
+            key = record.get('employee_id') or record.get('employee_number') or record.get('username')
+            user_id = employee_map.get(str(key).strip().lower()) if key else None
+            if user_id is None:
+                self.stats['unknown_employees'] += 1
+                self._add_error(f"Line {line}: unknown employee '{key}'")
+                continue
+
+            notes = (record.get('notes') or '').strip() or None
+            try:
+                if record.get('clock_in'):
+                    # Row already carries a full entry (clock_in / clock_out columns)
+                    clock_in = parse_punch_time(record.get('clock_in'))
+                    clock_out = parse_punch_time(record.get('clock_out'))
+                    if clock_out and clock_out <= clock_in:
+                        raise ValueError("clock_out must be after clock_in")
+                    paired.append((user_id, clock_in, clock_out, notes))
+                    continue
+
+                punch_time = parse_punch_time(record.get('timestamp') or record.get('punch_time'))
+                if punch_time is None:
+                    raise ValueError("timestamp is required")
+            except ValueError as e:
+                self.stats['invalid_rows'] += 1
+                self._add_error(f"Line {line}: {e}")
+                continue
+
+            direction = (record.get('punch_type') or record.get('direction') or '').strip().lower()
+            if direction in CLOCK_IN_VALUES:
+                direction = 'in'
+            elif direction in CLOCK_OUT_VALUES:
+                direction = 'out'
+            elif direction:
+                self.stats['invalid_rows'] += 1
+                self._add_error(f"Line {line}: unknown punch type '{direction}'")
+                continue
+            else:
+                direction = None
+
+            punches[user_id].append((punch_time, direction, notes))
+            self.stats['punches'] += 1
+
+        return punches, paired
+
+    def pair_punches(self, punches: Dict[int, list]) -> Iterator[tuple]:
+        """Pair each user's punches into (user_id, clock_in, clock_out, status, notes) entries.
+
+        Punches are walked in time order per user. Punches without a direction
+        alternate in/out within a work day. An in punch with no out punch within
+        MAX_SHIFT_HOURS becomes an Exception entry.
+        """
+        max_shift = timedelta(hours=MAX_SHIFT_HOURS)
+
+        for user_id, user_punches in punches.items():
+            user_punches.sort(key=lambda punch: punch[0])
+            open_punch = None
+            previous = None
+
+            for punch_time, direction, notes in user_punches:
+                # Terminals often repeat a punch; drop exact duplicates
+                if previous and previous[0] == punch_time and previous[1] == direction:
+                    continue
+                previous = (punch_time, direction)
+
+                if open_punch and punch_time - open_punch[0] > max_shift:
+                    self.stats['missing_clock_outs'] += 1
+                    yield (user_id, open_punch[0], None, 'Exception', 'Missing clock-out punch')
+                    open_punch = None
+
+                if direction is None:
+                    same_day = open_punch and open_punch[0].date() == punch_time.date()
+                    direction = 'out' if same_day else 'in'
+                    if open_punch and not same_day:
+                        self.stats['missing_clock_outs'] += 1
+                        yield (user_id, open_punch[0], None, 'Exception', 'Missing clock-out punch')
+                        open_punch = None
+
+                if direction == 'in':
+                    if open_punch:
+                        self.stats['missing_clock_outs'] += 1
+                        yield (user_id, open_punch[0], None, 'Exception', 'Missing clock-out punch')
+                    open_punch = (punch_time, notes)
+                elif open_punch:
+                    yield (user_id, open_punch[0], punch_time, 'Closed', open_punch[1] or notes)
+                    open_punch = None
+                else:
+                    self.stats['unmatched_clock_outs'] += 1
+                    self._add_error(f"User {user_id}: clock-out at {punch_time} has no matching clock-in")
+
+            if open_punch:
+                self.stats['missing_clock_outs'] += 1
+                yield (user_id, open_punch[0], None, 'Exception', 'Missing clock-out punch')
+
+    # Loading
+
+    def _stage(self, entries: Iterable[tuple]):
+        """Load entries into the staging table, via COPY on PostgreSQL"""
+        connection = db.session.connection()
+        use_copy = connection.dialect.name == 'postgresql'
+        created_at = datetime.utcnow()
+        chunk = []
+
+        def flush():
+            if not chunk:
+                return
+            if use_copy:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(chunk)
+                buffer.seek(0)
+                with connection.connection.cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY {TimeClockImportStaging.__tablename__} ({', '.join(STAGING_COLUMNS)}) "
+                        "FROM STDIN WITH (FORMAT csv)",
+                        buffer
+                    )
+            else:
+                connection.execute(
+                    insert(TimeClockImportStaging),
+                    [dict(zip(STAGING_COLUMNS, row)) for row in chunk]
+                )
+            chunk.clear()
+
+        seen = set()
+        for user_id, clock_in, clock_out, status, notes in entries:
+            # Same clock-in listed twice in the file counts as a duplicate
+            if (user_id, clock_in) in seen:
+                self.stats['duplicates'] += 1
+                continue
+            seen.add((user_id, clock_in))
+
+            chunk.append((self.batch_id, user_id, clock_in, clock_out, status, notes, created_at))
+            self.stats['entries_built'] += 1
+            if len(chunk) >= STAGING_CHUNK_SIZE:
+                flush()
+        flush()
+
+    def _promote(self) -> int:
+        """Insert staged entries that don't already exist with a single anti-join.
+
+        Each entry takes its owner's tenant rather than the importer's, which is
+        NULL for a super admin.
+        """
+        staging = TimeClockImportStaging.__table__
+        entries = TimeEntry.__table__
+        users = User.__table__
+
+        new_entries = (
+            db.select(
+                staging.c.user_id, users.c.tenant_id, staging.c.clock_in_time, staging.c.clock_out_time,
+                staging.c.status, staging.c.notes, literal(0), literal(False),
+                staging.c.created_at, staging.c.created_at
+            )
+            .join(users, users.c.id == staging.c.user_id)
+            .where(
+                staging.c.batch_id == self.batch_id,
+                ~exists().where(
+                    entries.c.user_id == staging.c.user_id,
+                    entries.c.clock_in_time == staging.c.clock_in_time
+                )
+            )
+        )
+        inserted = db.session.execute(
+            entries.insert().from_select(
+                ['user_id', 'tenant_id', 'clock_in_time', 'clock_out_time', 'status', 'notes',
+                 'total_break_minutes', 'is_overtime_approved', 'created_at', 'updated_at'],
+                new_entries
+            )
+        ).rowcount
+
+        # The INSERT ... SELECT skips the ORM flush hook, so flag the owners' scheduling features here
+        if inserted:
+            mark_features_stale(
+                db.select(staging.c.user_id).where(staging.c.batch_id == self.batch_id).distinct()
+            )
+
+        db.session.execute(db.delete(staging).where(staging.c.batch_id == self.batch_id))
+        return inserted
+
+    def import_stream(self, stream, file_format: str = 'csv', validate_only: bool = False) -> dict:
+        """Parse, pair and load a punch file, returning import statistics"""
+        try:
+            punches, paired = self.collect(self.iter_records(stream, file_format))
+            entries = [(user_id, clock_in, clock_out, 'Closed' if clock_out else 'Exception', notes)
+                       for user_id, clock_in, clock_out, notes in paired]
+
+            entries.extend(self.pair_punches(punches))
+
+            if validate_only:
+                self.stats['entries_built'] = len(entries)
+            else:
+                self._stage(entries)
+                self.stats['imported'] = self._promote()
+                self.stats['duplicates'] += self.stats['entries_built'] - self.stats['imported']
+                db.session.commit()
+                logger.info(f"Imported {self.stats['imported']} time entries from clock batch {self.batch_id}")
+        except Exception:
+            db.session.rollback()
+            raise
+
+        return {
+            'batch_id': self.batch_id,
+            'stats': self.stats,
+            'errors': self.errors
+        }
+
+
+def detect_punch_format(filename: str, content_type: Optional[str] = None) -> str:
+    """Return 'ndjson' or 'csv' for an uploaded punch file"""
+    filename = (filename or '').lower()
+    if filename.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    if content_type and ('ndjson' in content_type or 'jsonlines' in content_type):
+        return 'ndjson'
+    return 'csv'
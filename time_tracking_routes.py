@@ -10,6 +10,7 @@ from app import db
 from models import TimeEntry
 from sqlalchemy import and_
 from timezone_utils import get_current_time
+from punch_service import punch_in, punch_out, get_idempotency_key, ALREADY_OPEN, NOT_OPEN
 
 # Create blueprint for time tracking
 time_tracking_bp = Blueprint('time_tracking', __name__)
@@ -19,34 +20,23 @@ time_tracking_bp = Blueprint('time_tracking', __name__)
 def clock_in():
     """Simple clock in endpoint for dashboard buttons"""
     try:
-        # Check if user already has an active time entry
-        active_entry = TimeEntry.query.filter(
-            and_(
-                TimeEntry.user_id == current_user.id,
-                TimeEntry.clock_out_time.is_(None)
-            )
-        ).first()
+        # Single round-trip insert; a retried request with the same key is replayed
+        result = punch_in(
+            current_user.id,
+            get_current_time(),
+            idempotency_key=get_idempotency_key(request.get_json(silent=True))
+        )
         
-        if active_entry:
+        if result.outcome == ALREADY_OPEN:
             return jsonify({
                 'success': False,
                 'message': 'You are already clocked in!'
             }), 400
         
-        # Create new time entry
-        new_entry = TimeEntry(
-            user_id=current_user.id,
-            clock_in_time=get_current_time(),
-            status='Open'
-        )
-        
-        db.session.add(new_entry)
-        db.session.commit()
-        
         return jsonify({
             'success': True,
             'message': 'Successfully clocked in!',
-            'clock_in_time': new_entry.clock_in_time.strftime('%I:%M %p')
+            'clock_in_time': result.clock_in_time.strftime('%I:%M %p')
         })
         
     except Exception as e:
@@ -61,33 +51,26 @@ def clock_in():
 def clock_out():
     """Simple clock out endpoint for dashboard buttons"""
     try:
-        # Find active time entry
-        active_entry = TimeEntry.query.filter(
-            and_(
-                TimeEntry.user_id == current_user.id,
-                TimeEntry.clock_out_time.is_(None)
-            )
-        ).first()
+        # Single round-trip update of the open entry; retries are replayed
+        result = punch_out(
+            current_user.id,
+            get_current_time(),
+            idempotency_key=get_idempotency_key(request.get_json(silent=True))
+        )
         
-        if not active_entry:
+        if result.outcome == NOT_OPEN:
             return jsonify({
                 'success': False,
                 'message': 'No active clock-in found!'
             }), 400
         
-        # Clock out
-        active_entry.clock_out_time = get_current_time()
-        active_entry.status = 'Closed'
-        
-        db.session.commit()
-        
         # Calculate total hours
-        total_hours = active_entry.total_hours
+        total_hours = result.total_hours
         
         return jsonify({
             'success': True,
             'message': f'Successfully clocked out! Total hours: {total_hours}',
-            'clock_out_time': active_entry.clock_out_time.strftime('%I:%M %p'),
+            'clock_out_time': result.clock_out_time.strftime('%I:%M %p'),
             'total_hours': total_hours
         })
         
@@ -15,12 +15,23 @@ from flask_login import login_required, current_user
 from app import db
 from models import TimeEntry, User, Department, PayCode
 from auth_simple import role_required
+from columnar_export import (COLUMNAR_FORMATS, records_columns, records_rows, requested_format,
+                             stream_columnar)
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
 timecard_rollup_bp = Blueprint('timecard_rollup', __name__, url_prefix='/timecard-rollup')
 
+# Rollup type -> the list of records exported as the table of a Parquet/Arrow download
+ROLLUP_RECORDS_KEY = {
+    "daily": "periods",
+    "employee": "employees",
+    "department": "departments",
+    "pay_code": "pay_codes",
+    "combined": "employee_summary",
+}
+
 class RollupPeriod(Enum):
     """Enumeration of available rollup periods"""
     DAILY = "daily"
@@ -383,6 +394,14 @@ def generate_rollup():
         # Log successful rollup generation
         logging.info(f"Rollup generated successfully: {rollup_type} from {start_date_str} to {end_date_str}")
         
+        # Typed Parquet/Arrow download of the rollup's main table instead of JSON
+        export_format = requested_format(request, default='json')
+        if export_format in COLUMNAR_FORMATS:
+            records = rollup_data.get(ROLLUP_RECORDS_KEY.get(rollup_data.get("type")), [])
+            columns = records_columns(records)
+            return stream_columnar(f"rollup_{rollup_data.get('type')}_{start_date_str}_{end_date_str}",
+                                   columns, records_rows(records, columns), export_format)
+        
         return jsonify({
             "success": True,
             "data": rollup_data,
@@ -1,20 +1,136 @@
 """
 Timezone utilities for WFM application
-Provides consistent GMT+2 (South African Standard Time) handling
+Converts the naive GMT+2 (South African Standard Time) datetimes the database stores into
+each tenant's display time zone, with cached zones and format strings and column-at-a-time helpers
 """
 
+import logging
+import os
 from datetime import datetime, timezone, timedelta
-from flask import current_app
+from functools import lru_cache
+from typing import Iterable, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-# South African Standard Time (GMT+2)
+logger = logging.getLogger(__name__)
+
+# South African Standard Time (GMT+2); naive datetimes in the database are in this zone
 SAST = timezone(timedelta(hours=2))
 
+# Display zone for users without a tenant and for tenants whose zone is unknown
+DEFAULT_TIMEZONE = os.environ.get('WFM_TIMEZONE', 'Africa/Johannesburg')
+
+DEFAULT_DATE_FORMAT = '%Y-%m-%d'
+DEFAULT_TIME_FORMAT = '%H:%M:%S'
+
+# Zones that have been a fixed GMT+2 without daylight saving for decades; stored values
+# already are wall-clock time there, so conversion is skipped entirely
+SAST_ZONE_NAMES = {'Africa/Johannesburg', 'Africa/Maseru', 'Africa/Mbabane', 'Etc/GMT-2', 'SAST'}
+
+
+@lru_cache(maxsize=128)
+def get_tzinfo(name: Optional[str]):
+    """tzinfo for an IANA zone name; unknown names fall back to SAST"""
+    if not name or name in SAST_ZONE_NAMES:
+        return SAST
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        logger.warning(f"Unknown time zone {name!r}, using SAST")
+        return SAST
+
+
+class TimezoneService:
+    """Converts stored datetimes to one display zone and formats them with one set of format strings"""
+
+    def __init__(self, tz=SAST, date_format: str = DEFAULT_DATE_FORMAT, time_format: str = DEFAULT_TIME_FORMAT):
+        self.tz = tz
+        self.date_format = date_format or DEFAULT_DATE_FORMAT
+        self.time_format = time_format or DEFAULT_TIME_FORMAT
+        self.datetime_format = f'{self.date_format} {self.time_format}'
+        self.is_storage_zone = tz is SAST
+
+    def to_display(self, dt):
+        """Wall-clock display time for a stored (naive SAST) or aware datetime; dates and times pass through"""
+        if not isinstance(dt, datetime):
+            return dt
+        if dt.tzinfo is None:
+            if self.is_storage_zone:
+                return dt
+            dt = dt.replace(tzinfo=SAST)
+        return dt.astimezone(self.tz).replace(tzinfo=None)
+
+    def format(self, value, format_string: str) -> str:
+        if value is None:
+            return ''
+        return self.to_display(value).strftime(format_string)
+
+    def format_datetime(self, value, format_string: Optional[str] = None) -> str:
+        return self.format(value, format_string or self.datetime_format)
+
+    def format_date(self, value, format_string: Optional[str] = None) -> str:
+        return self.format(value, format_string or self.date_format)
+
+    def format_time(self, value, format_string: Optional[str] = None) -> str:
+        return self.format(value, format_string or self.time_format)
+
+    def convert_column(self, values: Iterable) -> List:
+        """Display times for a whole result column; None stays None"""
+        values = list(values)
+        if self.is_storage_zone and all(v is None or not isinstance(v, datetime) or v.tzinfo is None
+                                        for v in values):
+            return values
+        return [None if v is None else self.to_display(v) for v in values]
+
+    def format_column(self, values: Iterable, format_string: str, converted: bool = False) -> List[str]:
+        """Format a whole result column, formatting each distinct value once.
+
+        Pass converted=True for values that already came out of convert_column.
+        """
+        values = list(values) if converted else self.convert_column(values)
+        formatted = {None: ''}
+        result = []
+        for value in values:
+            text = formatted.get(value)
+            if text is None:
+                text = formatted[value] = value.strftime(format_string)
+            result.append(text)
+        return result
+
+
+@lru_cache(maxsize=256)
+def get_timezone_service(tz_name: Optional[str] = DEFAULT_TIMEZONE, date_format: Optional[str] = DEFAULT_DATE_FORMAT,
+                         time_format: Optional[str] = DEFAULT_TIME_FORMAT) -> TimezoneService:
+    """Shared service for a zone and format combination"""
+    return TimezoneService(get_tzinfo(tz_name or DEFAULT_TIMEZONE), date_format, time_format)
+
+
+def tenant_timezone_service(tenant_id: Optional[int]) -> TimezoneService:
+    """Service for a tenant's configured zone and formats, or the default for no tenant"""
+    if tenant_id:
+        from tenant_cache import get_tenant_context
+        context = get_tenant_context(tenant_id)
+        if context is not None:
+            tenant = context.tenant
+            return get_timezone_service(tenant.timezone, tenant.date_format, tenant.time_format)
+    return get_timezone_service()
+
+
+def current_timezone_service() -> TimezoneService:
+    """Service for the tenant the current request or job is scoped to, resolved once per request"""
+    from flask import g, has_request_context
+    from tenant_scope import current_tenant_id
+
+    if not has_request_context():
+        return tenant_timezone_service(current_tenant_id())
+    service = g.get('timezone_service')
+    if service is None:
+        service = g.timezone_service = tenant_timezone_service(current_tenant_id())
+    return service
+
+
 def get_current_time():
-    """Get current time in South African timezone (GMT+2)"""
-    # Return timezone-naive datetime adjusted for GMT+2
-    utc_now = datetime.utcnow()
-    sast_time = utc_now + timedelta(hours=2)
-    return sast_time
+    """Get current time in South African timezone (GMT+2), naive like the stored values"""
+    return datetime.now(SAST).replace(tzinfo=None)
 
 def localize_datetime(dt):
     """Convert a naive datetime to South African timezone"""
@@ -22,35 +138,17 @@ def localize_datetime(dt):
         return dt.replace(tzinfo=SAST)
     return dt.astimezone(SAST)
 
-def format_datetime(dt, format_string='%Y-%m-%d %H:%M:%S'):
-    """Format datetime in South African timezone"""
-    if dt is None:
-        return ''
-    
-    # Assume stored datetime is already in GMT+2 (SAST)
-    if dt.tzinfo is None:
-        # Add 2 hours if stored as UTC
-        if hasattr(dt, '_is_utc') and dt._is_utc:
-            dt = dt + timedelta(hours=2)
-    else:
-        dt = dt.astimezone(SAST)
-    return dt.strftime(format_string)
-
-def format_date(dt, format_string='%Y-%m-%d'):
-    """Format date in South African timezone"""
-    if dt.tzinfo is None:
-        dt = localize_datetime(dt)
-    else:
-        dt = dt.astimezone(SAST)
-    return dt.strftime(format_string)
+def format_datetime(dt, format_string=None):
+    """Format datetime in the current tenant's time zone"""
+    return current_timezone_service().format_datetime(dt, format_string)
 
-def format_time(dt, format_string='%H:%M:%S'):
-    """Format time in South African timezone"""
-    if dt.tzinfo is None:
-        dt = localize_datetime(dt)
-    else:
-        dt = dt.astimezone(SAST)
-    return dt.strftime(format_string)
+def format_date(dt, format_string=None):
+    """Format date in the current tenant's time zone"""
+    return current_timezone_service().format_date(dt, format_string)
+
+def format_time(dt, format_string=None):
+    """Format time in the current tenant's time zone"""
+    return current_timezone_service().format_time(dt, format_string)
 
 def to_utc(dt):
     """Convert South African time to UTC"""
@@ -65,14 +163,14 @@ def from_utc(dt):
     return dt.astimezone(SAST)
 
 # Template filters for Jinja2
-def datetime_filter(dt):
+def datetime_filter(dt, format_string=None):
     """Jinja2 filter for datetime formatting"""
-    return format_datetime(dt)
+    return format_datetime(dt, format_string)
 
-def date_filter(dt):
+def date_filter(dt, format_string=None):
     """Jinja2 filter for date formatting"""
-    return format_date(dt)
+    return format_date(dt, format_string)
 
-def time_filter(dt):
+def time_filter(dt, format_string=None):
     """Jinja2 filter for time formatting"""
-    return format_time(dt)
\ No newline at end of file
+    return format_time(dt, format_string)
@@ -0,0 +1,91 @@
+"""
+User Cache
+Per-request user loading with roles and department in one query, cached briefly per process
+"""
+
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, joinedload
+
+from app import db
+from models import Department, Role, User
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a signed-in user's identity may be served from memory; 0 disables the cache.
+# Also the upper bound on how long another worker process can serve a stale identity.
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', '30'))
+
+_user_cache = TTLCache(ttl=USER_CACHE_TTL, max_entries=4096)
+
+
+def _identity_query(user_id: int):
+    """User with roles and department joined in, so role checks and templates need no further queries"""
+    return (
+        db.select(User)
+        .options(joinedload(User.roles), joinedload(User.employee_department))
+        .where(User.id == user_id)
+    )
+
+
+def _load_identity(user_id: int) -> Optional[User]:
+    """Read the user in a private session, so the cached instance stays detached and fully loaded"""
+    with Session(db.engine, expire_on_commit=False) as session:
+        return session.execute(_identity_query(user_id)).unique().scalar_one_or_none()
+
+
+def load_identity(user_id: int) -> Optional[User]:
+    """The user behind a session cookie, attached to the current session.
+
+    Cached users are merged in without a query; with the cache disabled the
+    user, roles and department still arrive in a single query.
+    """
+    if USER_CACHE_TTL <= 0:
+        return db.session.execute(_identity_query(user_id)).unique().scalar_one_or_none()
+
+    user = _user_cache.get_or_set(
+        user_id,
+        lambda: _load_identity(user_id),
+        cache_if=lambda loaded: loaded is not None
+    )
+    if user is None:
+        return None
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user_id: int):
+    _user_cache.delete(user_id)
+
+
+def invalidate_all_users():
+    _user_cache.clear()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    """Remember users whose profile or roles this flush changed"""
+    info = session.info
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, User):
+            info.setdefault('changed_user_ids', set()).add(obj.id)
+        elif isinstance(obj, (Role, Department)):
+            # Renamed roles or departments, or role membership edited from the role side
+            info['users_changed_broadly'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    if session.info.pop('users_changed_broadly', False):
+        invalidate_all_users()
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_changed_users(session):
+    session.info.pop('users_changed_broadly', None)
+    session.info.pop('changed_user_ids', None)